@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Compare throughput of the sync views under gunicorn (WSGI, sync workers)
+with the async views under uvicorn (ASGI) at increasing concurrency.
+
+Usage:
+    python benchmarks/asgi_vs_wsgi.py --workers 3 --concurrency 10 50 200 --duration 10
+
+Each run seeds a fresh SQLite database with one ongoing election and a pool
+of logged-in voters, then replays a mix of home, election detail, status API
+and vote requests. Requires gunicorn and uvicorn to be installed.
+"""
+import argparse
+import json
+import sys
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import CSRF_TOKEN, run_load, run_server, session_cookie, setup_django, summarize  # noqa: E402
+
+SERVERS = {
+    # label: (server kind, extra environment)
+    'wsgi (gunicorn sync)': ('gunicorn', {'DJANGO_ASYNC_VIEWS': 'False'}),
+    'asgi (uvicorn)': ('uvicorn', {'DJANGO_ASYNC_VIEWS': 'True'}),
+}
+
+
+def seed(voters):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from voting_app.models import Candidate, Election
+
+    admin = User.objects.create_user('bench-admin', is_staff=True)
+    now = timezone.now()
+    election = Election.objects.create(
+        title='Benchmark Election',
+        description='Load test election',
+        start_time=now - timedelta(hours=1),
+        end_time=now + timedelta(days=1),
+        is_active=True,
+        created_by=admin
+    )
+    candidates = [Candidate.objects.create(election=election, name=f'Candidate {i}') for i in range(3)]
+    cookies = [
+        session_cookie(User.objects.create_user(f'bench-voter-{i}'))
+        for i in range(voters)
+    ]
+    return election, candidates, cookies
+
+
+def request_mix(election, candidates, cookies):
+    detail = f'/elections/{election.id}/'
+    status = f'/api/elections/{election.id}/status/'
+    vote = f'/elections/{election.id}/vote/'
+
+    def make_request(worker, iteration):
+        cookie = cookies[(worker * 7919 + iteration) % len(cookies)]
+        headers = {'Cookie': cookie}
+        step = iteration % 4
+        if step == 0:
+            return 'GET', '/', None, {}
+        if step == 1:
+            return 'GET', detail, None, headers
+        if step == 2:
+            return 'GET', status, None, headers
+        candidate = candidates[iteration % len(candidates)]
+        headers.update({
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-CSRFToken': CSRF_TOKEN,
+            'Referer': 'http://127.0.0.1/',
+        })
+        return 'POST', vote, f'candidate={candidate.id}', headers
+
+    return make_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run")
+    parser.add_argument('--voters', type=int, default=500)
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+        election, candidates, cookies = seed(args.voters)
+        make_request = request_mix(election, candidates, cookies)
+
+        for label, (kind, env) in SERVERS.items():
+            with run_server(kind, workers=args.workers, env=env) as address:
+                for concurrency in args.concurrency:
+                    summary = summarize(*run_load(address, make_request, concurrency, args.duration))
+                    summary.update(server=label, concurrency=concurrency, workers=args.workers)
+                    results.append(summary)
+                    print(
+                        f"{label:24} c={concurrency:<4} {summary['throughput']:>8} req/s  "
+                        f"p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms "
+                        f"errors={summary['errors']}"
+                    )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
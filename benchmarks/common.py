@@ -0,0 +1,170 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The scripts run against a throw-away SQLite database (DJANGO_SQLITE_PATH),
+start the application under a real server (gunicorn or uvicorn) in a
+subprocess and drive it over HTTP with a pool of keep-alive client threads.
+"""
+import http.client
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Any 32-character alphanumeric value is a valid CSRF secret; sending it as
+# both cookie and header satisfies CsrfViewMiddleware.
+CSRF_TOKEN = secrets.token_hex(16)
+
+SERVER_COMMANDS = {
+    'gunicorn': ['gunicorn', 'online_voting_system.wsgi:application', '--workers', '{workers}',
+                 '--bind', '127.0.0.1:{port}', '--log-level', 'warning'],
+    'gunicorn-uvicorn': ['gunicorn', 'online_voting_system.asgi:application', '--workers', '{workers}',
+                         '--worker-class', 'uvicorn.workers.UvicornWorker',
+                         '--bind', '127.0.0.1:{port}', '--log-level', 'warning'],
+    'uvicorn': ['uvicorn', 'online_voting_system.asgi:application', '--workers', '{workers}',
+                '--port', '{port}', '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def setup_django(db_path=None):
+    """Point Django at a benchmark database (SQLite file, or BENCHMARK_DATABASE_URL) and set it up"""
+    if db_path is not None:
+        os.environ['DJANGO_SQLITE_PATH'] = str(db_path)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    sys.path.insert(0, str(BASE_DIR))
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def session_cookie(user):
+    """Create a logged-in session for a user and return its cookie header value"""
+    from importlib import import_module
+
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+
+    # With SESSION_STORE = 'cache' the server needs a cache shared with this process (REDIS_URL)
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}; csrftoken={CSRF_TOKEN}'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def run_server(kind, workers=3, env=None):
+    """Start the app under gunicorn/uvicorn and yield (host, port) once it accepts requests"""
+    port = free_port()
+    command = [part.format(workers=workers, port=port) for part in SERVER_COMMANDS[kind]]
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=dict(os.environ, **(env or {})))
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{kind} did not start (exit code {process.poll()})")
+                time.sleep(0.2)
+        yield '127.0.0.1', port
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_load(address, make_request, concurrency, duration):
+    """
+    Drive the server from `concurrency` keep-alive client threads for `duration` seconds.
+
+    make_request(worker, iteration) returns (method, path, body, headers).
+    Returns (latencies in seconds, error count, elapsed seconds, query counts);
+    query counts come from the X-Query-Count header (REQUEST_METRICS_HEADERS in
+    benchmarks.settings).
+    """
+    host, port = address
+    latencies = []
+    queries = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        local_latencies = []
+        local_queries = []
+        local_errors = 0
+        iteration = 0
+        while time.monotonic() < deadline:
+            method, path, body, headers = make_request(index, iteration)
+            iteration += 1
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    local_errors += 1
+                query_count = response.getheader('X-Query-Count')
+                if query_count is not None:
+                    local_queries.append(int(query_count))
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=30)
+                continue
+            local_latencies.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.monotonic() - started, queries
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed, queries=()):
+    """Throughput, latency percentiles (milliseconds) and queries per request of a load run"""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
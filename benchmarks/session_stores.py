@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Database queries and writes of the vote flow per session and message store.
+
+Usage:
+    python benchmarks/session_stores.py --voters 20 --elections 4
+
+Seeds a fresh SQLite database with generate_scale_data and, for every
+configuration below, logs voters in and has each of them vote in every
+ongoing election, following the redirect to the election page (which shows
+and consumes the flash message) as a browser does. Requests go through the
+Django test client in this process, so the cache-based session stores work
+with the local-memory cache. Queries and writes are counted server-side by
+the request metrics middleware (X-Query-Count, X-DB-Writes).
+
+Reports, per configuration and step, the average SQL queries, writes and
+wall time, and writes per vote (POST plus redirect). Writes the run to
+benchmarks/results/ as JSON.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import BASE_DIR, setup_django  # noqa: E402
+
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+
+MESSAGES = 'django.contrib.messages.storage.'
+
+CONFIGS = {
+    # label: (SESSION_ENGINE, MESSAGE_STORAGE)
+    'db + fallback messages': ('django.contrib.sessions.backends.db', MESSAGES + 'fallback.FallbackStorage'),
+    'db + session messages': ('django.contrib.sessions.backends.db', MESSAGES + 'session.SessionStorage'),
+    'db + cookie messages': ('django.contrib.sessions.backends.db', MESSAGES + 'cookie.CookieStorage'),
+    'cached_db + cookie messages': ('django.contrib.sessions.backends.cached_db', MESSAGES + 'cookie.CookieStorage'),
+    'cache + cookie messages': ('django.contrib.sessions.backends.cache', MESSAGES + 'cookie.CookieStorage'),
+}
+
+STEPS = ('login', 'cast_vote', 'vote_redirect')
+
+PREFIX = 'sessions'
+PASSWORD = 'bench-Pass-2025'
+
+
+def seed(args):
+    from django.core.management import call_command
+    from voting_app.models import Candidate, Election
+
+    call_command(
+        'generate_scale_data', users=args.voters * len(CONFIGS), elections=args.elections * 2,
+        candidates=3, turnout=0, password=PASSWORD, prefix=PREFIX, verbosity=0,
+    )
+    elections = [
+        election for election in Election.objects.filter(title__startswith=f'{PREFIX} election ')
+        if election.is_ongoing
+    ][:args.elections]
+    candidates = {
+        election.id: Candidate.objects.filter(election=election).values_list('id', flat=True).first()
+        for election in elections
+    }
+    return candidates
+
+
+def measure(client, step, totals, method, path, data=None):
+    started = time.perf_counter()
+    response = getattr(client, method)(path, data or {})
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise SystemExit(f"{method.upper()} {path} returned {response.status_code}")
+    entry = totals[step]
+    entry['requests'] += 1
+    entry['queries'] += int(response['X-Query-Count'])
+    entry['writes'] += int(response['X-DB-Writes'])
+    entry['seconds'] += elapsed
+    return response
+
+
+def run(label, usernames, candidates):
+    from django.test import Client, override_settings
+
+    session_engine, message_storage = CONFIGS[label]
+    totals = {step: {'requests': 0, 'queries': 0, 'writes': 0, 'seconds': 0.0} for step in STEPS}
+    with override_settings(SESSION_ENGINE=session_engine, MESSAGE_STORAGE=message_storage):
+        for username in usernames:
+            # A new client per voter also means a new handler, built with this SESSION_ENGINE
+            client = Client()
+            measure(client, 'login', totals, 'post', '/login/', {'username': username, 'password': PASSWORD})
+            for election_id, candidate_id in candidates.items():
+                response = measure(
+                    client, 'cast_vote', totals, 'post', f'/elections/{election_id}/vote/', {'candidate': candidate_id}
+                )
+                measure(client, 'vote_redirect', totals, 'get', response['Location'])
+
+    summary = {'config': label, 'session_engine': session_engine, 'message_storage': message_storage}
+    for step, entry in totals.items():
+        requests = entry['requests'] or 1
+        summary[step] = {
+            'requests': entry['requests'],
+            'queries': round(entry['queries'] / requests, 2),
+            'writes': round(entry['writes'] / requests, 2),
+            'ms': round(entry['seconds'] / requests * 1000, 2),
+        }
+    summary['writes_per_vote'] = round(summary['cast_vote']['writes'] + summary['vote_redirect']['writes'], 2)
+    summary['queries_per_vote'] = round(summary['cast_vote']['queries'] + summary['vote_redirect']['queries'], 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--voters', type=int, default=20, help="Voters per configuration")
+    parser.add_argument('--elections', type=int, default=4, help="Ongoing elections each voter votes in")
+    parser.add_argument('--config', nargs='+', choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument('--output', help="JSON file (default: benchmarks/results/session-stores-<time>.json)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+        from django.test import override_settings
+        from voting_app.audit import get_audit_buffer
+
+        # Measure sessions, not PBKDF2: voters get (and log in with) a fast hash
+        override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']).enable()
+        candidates = seed(args)
+        if not candidates:
+            raise SystemExit("No ongoing elections were generated; raise --elections.")
+
+        print(f"{'configuration':30} {'login q/w':>10} {'vote q/w':>10} {'redirect q/w':>13} {'writes/vote':>12} {'ms/vote':>8}")
+        for index, label in enumerate(CONFIGS):
+            if label not in args.config:
+                continue
+            usernames = [f'{PREFIX}-voter-{n}' for n in range(index * args.voters, (index + 1) * args.voters)]
+            summary = run(label, usernames, candidates)
+            results.append(summary)
+            login, vote, redirect = summary['login'], summary['cast_vote'], summary['vote_redirect']
+            print(
+                f"{label:30} {login['queries']:>4}/{login['writes']:<5} {vote['queries']:>4}/{vote['writes']:<5} "
+                f"{redirect['queries']:>6}/{redirect['writes']:<6} {summary['writes_per_vote']:>12} "
+                f"{vote['ms'] + redirect['ms']:>8.2f}"
+            )
+        # Write queued audit entries while the database still exists
+        get_audit_buffer().flush()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"session-stores-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({'options': vars(args), 'results': results}, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
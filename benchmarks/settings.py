@@ -0,0 +1,28 @@
+"""
+Settings for benchmark runs: the development settings with DEBUG off and the
+request metrics reported in response headers (X-Query-Count, Server-Timing).
+BENCHMARK_DATABASE_URL switches them to a PostgreSQL database.
+"""
+import os
+
+from online_voting_system.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+REQUEST_METRICS_HEADERS = True
+
+# Slow-request warnings go to the servers' stderr; under load only flag outliers
+REQUEST_SLOW_THRESHOLD_MS = 1000
+
+# Load generators send everything from one address and a handful of accounts,
+# which the rate limits would turn away; BENCHMARK_ADMISSION_CONTROL=1 keeps them
+ADMISSION_CONTROL_ENABLED = os.environ.get('BENCHMARK_ADMISSION_CONTROL') == '1'
+
+# Run against PostgreSQL instead of the throw-away SQLite database, with the
+# pool settings of the deployment profiles (DB_POOL, DB_POOL_MAX_SIZE, ...)
+if os.environ.get('BENCHMARK_DATABASE_URL'):
+    import dj_database_url
+
+    from online_voting_system.database import configure_postgres
+
+    DATABASES = {'default': configure_postgres(dj_database_url.parse(os.environ['BENCHMARK_DATABASE_URL']))}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Parallel voters against SQLite, per connection profile.
+
+Usage:
+    python benchmarks/sqlite_concurrency.py --voters 400 --processes 8
+
+For every profile in settings.SQLITE_PROFILES ('default': SQLite's own
+journal and locking, 'concurrent': WAL, synchronous=NORMAL, BEGIN IMMEDIATE
+and a busy timeout) a fresh database is seeded with generate_scale_data and
+--processes forked workers cast every voter's ballot in every ongoing
+election through voting.cast_ballot, each vote followed by a read of the
+election's tallies (what the results page does). Workers start together.
+With --atomic each vote runs in one transaction that reads before it writes,
+as under ATOMIC_REQUESTS: a deferred transaction then has to upgrade its read
+lock, which fails at once ("database is locked") when another connection
+holds the write lock, whatever the busy timeout.
+
+Reports per profile the votes recorded, "database is locked" errors (and
+other OperationalErrors), votes per second and the gain of each profile
+over 'default'. Exits with status 1 if the 'concurrent' profile saw any
+lock errors or lost a vote, so the script doubles as a stress test. Writes
+the run to benchmarks/results/ as JSON.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import BASE_DIR, setup_django  # noqa: E402
+
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+
+PREFIX = 'sqlite'
+
+
+def seed(args):
+    from django.core.management import call_command
+    from voting_app.models import Candidate, Election
+
+    call_command(
+        'generate_scale_data', users=args.voters, elections=args.elections * 2,
+        candidates=3, turnout=0, prefix=PREFIX, verbosity=0,
+    )
+    elections = [
+        election for election in Election.objects.filter(title__startswith=f'{PREFIX} election ')
+        if election.is_ongoing
+    ][:args.elections]
+    return {
+        election.id: list(Candidate.objects.filter(election=election).values_list('id', flat=True))
+        for election in elections
+    }
+
+
+def vote(index, voter_ids, candidates, atomic, start, results):
+    """Worker process: cast the ballots of its voters, counting lock errors"""
+    from contextlib import nullcontext
+
+    from django.contrib.auth.models import User
+    from django.db import OperationalError, transaction
+    from django.db.models import Sum
+    from voting_app.models import VoteTally
+    from voting_app.voting import VoteRejected, cast_ballot
+
+    counts = {'votes': 0, 'rejected': 0, 'locked': 0, 'other_errors': 0}
+    users = list(User.objects.filter(pk__in=voter_ids))
+    start.wait()
+    for user in users:
+        for election_id, candidate_ids in candidates.items():
+            try:
+                with transaction.atomic() if atomic else nullcontext():
+                    cast_ballot(user, election_id, candidate_ids[user.pk % len(candidate_ids)])
+                VoteTally.objects.filter(election_id=election_id).aggregate(total=Sum('votes'))
+                counts['votes'] += 1
+            except VoteRejected:
+                counts['rejected'] += 1
+            except OperationalError as e:
+                counts['locked' if 'locked' in str(e) else 'other_errors'] += 1
+    results.put(counts)
+
+
+def run_profile(args):
+    """Seed a database for DJANGO_SQLITE_PROFILE and time the parallel voters (child process)"""
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+        from django.contrib.auth.models import User
+        from django.db import connection, connections
+        from voting_app.models import Vote
+
+        candidates = seed(args)
+        if not candidates:
+            raise SystemExit("No ongoing elections were generated; raise --elections.")
+        voter_ids = list(User.objects.filter(username__startswith=f'{PREFIX}-').values_list('pk', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        # Children must open their own connections
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        start = context.Event()
+        results = context.Queue()
+        workers = [
+            context.Process(
+                target=vote, args=(index, voter_ids[index::args.processes], candidates, args.atomic, start, results),
+            )
+            for index in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.5)
+        started = time.perf_counter()
+        start.set()
+        totals = {'votes': 0, 'rejected': 0, 'locked': 0, 'other_errors': 0}
+        for _ in workers:
+            for key, value in results.get().items():
+                totals[key] += value
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        recorded = Vote.objects.filter(election_id__in=candidates).count()
+        attempted = len(voter_ids) * len(candidates)
+
+    return dict(
+        totals,
+        journal_mode=journal_mode,
+        attempted=attempted,
+        recorded=recorded,
+        seconds=round(elapsed, 3),
+        votes_per_second=round(totals['votes'] / elapsed, 1) if elapsed else 0.0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--voters', type=int, default=400)
+    parser.add_argument('--elections', type=int, default=2, help="Ongoing elections each voter votes in")
+    parser.add_argument('--processes', type=int, default=8, help="Parallel voter processes")
+    parser.add_argument('--atomic', action='store_true', help="Cast each vote in one read-then-write transaction")
+    parser.add_argument('--profile', nargs='+', default=['default', 'concurrent'])
+    parser.add_argument('--output', help="JSON file (default: benchmarks/results/sqlite-concurrency-<time>.json)")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # The profile is read when the settings load, so each one runs in its own interpreter
+        print(json.dumps(run_profile(args)))
+        return
+
+    command = [
+        sys.executable, __file__, '--child', '--voters', str(args.voters),
+        '--elections', str(args.elections), '--processes', str(args.processes),
+    ] + (['--atomic'] if args.atomic else [])
+    results = {}
+    print(f"{'profile':12} {'journal':8} {'votes':>7} {'recorded':>9} {'locked':>7} {'other':>6} {'votes/s':>8} {'gain':>6}")
+    for profile in args.profile:
+        output = subprocess.run(
+            command, env=dict(os.environ, DJANGO_SQLITE_PROFILE=profile),
+            check=True, capture_output=True, text=True,
+        ).stdout
+        summary = results[profile] = json.loads(output.strip().splitlines()[-1])
+        baseline = results.get('default')
+        gain = summary['votes_per_second'] / baseline['votes_per_second'] if baseline and baseline['votes_per_second'] else None
+        summary['gain'] = round(gain, 2) if gain else None
+        print(
+            f"{profile:12} {summary['journal_mode']:8} {summary['votes']:>7} {summary['recorded']:>9} "
+            f"{summary['locked']:>7} {summary['other_errors']:>6} {summary['votes_per_second']:>8} "
+            f"{(f'{gain:.2f}x' if gain else '-'):>6}"
+        )
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"sqlite-concurrency-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({'options': vars(args), 'results': results}, indent=2))
+    print(f"\nResults written to {output}")
+
+    concurrent = results.get('concurrent')
+    if concurrent and (concurrent['locked'] or concurrent['other_errors'] or concurrent['recorded'] != concurrent['attempted']):
+        raise SystemExit("The concurrent profile lost votes or hit lock errors.")
+
+
+if __name__ == '__main__':
+    main()
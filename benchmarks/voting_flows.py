@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Load test of the main voting flows against a locally started server.
+
+Usage:
+    python benchmarks/voting_flows.py --server gunicorn uvicorn --workers 3 \\
+        --concurrency 10 50 --duration 10 --users 5000 --elections 8
+
+Seeds a fresh SQLite database with generate_scale_data, then drives each
+flow (register, login, home, election_detail, cast_vote, election_results,
+api_election_status) on its own for --duration seconds per server and
+concurrency level. Reports throughput, p50/p95/p99 latency and SQL queries
+per request (counted server-side by benchmarks.settings), and writes the
+run to benchmarks/results/ as JSON. Pass --compare with an earlier file to
+print the change in throughput and p95 latency.
+
+cast_vote cycles through the logged-in voters and the ongoing elections;
+once a voter has voted in an election (or was among the generated turnout)
+the request takes the "already voted" path, as repeat submissions do in
+production.
+"""
+import argparse
+import json
+import os
+import platform
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import django
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import (  # noqa: E402
+    BASE_DIR, CSRF_TOKEN, run_load, run_server, session_cookie, setup_django, summarize,
+)
+
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+
+SCENARIOS = (
+    'register', 'login', 'home', 'election_detail', 'cast_vote', 'election_results', 'api_election_status',
+)
+
+SERVERS = {
+    # name: extra environment
+    'gunicorn': {'DJANGO_ASYNC_VIEWS': 'False'},
+    'gunicorn-uvicorn': {'DJANGO_ASYNC_VIEWS': 'True'},
+    'uvicorn': {'DJANGO_ASYNC_VIEWS': 'True'},
+}
+
+PREFIX = 'bench'
+
+
+def seed(args):
+    """Generate the dataset and collect what the scenarios need"""
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from voting_app.models import Candidate, Election
+
+    call_command(
+        'generate_scale_data',
+        users=args.users, elections=args.elections, candidates=args.candidates,
+        turnout=args.turnout, password=args.password, prefix=PREFIX, seed=args.seed,
+    )
+
+    elections = list(Election.objects.filter(title__startswith=f'{PREFIX} election '))
+    ongoing = [election for election in elections if election.is_ongoing]
+    finished = [election for election in elections if election.is_finished]
+    if not ongoing or not finished:
+        raise SystemExit("Need at least one ongoing and one finished election; raise --elections.")
+
+    candidates = {}
+    for candidate_id, election_id in Candidate.objects.filter(
+        election__in=ongoing
+    ).values_list('id', 'election_id'):
+        candidates.setdefault(election_id, []).append(candidate_id)
+
+    voters = list(User.objects.filter(username__startswith=f'{PREFIX}-voter-').order_by('id')[:args.sessions])
+    return {
+        'ongoing': [election.id for election in ongoing],
+        'finished': [election.id for election in finished],
+        'candidates': candidates,
+        'usernames': [voter.username for voter in voters],
+        'cookies': [session_cookie(voter) for voter in voters],
+    }
+
+
+def form_post(headers, fields):
+    headers = dict(headers, **{
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-CSRFToken': CSRF_TOKEN,
+        'Referer': 'http://127.0.0.1/',
+    })
+    return urlencode(fields), headers
+
+
+def scenario(name, data, password):
+    """Return make_request(worker, iteration) for one flow"""
+    cookies = data['cookies']
+    ongoing = data['ongoing']
+    finished = data['finished']
+    run_id = secrets.token_hex(2)
+
+    def pick(items, worker, iteration):
+        return items[(worker * 7919 + iteration) % len(items)]
+
+    def make_request(worker, iteration):
+        cookie = pick(cookies, worker, iteration)
+        if name == 'register':
+            key = f'{run_id}{worker}x{iteration}'
+            body, headers = form_post({'Cookie': f'csrftoken={CSRF_TOKEN}'}, {
+                'username': f'reg-{key}',
+                'email': f'reg-{key}@example.com',
+                'first_name': 'Load',
+                'last_name': 'Test',
+                'voter_id': f'R{key}',
+                'date_of_birth': '1990-01-01',
+                'password1': password,
+                'password2': password,
+            })
+            return 'POST', '/register/', body, headers
+        if name == 'login':
+            body, headers = form_post({'Cookie': f'csrftoken={CSRF_TOKEN}'}, {
+                'username': pick(data['usernames'], worker, iteration),
+                'password': password,
+            })
+            return 'POST', '/login/', body, headers
+        if name == 'home':
+            return 'GET', '/', None, {}
+        if name == 'election_detail':
+            return 'GET', f'/elections/{pick(ongoing, worker, iteration)}/', None, {'Cookie': cookie}
+        if name == 'api_election_status':
+            return 'GET', f'/api/elections/{pick(ongoing, worker, iteration)}/status/', None, {'Cookie': cookie}
+        if name == 'election_results':
+            return 'GET', f'/elections/{pick(finished, worker, iteration)}/results/', None, {'Cookie': cookie}
+        if name == 'cast_vote':
+            # Walk voters first, then elections, so pairs repeat as late as possible
+            index = worker * 7919 + iteration
+            election_id = ongoing[(index // len(cookies)) % len(ongoing)]
+            candidate_id = pick(data['candidates'][election_id], worker, iteration)
+            body, headers = form_post({'Cookie': cookies[index % len(cookies)]}, {'candidate': candidate_id})
+            return 'POST', f'/elections/{election_id}/vote/', body, headers
+        raise ValueError(name)
+
+    return make_request
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    previous = {
+        (row['server'], row['scenario'], row['concurrency']): row
+        for row in json.loads(Path(previous_path).read_text())['results']
+    }
+    print(f"\nChange against {previous_path}:")
+    for row in results:
+        before = previous.get((row['server'], row['scenario'], row['concurrency']))
+        if before is None or not before['throughput'] or not before['p95_ms']:
+            continue
+        throughput = (row['throughput'] / before['throughput'] - 1) * 100
+        p95 = (row['p95_ms'] / before['p95_ms'] - 1) * 100
+        print(f"{row['server']:16} {row['scenario']:20} c={row['concurrency']:<4} "
+              f"throughput {throughput:+6.1f}%  p95 {p95:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', nargs='+', choices=sorted(SERVERS), default=['gunicorn'])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per flow")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--elections', type=int, default=8)
+    parser.add_argument('--candidates', type=int, default=4)
+    parser.add_argument('--turnout', type=float, default=0.3)
+    parser.add_argument('--sessions', type=int, default=500, help="Logged-in voters used by the clients")
+    parser.add_argument('--password', default='bench-Pass-2025')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file (default: benchmarks/results/voting-flows-<time>.json)")
+    parser.add_argument('--compare', help="Earlier JSON results to compare with")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(Path(tmp) / 'bench.sqlite3')
+        started = time.monotonic()
+        data = seed(args)
+        print(f"Seeded in {time.monotonic() - started:.1f}s")
+
+        for server in args.server:
+            with run_server(server, workers=args.workers, env=SERVERS[server]) as address:
+                for name in args.scenario:
+                    make_request = scenario(name, data, args.password)
+                    for concurrency in args.concurrency:
+                        summary = summarize(*run_load(address, make_request, concurrency, args.duration))
+                        summary.update(server=server, scenario=name, concurrency=concurrency, workers=args.workers)
+                        results.append(summary)
+                        print(
+                            f"{server:16} {name:20} c={concurrency:<4} {summary['throughput']:>8} req/s  "
+                            f"p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms "
+                            f"queries={summary['queries_per_request']} errors={summary['errors']}"
+                        )
+
+    run = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'cpus': os.cpu_count(),
+        'options': vars(args),
+        'results': results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"voting-flows-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
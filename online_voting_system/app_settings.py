@@ -0,0 +1,147 @@
+"""
+Settings of the voting app's features, shared by the settings profiles.
+
+settings.py and settings_heroku.py (and the profiles built on them) import
+everything from here after their Django settings; a profile that needs a
+different value overrides it after the import. Values that deployments tune
+are read from the environment (or .env) with decouple.
+"""
+from pathlib import Path
+
+from decouple import config
+
+# Audit logging: entries are batched off the request path and journaled to
+# disk until written (see voting_app/audit.py)
+AUDIT_LOG_ASYNC = True
+AUDIT_LOG_BATCH_SIZE = 100
+AUDIT_LOG_BUFFER_SIZE = 10000
+AUDIT_LOG_FLUSH_INTERVAL = 1.0
+AUDIT_LOG_SPOOL_DIR = Path(__file__).resolve().parent.parent / 'audit_spool'
+
+# Home page caching: sections are cached until the next election start/end
+# (at most HOME_CACHE_MAX_TTL seconds); vote totals refresh every
+# HOME_VOTE_TOTALS_TTL seconds
+HOME_CACHE_MAX_TTL = 60
+HOME_VOTE_TOTALS_TTL = 10
+
+# Live status stream (Server-Sent Events, ASGI only): seconds between status
+# recomputations and between heartbeats on idle connections
+LIVE_STATUS_INTERVAL = 2.0
+LIVE_STATUS_HEARTBEAT = 15.0
+
+# Route the high-traffic views to their async implementations (ASGI only).
+# online_voting_system/asgi.py turns this on by default.
+ASYNC_VIEWS = config('DJANGO_ASYNC_VIEWS', default=False, cast=bool)
+
+# Vote/audit exports: rows fetched per database round trip (server-side
+# cursor on PostgreSQL)
+EXPORT_CHUNK_SIZE = 2000
+
+# Candidate photos: JPEG/WebP variants (longest side in pixels) rendered by a
+# background thread when a photo changes (see voting_app/photos.py)
+CANDIDATE_PHOTO_ASYNC = True
+CANDIDATE_PHOTO_SIZES = (96, 192, 384)
+CANDIDATE_PHOTO_QUALITY = 82
+
+# Elections and candidate lists: per-process LRU (ENTITY_CACHE_LOCAL_TTL
+# seconds) in front of the shared cache (ENTITY_CACHE_TTL seconds, capped at
+# ENTITY_CACHE_LOCAL_TTL without REDIS_URL), see voting_app/entity_cache.py
+ENTITY_CACHE_ENABLED = True
+ENTITY_CACHE_TTL = 300
+ENTITY_CACHE_LOCAL_TTL = 5
+ENTITY_CACHE_LOCAL_SIZE = 1000
+
+# Lifecycle scheduler (run_election_scheduler): warm caches this many seconds
+# before an election opens; re-check at least every ELECTION_SCHEDULER_MAX_SLEEP
+ELECTION_WARMUP_LEAD = 300
+ELECTION_SCHEDULER_MAX_SLEEP = 30
+# Results are frozen this many seconds after end_time, once votes in flight have committed
+ELECTION_CLOSE_GRACE = 5
+# Cached results payloads never expire on a shared cache (REDIS_URL); with
+# per-process caches edits reach other workers after this many seconds
+RESULTS_LOCAL_CACHE_TTL = 5
+
+# Cache backends that count hits/misses per request (see voting_app/instrumentation.py).
+# Set REDIS_URL to share the cache between worker processes.
+REDIS_URL = config('REDIS_URL', default=None)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'voting_app.instrumentation.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'voting_app.instrumentation.LocMemCache',
+        },
+    }
+
+# Sessions: 'db' (one query per authenticated request), 'cached_db' (read from
+# the cache, written through to the database) or 'cache' (cache only). The
+# cached modes need a cache shared by all workers (REDIS_URL); with per-process
+# caches a worker could keep serving a session another worker has logged out.
+SESSION_STORE = config('DJANGO_SESSION_STORE', default='cached_db' if REDIS_URL else 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+}[SESSION_STORE]
+
+# Flash messages travel in a signed cookie and never write the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Per-request metrics (voting_app.instrumentation.RequestMetricsMiddleware):
+# requests slower than REQUEST_SLOW_THRESHOLD_MS are logged with their most
+# repeated SQL; histograms cover the last REQUEST_METRICS_WINDOW seconds
+REQUEST_METRICS_ENABLED = True
+REQUEST_SLOW_THRESHOLD_MS = 500
+REQUEST_SLOW_TOP_SQL = 5
+REQUEST_METRICS_WINDOW = 300
+REQUEST_METRICS_HEADERS = False
+
+# Prometheus metrics (GET /metrics): per-process files aggregated at scrape
+# time (see voting_app/metrics.py). Set METRICS_TOKEN to require
+# "Authorization: Bearer <token>".
+METRICS_DIR = config('METRICS_DIR', default='') or None
+METRICS_TOKEN = config('METRICS_TOKEN', default='') or None
+
+# Seconds between two copies of the PostgreSQL connection pool statistics
+# into this process's metrics file (see voting_app/db_pool.py)
+DB_POOL_METRICS_INTERVAL = 5
+
+# With a read replica, a client reads from the primary database for this many
+# seconds after a successful POST, so it sees its own vote (voting_app/routing.py)
+REPLICA_PIN_SECONDS = 10
+
+# Admission control for voting, registration and login POSTs
+# (voting_app/admission.py): token buckets per user and per client IP in the
+# shared cache, and a cap on guarded requests in progress over all workers
+# (counted in the shared cache, whose entry restarts every
+# ADMISSION_IN_FLIGHT_TTL seconds); past the cap requests get 503 with
+# Retry-After instead of queuing.
+ADMISSION_CONTROL_ENABLED = config('ADMISSION_CONTROL_ENABLED', default=True, cast=bool)
+ADMISSION_LIMITS = {
+    'vote': {'user': '10/m', 'ip': '120/m'},
+    'register': {'ip': '10/h'},
+    'login': {'user': '10/m', 'ip': '30/m'},
+}
+ADMISSION_MAX_CONCURRENT = config('ADMISSION_MAX_CONCURRENT', default=32, cast=int)
+ADMISSION_RETRY_AFTER = 1
+ADMISSION_IN_FLIGHT_TTL = 60
+# Proxies that append to X-Forwarded-For in front of the app (nginx.conf: 1);
+# with none, rate limits key on REMOTE_ADDR and ignore the header
+ADMISSION_TRUSTED_PROXIES = config('ADMISSION_TRUSTED_PROXIES', default=0, cast=int)
+# Answered before sessions and the database are touched (load balancer checks)
+ADMISSION_HEALTH_PATH = '/healthz'
+
+# Per-process bitmap of who voted in each election (about 122 KiB per
+# election per million user ids); answers can_vote on the election page and
+# refuses repeat submissions without a query (voting_app/voter_index.py)
+VOTER_INDEX_ENABLED = True
+
+# Vote ledger (voting_app/ledger.py): the scheduler seals new votes into
+# hash-chained blocks of at most LEDGER_BATCH_SIZE every LEDGER_SEAL_INTERVAL seconds
+LEDGER_BATCH_SIZE = 1024
+LEDGER_SEAL_INTERVAL = 10
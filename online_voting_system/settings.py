@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'voting_app.admission.HealthCheckMiddleware',
+    'voting_app.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'voting_app.routing.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'online_voting_system.urls'
@@ -73,13 +77,45 @@ WSGI_APPLICATION = 'online_voting_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite profiles, applied to every new connection. 'concurrent' is meant for
+# several worker processes: WAL lets reads proceed while a vote is written,
+# synchronous=NORMAL is durable enough with WAL and saves an fsync per commit,
+# write transactions start with BEGIN IMMEDIATE so concurrent writers queue on
+# the busy timeout instead of failing a lock upgrade with "database is locked",
+# and reads go through a memory map. 'default' keeps SQLite's own settings.
+SQLITE_PROFILES = {
+    'default': {},
+    'concurrent': {
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,  # busy_timeout, seconds
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA cache_size=-20000;'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+    },
+}
+SQLITE_PROFILE = os.environ.get('DJANGO_SQLITE_PROFILE', 'concurrent')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': SQLITE_PROFILES[SQLITE_PROFILE],
     }
 }
 
+# Optional read replica for the read-only views (see voting_app/routing.py).
+# To try it locally, point DJANGO_REPLICA_SQLITE_PATH at a copy of the
+# database. Tests read the replica's rows from the test database.
+if os.environ.get('DJANGO_REPLICA_SQLITE_PATH'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'], NAME=os.environ['DJANGO_REPLICA_SQLITE_PATH'], TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['voting_app.routing.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,3 +170,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Settings of the voting app's features (audit log, caches, sessions, metrics,
+# admission control, ...), shared by every profile: see app_settings.py
+from .app_settings import *
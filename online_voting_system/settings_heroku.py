@@ -5,6 +5,7 @@ Heroku Production Settings for Django Voting System
 import os
 import dj_database_url
 from decouple import config
+from .database import add_replica, configure_postgres
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 from pathlib import Path
@@ -31,6 +32,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'voting_app.admission.HealthCheckMiddleware',
+    'voting_app.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -39,6 +42,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'voting_app.routing.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'online_voting_system.urls'
@@ -66,6 +70,12 @@ DATABASES = {
         default=config('DATABASE_URL', default='sqlite:///db.sqlite3')
     )
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Connection pool (DB_POOL, or ?pool=true in DATABASE_URL) or persistent
+    # connections with health checks; see online_voting_system/database.py
+    configure_postgres(DATABASES['default'])
+    add_replica(DATABASES)
+DATABASE_ROUTERS = ['voting_app.routing.ReplicaRouter']
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -109,6 +119,13 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
+# Settings of the voting app's features (audit log, caches, sessions, metrics,
+# admission control, ...), shared by every profile: see app_settings.py
+from .app_settings import *
+
+# The Heroku router appends the client address to X-Forwarded-For
+ADMISSION_TRUSTED_PROXIES = config('ADMISSION_TRUSTED_PROXIES', default=1, cast=int)
+
 # Heroku specific settings
 if 'DATABASE_URL' in os.environ:
     # Production settings
@@ -131,6 +148,11 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
             'style': '{',
         },
+        # One JSON object per line
+        'structured': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'console': {
@@ -138,6 +160,11 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose'
         },
+        'requests': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -149,6 +176,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'voting_app.requests': {
+            'handlers': ['requests'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -5,6 +5,7 @@ PostgreSQL Production Settings for Django Voting System
 import os
 from decouple import config
 from .settings import *
+from .database import add_replica, configure_postgres
 
 # Override database configuration for PostgreSQL
 DATABASES = {
@@ -30,9 +31,9 @@ ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='').split(',')
 if config('DATABASE_URL', default=None):
     import dj_database_url
     DATABASES['default'] = dj_database_url.parse(config('DATABASE_URL'))
-    DATABASES['default']['OPTIONS'] = {
-        'sslmode': 'require',
-    }
+    # Keep the URL's query options (pool_*), but always require SSL; OPTIONS
+    # is only there when the URL has a query string
+    DATABASES['default'].setdefault('OPTIONS', {})['sslmode'] = 'require'
 
 # Static files configuration for production
 STATIC_URL = '/static/'
@@ -43,7 +44,10 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
 
 # WhiteNoise for static files serving
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+)
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Email configuration
@@ -67,8 +71,9 @@ SECURE_HSTS_PRELOAD = True
 # SESSION_COOKIE_SECURE = True
 # CSRF_COOKIE_SECURE = True
 
-# Database connection pooling
-DATABASES['default']['CONN_MAX_AGE'] = 60
+# Database connection pooling (DB_POOL) or persistent connections with health checks
+configure_postgres(DATABASES['default'])
+add_replica(DATABASES)
 
 # Logging configuration
 LOGGING = {
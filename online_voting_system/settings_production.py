@@ -4,6 +4,7 @@ Production settings for online_voting_system project.
 import os
 from decouple import config
 from .settings import *
+from .database import add_replica, configure_postgres
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
@@ -25,6 +26,13 @@ DATABASES = {
         'PORT': config('DB_PORT', default='5432'),
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Connection pool (DB_POOL) or persistent connections with health checks
+    configure_postgres(DATABASES['default'])
+    add_replica(DATABASES)
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Single-box deployment: WAL, BEGIN IMMEDIATE, busy timeout (see settings.py)
+    DATABASES['default']['OPTIONS'] = SQLITE_PROFILES[config('DJANGO_SQLITE_PROFILE', default='concurrent')]
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
@@ -36,7 +44,10 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
 
 # WhiteNoise for static files serving
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+)
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Email configuration
@@ -36,10 +36,21 @@ if not DEBUG:
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        # One JSON object per line
+        'structured': {
+            'format': '{message}',
+            'style': '{',
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'requests': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -50,5 +61,10 @@ LOGGING = {
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': False,
         },
+        'voting_app.requests': {
+            'handlers': ['requests'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
@@ -1,10 +1,14 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import UserProfile, Election, Candidate, Vote, AuditLog
+from .models import UserProfile, Election, Candidate, Vote, AuditLog, VoteTally, LedgerBlock
+from . import eligibility
 
 
 # Inline admin for UserProfile
@@ -20,6 +24,7 @@ class CustomUserAdmin(UserAdmin):
     inlines = (UserProfileInline,)
     list_display = ('username', 'email', 'first_name', 'last_name', 'get_voter_id', 'get_is_eligible', 'is_active')
     list_filter = UserAdmin.list_filter + ('userprofile__is_eligible',)
+    list_select_related = ('userprofile',)
     
     def get_voter_id(self, obj):
         try:
@@ -42,24 +47,75 @@ admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
 
 
+class AgeListFilter(admin.SimpleListFilter):
+    """Age brackets as date_of_birth ranges (profile_eligible_dob_idx)"""
+    title = 'age'
+    parameter_name = 'age'
+    # parameter value: (label, minimum age, maximum age or None)
+    BRACKETS = {
+        'under-18': ('Under 18', 0, 17),
+        '18-24': ('18-24', 18, 24),
+        '25-34': ('25-34', 25, 34),
+        '35-49': ('35-49', 35, 49),
+        '50-64': ('50-64', 50, 64),
+        '65+': ('65 and over', 65, None),
+    }
+    
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, (label, _, _) in self.BRACKETS.items()]
+    
+    def queryset(self, request, queryset):
+        if self.value() not in self.BRACKETS:
+            return queryset
+        _, youngest, oldest = self.BRACKETS[self.value()]
+        today = timezone.localdate()
+        queryset = queryset.filter(date_of_birth__lte=eligibility.age_cutoff(today, youngest))
+        if oldest is not None:
+            # Born after the day they would have turned oldest + 1
+            queryset = queryset.filter(date_of_birth__gt=eligibility.age_cutoff(today, oldest + 1))
+        return queryset
+
+
+class EligibleForElectionFilter(admin.SimpleListFilter):
+    """Voters who may vote in an upcoming or ongoing election"""
+    title = 'eligible for election'
+    parameter_name = 'eligible_for'
+    
+    def lookups(self, request, model_admin):
+        elections = Election.objects.filter(is_active=True, end_time__gte=timezone.now()).order_by('start_time')
+        return [(election.pk, election.title) for election in elections]
+    
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        election = Election.objects.filter(pk=self.value()).first()
+        if election is None:
+            return queryset.none()
+        return queryset.filter(eligibility.eligibility_q(election))
+
+
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'voter_id', 'phone_number', 'age', 'is_eligible', 'created_at')
-    list_filter = ('is_eligible', 'created_at')
+    list_filter = ('is_eligible', AgeListFilter, EligibleForElectionFilter, 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email', 'voter_id', 'phone_number')
     readonly_fields = ('created_at', 'age')
     
     def age(self, obj):
         return obj.age
     age.short_description = 'Age'
+    # Youngest first when sorted ascending; sorting stays in SQL
+    age.admin_order_field = '-date_of_birth'
 
 
 @admin.register(Election)
 class ElectionAdmin(admin.ModelAdmin):
     list_display = ('title', 'start_time', 'end_time', 'is_active', 'get_status', 'get_total_votes', 'created_by')
     list_filter = ('is_active', 'start_time', 'end_time', 'created_by')
+    list_select_related = ('created_by',)
     search_fields = ('title', 'description')
-    readonly_fields = ('created_at', 'updated_at', 'get_total_votes', 'get_status')
+    readonly_fields = ('created_at', 'updated_at', 'get_total_votes', 'get_status', 'get_eligible_voters')
     filter_horizontal = ()
     
     fieldsets = (
@@ -69,13 +125,24 @@ class ElectionAdmin(admin.ModelAdmin):
         ('Timing', {
             'fields': ('start_time', 'end_time', 'is_active')
         }),
+        ('Eligibility', {
+            'fields': ('minimum_voter_age', 'get_eligible_voters')
+        }),
         ('Statistics', {
             'fields': ('get_total_votes', 'get_status', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
     
+    def get_queryset(self, request):
+        # Vote totals from the tally store in the changelist query itself
+        return super().get_queryset(request).annotate(
+            _total_votes=Coalesce(Sum('tallies__votes'), 0)
+        )
+    
     def get_status(self, obj):
+        if obj.pk is None:
+            return '-'  # Add form: no schedule yet
         if obj.is_ongoing:
             return format_html('<span style="color: green;">Ongoing</span>')
         elif obj.is_upcoming:
@@ -87,23 +154,35 @@ class ElectionAdmin(admin.ModelAdmin):
     get_status.short_description = 'Status'
     
     def get_total_votes(self, obj):
-        return obj.total_votes
+        return obj._total_votes
     get_total_votes.short_description = 'Total Votes'
+    get_total_votes.admin_order_field = '_total_votes'
+    
+    def get_eligible_voters(self, obj):
+        if obj.pk is None:
+            return '-'
+        url = reverse('admin:voting_app_userprofile_changelist')
+        count = eligibility.eligible_voters(obj).count()
+        return format_html('<a href="{}?eligible_for={}">{}</a>', url, obj.pk, count)
+    get_eligible_voters.short_description = 'Eligible voters'
 
 
 @admin.register(Candidate)
 class CandidateAdmin(admin.ModelAdmin):
     list_display = ('name', 'party', 'election', 'get_vote_count', 'get_vote_percentage', 'created_at')
     list_filter = ('election', 'party', 'created_at')
+    list_select_related = ('election',)
     search_fields = ('name', 'party', 'election__title')
-    readonly_fields = ('created_at', 'get_vote_count', 'get_vote_percentage', 'get_photo_preview')
+    readonly_fields = (
+        'created_at', 'get_vote_count', 'get_vote_percentage', 'get_photo_preview', 'photo_width', 'photo_height'
+    )
     
     fieldsets = (
         (None, {
             'fields': ('election', 'name', 'party')
         }),
         ('Details', {
-            'fields': ('bio', 'photo', 'get_photo_preview')
+            'fields': ('bio', 'photo', 'get_photo_preview', ('photo_width', 'photo_height'))
         }),
         ('Statistics', {
             'fields': ('get_vote_count', 'get_vote_percentage', 'created_at'),
@@ -111,13 +190,31 @@ class CandidateAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Vote count and share of the election total, computed in SQL
+        election_total = VoteTally.objects.filter(
+            election=OuterRef('election')
+        ).values('election').annotate(total=Sum('votes')).values('total')
+        return super().get_queryset(request).annotate(
+            _vote_count=Coalesce(F('tally__votes'), 0),
+            _election_votes=Coalesce(Subquery(election_total), 0),
+        ).annotate(
+            _vote_percentage=Case(
+                When(_election_votes=0, then=Value(0.0)),
+                default=F('_vote_count') * 100.0 / F('_election_votes'),
+                output_field=FloatField(),
+            )
+        )
+    
     def get_vote_count(self, obj):
-        return obj.vote_count
+        return obj._vote_count
     get_vote_count.short_description = 'Votes'
+    get_vote_count.admin_order_field = '_vote_count'
     
     def get_vote_percentage(self, obj):
-        return f"{obj.vote_percentage}%"
+        return f"{round(obj._vote_percentage, 2)}%"
     get_vote_percentage.short_description = 'Vote %'
+    get_vote_percentage.admin_order_field = '_vote_percentage'
     
     def get_photo_preview(self, obj):
         if obj.photo:
@@ -130,8 +227,10 @@ class CandidateAdmin(admin.ModelAdmin):
 class VoteAdmin(admin.ModelAdmin):
     list_display = ('voter', 'candidate', 'election', 'timestamp', 'ip_address')
     list_filter = ('election', 'timestamp', 'candidate__party')
+    # Candidate.__str__ shows the election title too
+    list_select_related = ('voter', 'candidate__election', 'election')
     search_fields = ('voter__username', 'candidate__name', 'election__title')
-    readonly_fields = ('voter', 'candidate', 'election', 'timestamp', 'ip_address')
+    readonly_fields = ('voter', 'candidate', 'election', 'timestamp', 'ip_address', 'receipt', 'ledger_position')
     
     def has_add_permission(self, request):
         return False  # Prevent adding votes through admin
@@ -144,6 +243,7 @@ class VoteAdmin(admin.ModelAdmin):
 class AuditLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'action', 'timestamp', 'ip_address')
     list_filter = ('action', 'timestamp')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'action', 'details')
     readonly_fields = ('user', 'action', 'details', 'ip_address', 'timestamp')
     
@@ -154,6 +254,26 @@ class AuditLogAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(LedgerBlock)
+class LedgerBlockAdmin(admin.ModelAdmin):
+    list_display = ('election', 'index', 'first_position', 'size', 'chain_hash', 'sealed_at')
+    list_filter = ('election',)
+    list_select_related = ('election',)
+    readonly_fields = (
+        'election', 'index', 'first_position', 'size', 'merkle_root', 'previous_hash', 'chain_hash',
+        'election_root', 'sealed_at',
+    )
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False  # The ledger is append-only
+
+
 # Customize admin site
 admin.site.site_header = "Online Voting System Administration"
 admin.site.site_title = "Voting Admin"
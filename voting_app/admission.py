@@ -0,0 +1,349 @@
+"""
+Admission control for the write-heavy entry points (vote, registration, login).
+
+When an election opens, every voter arrives at once and requests would
+otherwise pile up on the database until latency is bad for everyone. Each
+guarded POST passes two checks before the view runs:
+
+    rate limit   token buckets in the shared cache, per user and per client
+                 IP (client_address), refilled continuously at the configured
+                 rate; an empty bucket answers 429 with Retry-After
+    concurrency  at most ADMISSION_MAX_CONCURRENT guarded requests run at
+                 once across all workers, counted in the shared cache; past
+                 the cap the request fails fast with 503 and Retry-After
+                 instead of queuing
+
+A bucket is a single cache entry, the time at which it will be full again
+(the GCRA form of a token bucket), so taking a token is one get and one set.
+Requests for the same bucket that race between processes can both take the
+last token; limits are meant to stop floods, not to count exactly. If the
+cache fails, requests are admitted.
+
+The cap is checked first, before the session and user are loaded, so a
+rejected request costs no queries. The in-flight count is one cache entry
+(incr/decr, released in a finally) that expires ADMISSION_IN_FLIGHT_TTL
+seconds after it was created: that returns the slots of a worker killed
+mid-request, at the price of briefly under-counting the requests in
+progress when it happens. With a per-process cache (no REDIS_URL) the cap
+only applies per process, which on sync gunicorn workers means never.
+
+The client IP is the address the nearest untrusted hop connected from:
+REMOTE_ADDR, or with ADMISSION_TRUSTED_PROXIES proxies in front of the app,
+the X-Forwarded-For entry appended by the outermost of them. Entries further
+left are whatever the client sent and would give a flood a fresh bucket per
+request.
+
+HealthCheckMiddleware answers ADMISSION_HEALTH_PATH before any other
+middleware runs: no session, no database, no cache, just this process's
+in-flight count and admission counters.
+
+Settings:
+    ADMISSION_CONTROL_ENABLED  Apply rate limits and the concurrency cap (default True)
+    ADMISSION_LIMITS           {scope: {'user' | 'ip': 'N/s|m|h|d'}} (see settings.py)
+    ADMISSION_MAX_CONCURRENT   Guarded requests in progress over all workers (default 32)
+    ADMISSION_IN_FLIGHT_TTL    Seconds before the shared in-flight count starts over (default 60)
+    ADMISSION_RETRY_AFTER      Retry-After seconds of a 503 (default 1)
+    ADMISSION_TRUSTED_PROXIES  Proxies appending to X-Forwarded-For in front of the app (default 0)
+    ADMISSION_HEALTH_PATH      Path of the health endpoint (default '/healthz')
+"""
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'admission'
+IN_FLIGHT_KEY = f'{KEY_PREFIX}:in_flight'
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+def _enabled():
+    return getattr(settings, 'ADMISSION_CONTROL_ENABLED', True)
+
+
+def parse_rate(rate):
+    """'10/m' -> (capacity 10, seconds per token 6.0)"""
+    count, _, period = rate.partition('/')
+    count = int(count)
+    if count <= 0 or period[:1] not in PERIODS:
+        raise ValueError(f"Invalid rate {rate!r}; use N/s, N/m, N/h or N/d")
+    return count, PERIODS[period[:1]] / count
+
+
+class TokenBucket:
+    """A token bucket of `capacity` tokens, one token refilled every `interval` seconds"""
+
+    def __init__(self, key, capacity, interval):
+        self.key = key
+        self.capacity = capacity
+        self.interval = interval
+
+    def _next(self, full_at, now):
+        """(new full_at, 0) when a token is available, else (None, seconds to wait)"""
+        full_at = max(full_at or now, now) + self.interval
+        wait = full_at - now - self.capacity * self.interval
+        if wait > 0:
+            return None, wait
+        return full_at, 0.0
+
+    def take(self):
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        now = time.time()
+        full_at, wait = self._next(cache.get(self.key), now)
+        if full_at is not None:
+            cache.set(self.key, full_at, math.ceil(full_at - now))
+        return wait
+
+    async def atake(self):
+        """Async counterpart of take"""
+        now = time.time()
+        full_at, wait = self._next(await cache.aget(self.key), now)
+        if full_at is not None:
+            await cache.aset(self.key, full_at, math.ceil(full_at - now))
+        return wait
+
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking cap on the guarded requests in progress in all workers.
+
+    The shared count is IN_FLIGHT_KEY in the cache; in_flight and peak are
+    this process's share, for the health endpoint and the metrics gauge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+
+    def _ttl(self):
+        return getattr(settings, 'ADMISSION_IN_FLIGHT_TTL', 60)
+
+    def _count(self, delta):
+        with self._lock:
+            self.in_flight += delta
+            self.peak = max(self.peak, self.in_flight)
+            metrics.ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def acquire(self, limit):
+        try:
+            cache.add(IN_FLIGHT_KEY, 0, self._ttl())
+            if cache.incr(IN_FLIGHT_KEY) > limit:
+                self._decr()
+                return False
+        except Exception:
+            logger.exception("Concurrency check failed; admitting the request")
+        self._count(1)
+        return True
+
+    async def aacquire(self, limit):
+        """Async counterpart of acquire"""
+        try:
+            await cache.aadd(IN_FLIGHT_KEY, 0, self._ttl())
+            if await cache.aincr(IN_FLIGHT_KEY) > limit:
+                await self._adecr()
+                return False
+        except Exception:
+            logger.exception("Concurrency check failed; admitting the request")
+        self._count(1)
+        return True
+
+    def release(self):
+        self._count(-1)
+        self._decr()
+
+    async def arelease(self):
+        """Async counterpart of release"""
+        self._count(-1)
+        await self._adecr()
+
+    def _decr(self):
+        try:
+            cache.decr(IN_FLIGHT_KEY)
+        except ValueError:
+            pass  # The count expired meanwhile and starts over
+        except Exception:
+            logger.exception("Could not release a concurrency slot")
+
+    async def _adecr(self):
+        try:
+            await cache.adecr(IN_FLIGHT_KEY)
+        except ValueError:
+            pass
+        except Exception:
+            logger.exception("Could not release a concurrency slot")
+
+
+limiter = ConcurrencyLimiter()
+
+counters = {
+    'admitted': 0,
+    'rate_limited': 0,
+    'overloaded': 0,
+}
+
+
+def stats():
+    """This process's counters, in-flight requests and their peak"""
+    return dict(
+        counters,
+        in_flight=limiter.in_flight,
+        peak_in_flight=limiter.peak,
+        max_concurrent=getattr(settings, 'ADMISSION_MAX_CONCURRENT', 32),
+    )
+
+
+def client_address(request):
+    """The client IP as seen by the trusted proxies (or by this server without any)"""
+    proxies = getattr(settings, 'ADMISSION_TRUSTED_PROXIES', 0)
+    if proxies:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def _buckets(scope, request, user):
+    """The buckets a request of `scope` takes a token from"""
+    limits = getattr(settings, 'ADMISSION_LIMITS', {}).get(scope, {})
+    identities = {'ip': client_address(request)}
+    if scope == 'login':
+        # Not logged in yet: limit attempts per account name
+        identities['user'] = (request.POST.get('username') or '').strip().lower() or None
+    elif user is not None and user.is_authenticated:
+        identities['user'] = user.pk
+
+    buckets = []
+    for kind, rate in limits.items():
+        if identities.get(kind) is not None:
+            capacity, interval = parse_rate(rate)
+            buckets.append((kind, TokenBucket(f'{KEY_PREFIX}:{scope}:{kind}:{identities[kind]}', capacity, interval)))
+    return buckets
+
+
+def _admitted(scope):
+    counters['admitted'] += 1
+    metrics.ADMISSION_ADMITTED.inc(scope=scope)
+
+
+def _rejected(scope, reason, status, retry_after, message):
+    counters['overloaded' if reason == 'overload' else 'rate_limited'] += 1
+    metrics.ADMISSION_REJECTIONS.inc(scope=scope, reason=reason)
+    response = HttpResponse(message, status=status, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _rate_limited(scope, kind, wait):
+    return _rejected(scope, f'rate_{kind}', 429, wait, "Too many requests. Please wait a moment and try again.")
+
+
+def _overloaded(scope):
+    return _rejected(
+        scope, 'overload', 503, getattr(settings, 'ADMISSION_RETRY_AFTER', 1),
+        "The service is busy. Please try again in a moment.",
+    )
+
+
+def _check_rate(scope, request, user):
+    try:
+        for kind, bucket in _buckets(scope, request, user):
+            wait = bucket.take()
+            if wait:
+                return _rate_limited(scope, kind, wait)
+    except Exception:
+        logger.exception("Rate limit check failed; admitting the request")
+    return None
+
+
+async def _acheck_rate(scope, request, user):
+    try:
+        for kind, bucket in _buckets(scope, request, user):
+            wait = await bucket.atake()
+            if wait:
+                return _rate_limited(scope, kind, wait)
+    except Exception:
+        logger.exception("Rate limit check failed; admitting the request")
+    return None
+
+
+def admission_control(scope):
+    """
+    Guard the POSTs of a view with the concurrency cap and the `scope`
+    rate limits. Works on sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method in SAFE_METHODS or not _enabled():
+                    return await view(request, *args, **kwargs)
+                if not await limiter.aacquire(getattr(settings, 'ADMISSION_MAX_CONCURRENT', 32)):
+                    return _overloaded(scope)
+                try:
+                    user = await request.auser() if hasattr(request, 'auser') else None
+                    rejection = await _acheck_rate(scope, request, user)
+                    if rejection is not None:
+                        return rejection
+                    _admitted(scope)
+                    return await view(request, *args, **kwargs)
+                finally:
+                    await limiter.arelease()
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method in SAFE_METHODS or not _enabled():
+                    return view(request, *args, **kwargs)
+                if not limiter.acquire(getattr(settings, 'ADMISSION_MAX_CONCURRENT', 32)):
+                    return _overloaded(scope)
+                try:
+                    rejection = _check_rate(scope, request, getattr(request, 'user', None))
+                    if rejection is not None:
+                        return rejection
+                    _admitted(scope)
+                    return view(request, *args, **kwargs)
+                finally:
+                    limiter.release()
+        return wrapper
+    return decorator
+
+
+class HealthCheckMiddleware:
+    """Answers the health endpoint before sessions, authentication or the database are touched"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.path = getattr(settings, 'ADMISSION_HEALTH_PATH', '/healthz')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path == self.path:
+            return self.health()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.path == self.path:
+            return self.health()
+        return await self.get_response(request)
+
+    def health(self):
+        response = JsonResponse(dict(stats(), status='ok'))
+        response['Cache-Control'] = 'no-store'
+        return response
@@ -0,0 +1,169 @@
+"""
+Async implementations of the high-traffic views.
+
+These are routed instead of their counterparts in views.py when ASYNC_VIEWS
+is enabled, which is meant for the ASGI deployment (uvicorn or gunicorn with
+uvicorn workers). Database reads use Django's async ORM; the vote insert runs
+in a transaction and therefore goes through sync_to_async. Templates are
+rendered in a worker thread because they may touch lazy objects such as
+request.user.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+
+from . import audit, voter_index
+from .ballots import aget_ballot
+from .entity_cache import aget_election
+from .forms import VoteForm
+from .homepage import aget_home_context
+from .live import acompute_status
+from .models import Election, Vote
+from .results import aget_final_results, closing_results
+from .routing import replica_reads
+from .tallies import aelection_total
+from .views import get_client_ip
+from .voting import VoteRejected, cast_ballot
+
+
+async def aget_election_or_404(election_id):
+    """Async counterpart of views.get_election_or_404"""
+    try:
+        return await aget_election(election_id)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
+
+
+async def alog_audit(user, action, details, request):
+    """Async-safe log_audit"""
+    await audit.arecord(user, action, details, get_client_ip(request))
+
+
+@replica_reads
+async def home(request):
+    """Home page showing active elections"""
+    context = await aget_home_context()
+
+    return await sync_to_async(render)(request, 'voting_app/home.html', context)
+
+
+@login_required
+async def election_detail(request, pk):
+    """Election detail view with voting capability"""
+    user = await request.auser()
+    try:
+        ballot = await aget_ballot(pk)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
+    election = ballot['election']
+    election.total_votes = await aelection_total(election.id)
+
+    # Check if user has already voted; only voters need their Vote row
+    voted = await voter_index.ahas_voted(election.pk, user.pk, election.total_votes)
+    user_vote = None
+    if voted is not False:
+        user_vote = await Vote.objects.filter(voter=user, election=election).select_related('candidate').afirst()
+        if voted and user_vote is None:
+            voter_index.forget(election.pk, user.pk)
+
+    # Get candidates with vote counts (only show after election ends or if user is admin)
+    candidates = ballot['candidates']
+    if election.is_finished or user.is_staff:
+        candidates = [candidate async for candidate in election.candidates.select_related('tally')]
+
+    context = {
+        'object': election,
+        'election': election,
+        'user_vote': user_vote,
+        'candidates': candidates,
+        'can_vote': election.is_ongoing and not user_vote,
+    }
+
+    # Voting form
+    if context['can_vote']:
+        context['vote_form'] = VoteForm(election=election, user=user)
+
+    return await sync_to_async(render)(request, 'voting_app/election_detail.html', context)
+
+
+@login_required
+async def cast_vote(request, election_id):
+    """Handle vote casting"""
+    if request.method == 'POST':
+        user = await request.auser()
+        try:
+            vote = await sync_to_async(cast_ballot)(
+                user,
+                election_id,
+                request.POST.get('candidate'),
+                ip_address=get_client_ip(request)
+            )
+        except VoteRejected as e:
+            if e.code == 'invalid_candidate':
+                await aget_election_or_404(election_id)
+            messages.error(request, e.message)
+        else:
+            await alog_audit(user, 'VOTE_CAST', f'Vote cast in election: {vote.election.title}', request)
+            messages.success(request, 'Your vote has been cast successfully!')
+
+    return redirect('election_detail', pk=election_id)
+
+
+@replica_reads
+@login_required
+async def election_results(request, election_id):
+    """View election results"""
+    # Finished elections are served from their cached results snapshot
+    final_results = await aget_final_results(election_id)
+    if final_results is not None:
+        return await sync_to_async(render)(request, 'voting_app/election_results.html', final_results)
+
+    election = await aget_election_or_404(election_id)
+
+    if election.is_finished:
+        final_results = await sync_to_async(closing_results)(election)
+        return await sync_to_async(render)(request, 'voting_app/election_results.html', final_results)
+
+    # Only show live results to admins while the election is not finished
+    user = await request.auser()
+    if not user.is_staff:
+        messages.error(request, 'Results are not yet available for this election.')
+        return redirect('election_detail', pk=election_id)
+
+    # Get candidates with vote counts and percentages from the tally store
+    candidates = [
+        candidate async for candidate in
+        election.candidates.select_related('tally').order_by('-tally__votes', 'name')
+    ]
+
+    total_votes = sum(candidate.vote_count for candidate in candidates)
+    election.total_votes = total_votes
+
+    # Calculate percentages
+    for candidate in candidates:
+        candidate.percentage = round(candidate.vote_count / total_votes * 100, 2) if total_votes > 0 else 0
+
+    organizer = await User.objects.aget(pk=election.created_by_id)
+    context = {
+        'election': election,
+        'organizer': organizer.get_full_name() or organizer.username,
+        'candidates': candidates,
+        'total_votes': total_votes,
+    }
+
+    return await sync_to_async(render)(request, 'voting_app/election_results.html', context)
+
+
+@replica_reads
+@login_required
+async def api_election_status(request, election_id):
+    """Get election status via API"""
+    try:
+        data = await acompute_status(election_id)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
+
+    return JsonResponse(data)
@@ -0,0 +1,332 @@
+"""
+Batched audit-log writer.
+
+Audit entries are queued in a bounded in-process buffer and written with
+bulk_create by a background thread, either when a batch fills up or when the
+flush interval elapses. This keeps AuditLog inserts off the vote transaction.
+
+When AUDIT_LOG_SPOOL_DIR is set, every queued entry is also appended to a
+journal segment on disk before it is acknowledged. A segment is deleted once
+its entries are in the database; if a flush fails, or the worker dies before
+flushing, the segment stays on disk and is replayed later (by a live worker
+or by the flush_audit_spool management command).
+
+Settings:
+    AUDIT_LOG_ASYNC           Queue entries instead of writing them inline (default False)
+    AUDIT_LOG_BATCH_SIZE      Entries per bulk_create (default 100)
+    AUDIT_LOG_BUFFER_SIZE     Maximum queued entries before the caller flushes (default 10000)
+    AUDIT_LOG_FLUSH_INTERVAL  Seconds between background flushes (default 1.0)
+    AUDIT_LOG_SPOOL_DIR       Directory for journal segments (default None, no journal)
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import AUDIT_BUFFER_DEPTH
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+SPILL_SUFFIX = '.spill.jsonl'
+ACTIVE_SUFFIX = '.active.jsonl'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _to_model(entry):
+    return AuditLog(
+        user_id=entry['user_id'],
+        action=entry['action'],
+        details=entry['details'],
+        ip_address=entry['ip_address'],
+        timestamp=parse_datetime(entry['timestamp']),
+    )
+
+
+class AuditBuffer:
+    """Bounded in-process queue of audit entries flushed in batches"""
+
+    def __init__(self, batch_size=100, max_size=10000, flush_interval=1.0, spool_dir=None):
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._segment = 0
+        self._journal = None
+        self._journal_path = None
+
+        self.counters = {
+            'enqueued': 0,
+            'flushed': 0,
+            'batches': 0,
+            'flush_failures': 0,
+            'spilled': 0,
+            'replayed': 0,
+            'sync_flushes': 0,
+        }
+        self.last_flush_at = None
+
+    # Journal segments
+
+    def _open_journal(self):
+        self._segment += 1
+        self._journal_path = self.spool_dir / f'audit-{self._pid}-{self._segment}{ACTIVE_SUFFIX}'
+        self._journal = open(self._journal_path, 'a', encoding='utf-8')
+
+    def _rotate_journal(self):
+        """Close the current segment and return its path (caller holds _lock)"""
+        if self._journal is None:
+            return None
+        self._journal.close()
+        path = self._journal_path
+        self._journal = None
+        self._journal_path = None
+        return path
+
+    def _count(self, **increments):
+        """Bump counters; the flusher thread and request threads share them"""
+        with self._lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    # Queueing
+
+    def _ensure_started(self):
+        """(Re)start the flusher thread, e.g. after a fork into a new worker"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        self._pid = pid
+        self._entries.clear()
+        self._journal = None
+        if self.spool_dir:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+        self._thread.start()
+
+    def add(self, entry):
+        """Queue an audit entry (a dict as built by make_entry)"""
+        with self._lock:
+            self._ensure_started()
+            if self.spool_dir:
+                if self._journal is None:
+                    self._open_journal()
+                self._journal.write(json.dumps(entry) + '\n')
+                self._journal.flush()
+            self._entries.append(entry)
+            self.counters['enqueued'] += 1
+            depth = len(self._entries)
+            if depth >= self.max_size:
+                self.counters['sync_flushes'] += 1
+        AUDIT_BUFFER_DEPTH.set(depth)
+
+        if depth >= self.max_size:
+            # Buffer is full: apply backpressure instead of growing without bound
+            self.flush()
+        elif depth >= self.batch_size:
+            self._wakeup.set()
+
+    # Flushing
+
+    def flush(self):
+        """Write all queued entries to the database; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._entries)
+                self._entries.clear()
+                segment = self._rotate_journal()
+            AUDIT_BUFFER_DEPTH.set(0)
+            if not entries:
+                return 0
+
+            written = 0
+            try:
+                for start in range(0, len(entries), self.batch_size):
+                    batch = entries[start:start + self.batch_size]
+                    with transaction.atomic():
+                        AuditLog.objects.bulk_create([_to_model(entry) for entry in batch])
+                    written += len(batch)
+                    self._count(flushed=len(batch), batches=1)
+            except Exception:
+                self._count(flush_failures=1)
+                logger.exception("Audit log flush failed")
+                self._spill(entries[written:], segment)
+                return written
+
+            if segment is not None:
+                segment.unlink(missing_ok=True)
+            self.last_flush_at = time.time()
+            return written
+
+    def _spill(self, entries, segment):
+        """Keep entries that could not be written on disk for a later replay"""
+        self._count(spilled=len(entries))
+        if self.spool_dir is None:
+            logger.error("Dropped %d audit entries (no AUDIT_LOG_SPOOL_DIR configured)", len(entries))
+            return
+        spill_path = self.spool_dir / f'audit-{self._pid}-{self._segment}-{time.time_ns()}{SPILL_SUFFIX}'
+        with open(spill_path, 'w', encoding='utf-8') as spill:
+            for entry in entries:
+                spill.write(json.dumps(entry) + '\n')
+        if segment is not None:
+            segment.unlink(missing_ok=True)
+
+    def replay_spool(self):
+        """
+        Write spilled segments, and segments left behind by dead workers, to
+        the database. Returns the number of entries replayed.
+        """
+        if self.spool_dir is None or not self.spool_dir.exists():
+            return 0
+
+        replayed = 0
+        for path in sorted(self.spool_dir.iterdir()):
+            if path.name.endswith(ACTIVE_SUFFIX):
+                pid = int(path.name.split('-')[1])
+                if pid == os.getpid() or _pid_alive(pid):
+                    continue
+            elif '.replaying-' in path.name:
+                # Claimed by a replayer; take it over only if that process died
+                pid = int(path.name.rsplit('-', 1)[1])
+                if _pid_alive(pid):
+                    continue
+            elif not path.name.endswith(SPILL_SUFFIX):
+                continue
+
+            # Claim the file so that concurrent replayers skip it
+            claimed = path.with_name(f"{path.name.split('.replaying-')[0]}.replaying-{os.getpid()}")
+            try:
+                path.rename(claimed)
+            except FileNotFoundError:
+                continue
+
+            with open(claimed, encoding='utf-8') as segment:
+                entries = [json.loads(line) for line in segment if line.strip()]
+            try:
+                with transaction.atomic():
+                    AuditLog.objects.bulk_create(
+                        [_to_model(entry) for entry in entries],
+                        batch_size=self.batch_size
+                    )
+            except Exception:
+                logger.exception("Audit spool replay failed for %s", path.name)
+                claimed.rename(path)
+                continue
+            claimed.unlink()
+            replayed += len(entries)
+
+        self._count(replayed=replayed)
+        return replayed
+
+    def _run(self):
+        last_replay = 0.0
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() - last_replay > self.flush_interval * 30:
+                    last_replay = time.monotonic()
+                    self.replay_spool()
+            except Exception:
+                logger.exception("Audit log writer error")
+            finally:
+                close_old_connections()
+
+    # Monitoring
+
+    def stats(self):
+        """Counters plus current depth and lag (age of the oldest queued entry)"""
+        with self._lock:
+            depth = len(self._entries)
+            oldest = self._entries[0]['timestamp'] if self._entries else None
+            counters = dict(self.counters)
+        lag = 0.0
+        if oldest is not None:
+            lag = max(0.0, (timezone.now() - parse_datetime(oldest)).total_seconds())
+        return dict(counters, depth=depth, lag_seconds=lag, last_flush_at=self.last_flush_at)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_audit_buffer():
+    """Return the process-wide audit buffer, creating it from settings"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = AuditBuffer(
+                    batch_size=getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 100),
+                    max_size=getattr(settings, 'AUDIT_LOG_BUFFER_SIZE', 10000),
+                    flush_interval=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL', 1.0),
+                    spool_dir=getattr(settings, 'AUDIT_LOG_SPOOL_DIR', None),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def make_entry(user, action, details, ip_address):
+    """Build a JSON-serializable audit entry"""
+    return {
+        'user_id': user.pk if user is not None and user.is_authenticated else None,
+        'action': action,
+        'details': details,
+        'ip_address': ip_address,
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def record(user, action, details, ip_address):
+    """
+    Record an audit entry.
+
+    With AUDIT_LOG_ASYNC the entry is queued once the surrounding
+    transaction commits; otherwise it is written immediately.
+    """
+    entry = make_entry(user, action, details, ip_address)
+    if getattr(settings, 'AUDIT_LOG_ASYNC', False):
+        transaction.on_commit(lambda: get_audit_buffer().add(entry))
+    else:
+        _to_model(entry).save()
+
+
+async def arecord(user, action, details, ip_address):
+    """
+    Async counterpart of record, for use outside transactions.
+
+    Queueing goes through sync_to_async because a full buffer is flushed
+    by the caller.
+    """
+    entry = make_entry(user, action, details, ip_address)
+    if getattr(settings, 'AUDIT_LOG_ASYNC', False):
+        await sync_to_async(get_audit_buffer().add)(entry)
+    else:
+        await _to_model(entry).asave()
@@ -0,0 +1,38 @@
+"""
+Election ballots.
+
+The election row and its candidate list only change when an admin edits
+them, yet every election detail request needs both. They are read through
+the two-tier entity cache (see entity_cache.py) and invalidated by the
+Election and Candidate signals (and by the photo worker). The lifecycle
+scheduler warms them shortly before an election opens.
+
+Vote counts are not part of the ballot; they come from the tally store.
+"""
+from .entity_cache import (
+    aget_candidates, aget_election, get_candidates, get_election, invalidate_election, warm_election,
+)
+
+
+def warm_ballot(election_id):
+    """(Re)build the cached ballot of an election"""
+    election, candidates = warm_election(election_id)
+    return {'election': election, 'candidates': candidates}
+
+
+def get_ballot(election_id):
+    """
+    Return {'election', 'candidates'} from the cache when possible.
+
+    Raises Election.DoesNotExist for unknown elections.
+    """
+    return {'election': get_election(election_id), 'candidates': get_candidates(election_id)}
+
+
+async def aget_ballot(election_id):
+    """Async counterpart of get_ballot"""
+    return {'election': await aget_election(election_id), 'candidates': await aget_candidates(election_id)}
+
+
+def invalidate_ballot(election_id):
+    invalidate_election(election_id)
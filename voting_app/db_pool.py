@@ -0,0 +1,80 @@
+"""
+Connection pool metrics.
+
+With DB_POOL on (see online_voting_system/database.py) every process owns a
+psycopg pool per database alias. After a request finishes, and at most once
+every DB_POOL_METRICS_INTERVAL seconds, the process copies the pool's
+statistics into its metrics file: open, idle and maximum connections and
+waiting requests as gauges (voting_db_pool_*, summed over live processes),
+and the growth of the pool's counters since the previous copy (checkouts,
+queued checkouts, wait time, failed checkouts, connections opened and lost)
+as Prometheus counters. The pool's own counters are left alone, so
+get_stats() keeps reporting totals. /metrics publishes the pools of the process serving it first.
+
+Without a pool nothing is exported.
+
+Settings:
+    DB_POOL_METRICS_INTERVAL  Seconds between two copies per process (default 5)
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+# get_stats() counter -> (metric, scale)
+COUNTERS = {
+    'requests_num': (metrics.DB_POOL_CHECKOUTS, 1),
+    'requests_queued': (metrics.DB_POOL_QUEUED, 1),
+    'requests_wait_ms': (metrics.DB_POOL_WAIT, 0.001),
+    'requests_errors': (metrics.DB_POOL_ERRORS, 1),
+    'connections_num': (metrics.DB_POOL_CONNECTIONS_OPENED, 1),
+    'connections_lost': (metrics.DB_POOL_CONNECTIONS_LOST, 1),
+    'returns_bad': (metrics.DB_POOL_CONNECTIONS_LOST, 1),
+}
+
+_lock = threading.Lock()
+_published_at = {'time': 0.0}
+# (alias, pool id) -> counters at the previous copy
+_last_counters = {}
+
+
+def pools():
+    """{alias: pool} of the pools this process has opened"""
+    result = {}
+    for alias in connections:
+        if connections.settings[alias].get('OPTIONS', {}).get('pool'):
+            # Only the PostgreSQL backend has pools. The connection's pool
+            # property would create a missing one, so read the backend's
+            # registry instead; pools are created closed and opened by the
+            # first connection.
+            created = getattr(connections[alias], '_connection_pools', {})
+            pool = created.get(alias)
+            if pool is not None and not pool.closed:
+                result[alias] = pool
+    return result
+
+
+def publish(force=False):
+    """Copy the statistics of this process's pools into its metrics file"""
+    interval = getattr(settings, 'DB_POOL_METRICS_INTERVAL', 5)
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _published_at['time'] < interval:
+            return False
+        _published_at['time'] = now
+        for alias, pool in pools().items():
+            stats = pool.get_stats()
+            last = _last_counters.setdefault((alias, id(pool)), {})
+            metrics.DB_POOL_SIZE.set(stats.get('pool_size', 0), alias=alias)
+            metrics.DB_POOL_AVAILABLE.set(stats.get('pool_available', 0), alias=alias)
+            metrics.DB_POOL_MAX_SIZE.set(stats.get('pool_max', 0), alias=alias)
+            metrics.DB_POOL_WAITING.set(stats.get('requests_waiting', 0), alias=alias)
+            for key, (counter, scale) in COUNTERS.items():
+                delta = stats.get(key, 0) - last.get(key, 0)
+                if delta > 0:
+                    counter.inc(delta * scale, alias=alias)
+                last[key] = stats.get(key, 0)
+    return True
@@ -0,0 +1,89 @@
+"""
+Voter eligibility, evaluated in the database.
+
+A voter may vote in an election when their profile is flagged eligible
+(UserProfile.is_eligible) and they have reached the election's
+minimum_voter_age on the day it opens. The age rule is turned into a bound
+on the date of birth ("born on or before <cutoff>"), computed once in
+Python, so eligibility is a plain range condition the database answers from
+profile_eligible_dob_idx (date_of_birth, partial on is_eligible) instead of
+computing an age per row. Counts for several elections come from one
+aggregate query over that index.
+"""
+from datetime import date
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import UserProfile, VoteTally
+
+
+def age_cutoff(on_date, years):
+    """Latest date of birth of someone at least `years` old on `on_date`"""
+    try:
+        return on_date.replace(year=on_date.year - years)
+    except ValueError:
+        # 29 February: someone born on 1 March is not `years` old yet
+        return date(on_date.year - years, 2, 28)
+
+
+def election_day(election):
+    """The day an election opens, in the site's time zone"""
+    return timezone.localdate(election.start_time)
+
+
+def election_cutoff(election):
+    return age_cutoff(election_day(election), election.minimum_voter_age)
+
+
+def eligibility_q(election, prefix=''):
+    """Q for profiles (or, with prefix='userprofile__', users) eligible to vote in an election"""
+    return Q(**{f'{prefix}is_eligible': True, f'{prefix}date_of_birth__lte': election_cutoff(election)})
+
+
+def eligible_voters(election):
+    """Profiles eligible to vote in an election"""
+    return UserProfile.objects.filter(eligibility_q(election))
+
+
+def is_eligible(election, date_of_birth, flagged=True):
+    """Apply the election's rules to values already loaded (e.g. by resolve_ballot)"""
+    return bool(flagged) and date_of_birth is not None and date_of_birth <= election_cutoff(election)
+
+
+def eligible_counts(elections):
+    """{election id: eligible voters} for several elections in one query"""
+    elections = list(elections)
+    if not elections:
+        return {}
+    cutoffs = {election.pk: election_cutoff(election) for election in elections}
+    counts = UserProfile.objects.filter(
+        is_eligible=True, date_of_birth__lte=max(cutoffs.values())
+    ).aggregate(**{
+        f'election_{pk}': Count('pk', filter=Q(date_of_birth__lte=cutoff))
+        for pk, cutoff in cutoffs.items()
+    })
+    return {pk: counts[f'election_{pk}'] for pk in cutoffs}
+
+
+def turnout(elections):
+    """
+    [{'election', 'eligible', 'votes', 'turnout'}] per election, turnout in
+    percent of the eligible voters. Two queries, whatever the number of
+    elections: the eligible counts and the tally totals.
+    """
+    elections = list(elections)
+    eligible = eligible_counts(elections)
+    votes = dict(
+        VoteTally.objects.filter(election__in=elections).order_by()
+        .values('election_id').annotate(total=Sum('votes')).values_list('election_id', 'total')
+    )
+    return [
+        {
+            'election': election,
+            'eligible': eligible[election.pk],
+            'votes': votes.get(election.pk, 0),
+            'turnout': round(votes.get(election.pk, 0) / eligible[election.pk] * 100, 1) if eligible[election.pk] else 0,
+        }
+        for election in elections
+    ]
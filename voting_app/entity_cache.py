@@ -0,0 +1,306 @@
+"""
+Two-tier read-through cache for elections and their candidates.
+
+Election and Candidate rows are read on nearly every request but change
+rarely. Reads go through two tiers:
+
+    local   a per-process LRU of pickled values with a short TTL
+            (ENTITY_CACHE_LOCAL_TTL); no network round trip
+    shared  the default cache backend (Redis with REDIS_URL), for
+            ENTITY_CACHE_TTL seconds
+
+and fall back to the database. Shared keys carry a per-election version,
+so a change never has to find and delete the keys derived from an
+election (values are always loaded from the primary database, see
+routing.py): the Election/Candidate post_save and post_delete signals bump the
+version when the transaction commits (and drop the local entries of the
+process that made the change) and readers move on to new keys. Other processes may serve their local
+copy for up to ENTITY_CACHE_LOCAL_TTL seconds after a change; vote casting
+does not depend on it (cast_ballot re-reads the candidate and election).
+
+With a per-process default cache (LocMem, i.e. no REDIS_URL) the version
+bump never reaches the other workers, so entries are then kept for no
+longer than ENTITY_CACHE_LOCAL_TTL in that tier as well.
+
+Values are pickled in the local tier too, so every hit returns fresh model
+instances that callers may annotate freely.
+
+Settings:
+    ENTITY_CACHE_ENABLED     Read through the cache at all (default True). TestCase never
+                             commits, so versions are not bumped there; tests turn it off
+    ENTITY_CACHE_TTL         Seconds in the shared tier (default 300; capped at the
+                             local TTL when the default cache is per-process)
+    ENTITY_CACHE_LOCAL_TTL   Seconds in the per-process tier (default 5)
+    ENTITY_CACHE_LOCAL_SIZE  Entries kept per process (default 1000)
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from . import metrics
+from .models import Candidate, Election
+from .routing import use_primary
+
+KEY_PREFIX = 'entity'
+
+# Values cached per election; all share the election's version
+KINDS = ('election', 'candidates')
+
+_MISSING = object()
+
+
+def _enabled():
+    return getattr(settings, 'ENTITY_CACHE_ENABLED', True)
+
+
+def shared_backend():
+    """Whether the default cache is seen by all worker processes"""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+class LocalTier:
+    """Per-process LRU of pickled values that expire after `ttl` seconds"""
+
+    def __init__(self, max_size=1000, ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class EntityCache:
+    """Versioned read-through cache in front of the shared cache backend"""
+
+    def __init__(self):
+        self.local = LocalTier(
+            max_size=getattr(settings, 'ENTITY_CACHE_LOCAL_SIZE', 1000),
+            ttl=getattr(settings, 'ENTITY_CACHE_LOCAL_TTL', 5.0),
+        )
+        self.counters = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+        }
+
+    # Keys and versions
+
+    def _version_key(self, election_id):
+        return f'{KEY_PREFIX}:version:{election_id}'
+
+    def _data_key(self, kind, election_id, version):
+        return f'{KEY_PREFIX}:{kind}:{election_id}:v{version}'
+
+    def _new_version(self):
+        # Never reuses the version of an earlier life of the key (evicted, flushed)
+        return time.time_ns() // 1000
+
+    def _version(self, election_id):
+        key = self._version_key(election_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, self._new_version(), None)
+            version = cache.get(key)
+        return version
+
+    async def _aversion(self, election_id):
+        key = self._version_key(election_id)
+        version = await cache.aget(key)
+        if version is None:
+            await cache.aadd(key, self._new_version(), None)
+            version = await cache.aget(key)
+        return version
+
+    def _count(self, tier):
+        self.counters[f'{tier}_hits' if tier != 'database' else 'misses'] += 1
+        metrics.ENTITY_CACHE_LOOKUPS.inc(tier=tier)
+
+    def _ttl(self):
+        ttl = getattr(settings, 'ENTITY_CACHE_TTL', 300)
+        if not shared_backend():
+            # Other workers would not see a version bump: do not outlive the local tier
+            ttl = min(ttl, self.local.ttl)
+        return ttl
+
+    # Reads
+
+    def get(self, kind, election_id, loader):
+        """Return the cached `kind` value of an election, calling loader() on a miss"""
+        if not _enabled():
+            return loader()
+        value = self.local.get((kind, election_id))
+        if value is not _MISSING:
+            self._count('local')
+            return value
+
+        key = self._data_key(kind, election_id, self._version(election_id))
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            self._count('database')
+            # A lagging replica could cache replaced rows under the new version
+            with use_primary():
+                value = loader()
+            cache.set(key, value, self._ttl())
+        else:
+            self._count('shared')
+        self.local.set((kind, election_id), value)
+        return value
+
+    async def aget(self, kind, election_id, aloader):
+        """Async counterpart of get; aloader() is a coroutine function"""
+        if not _enabled():
+            return await aloader()
+        value = self.local.get((kind, election_id))
+        if value is not _MISSING:
+            self._count('local')
+            return value
+
+        key = self._data_key(kind, election_id, await self._aversion(election_id))
+        value = await cache.aget(key, _MISSING)
+        if value is _MISSING:
+            self._count('database')
+            with use_primary():
+                value = await aloader()
+            await cache.aset(key, value, self._ttl())
+        else:
+            self._count('shared')
+        self.local.set((kind, election_id), value)
+        return value
+
+    def refresh(self, kind, election_id, loader):
+        """Load a value from the database and store it in both tiers (cache warm-up)"""
+        with use_primary():
+            value = loader()
+        if _enabled():
+            cache.set(self._data_key(kind, election_id, self._version(election_id)), value, self._ttl())
+            self.local.set((kind, election_id), value)
+        return value
+
+    # Invalidation
+
+    def invalidate(self, election_id):
+        """
+        Move an election to a new version once the surrounding transaction
+        commits; stale keys simply expire.
+
+        Bumping earlier would let another process cache the uncommitted
+        (old) rows under the new version.
+        """
+        self.counters['invalidations'] += 1
+        self._discard_local(election_id)
+        transaction.on_commit(lambda: self._bump(election_id), robust=True)
+
+    def _discard_local(self, election_id):
+        for kind in KINDS:
+            self.local.discard((kind, election_id))
+
+    def _bump(self, election_id):
+        self._discard_local(election_id)
+        try:
+            cache.incr(self._version_key(election_id))
+        except ValueError:
+            # No version yet (or evicted): any new one leaves the old keys behind
+            cache.add(self._version_key(election_id), self._new_version(), None)
+
+    # Monitoring
+
+    def stats(self):
+        """Counters plus the hit rate over all lookups and the local tier size"""
+        lookups = self.counters['local_hits'] + self.counters['shared_hits'] + self.counters['misses']
+        hits = lookups - self.counters['misses']
+        return dict(
+            self.counters,
+            hit_rate=round(hits / lookups, 4) if lookups else None,
+            local_entries=len(self.local),
+        )
+
+
+entity_cache = EntityCache()
+
+
+def _load_election(election_id):
+    return Election.objects.get(pk=election_id)
+
+
+def _candidates_queryset(election_id):
+    return Candidate.objects.filter(election_id=election_id)
+
+
+def _load_candidates(election_id):
+    return list(_candidates_queryset(election_id))
+
+
+def get_election(election_id):
+    """
+    Return an election from the cache when possible.
+
+    Raises Election.DoesNotExist for unknown elections (which are not cached).
+    """
+    return entity_cache.get('election', int(election_id), lambda: _load_election(election_id))
+
+
+async def aget_election(election_id):
+    """Async counterpart of get_election"""
+    return await entity_cache.aget('election', int(election_id), lambda: Election.objects.aget(pk=election_id))
+
+
+def get_candidates(election_id):
+    """Return the candidate list of an election from the cache when possible"""
+    return entity_cache.get('candidates', int(election_id), lambda: _load_candidates(election_id))
+
+
+async def aget_candidates(election_id):
+    """Async counterpart of get_candidates"""
+    async def load():
+        return [candidate async for candidate in _candidates_queryset(election_id)]
+    return await entity_cache.aget('candidates', int(election_id), load)
+
+
+def warm_election(election_id):
+    """(Re)load an election and its candidates into both tiers"""
+    election_id = int(election_id)
+    election = entity_cache.refresh('election', election_id, lambda: _load_election(election_id))
+    candidates = entity_cache.refresh('candidates', election_id, lambda: _load_candidates(election_id))
+    return election, candidates
+
+
+def invalidate_election(election_id):
+    """Drop the cached election and candidates (called by the model signals)"""
+    entity_cache.invalidate(int(election_id))
@@ -0,0 +1,166 @@
+"""
+Streaming exports of votes and audit log entries.
+
+Rows are read with QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE) over
+values_list() tuples, so no model instances are built and no result cache is
+kept; on PostgreSQL this uses a server-side cursor. Each row is serialized
+(CSV or NDJSON), batched into ~64 KB pieces and optionally gzip-compressed
+on the fly, which keeps memory flat regardless of the table size. The same
+generator feeds the staff download views and the export_data command; under
+ASGI the views serve it through astream(), as an ASGI response would
+otherwise collect a sync generator into a list first.
+"""
+import csv
+import zlib
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AuditLog, Vote
+
+FORMATS = {
+    # format: (content type, file extension)
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+EXPORTS = {
+    'votes': (
+        Vote,
+        ('id', 'election_id', 'election__title', 'candidate_id', 'candidate__name',
+         'voter_id', 'voter__username', 'timestamp', 'ip_address'),
+    ),
+    'audit': (
+        AuditLog,
+        ('id', 'timestamp', 'user_id', 'user__username', 'action', 'details', 'ip_address'),
+    ),
+}
+
+BUFFER_SIZE = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Invalid export parameters"""
+
+
+def parse_moment(value, end_of_day=False):
+    """Parse an ISO date or datetime filter value into an aware datetime"""
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        moment = day = None
+    if moment is None:
+        if day is None:
+            raise ExportError(f"Invalid date or datetime: {value!r}")
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(kind, election=None, since=None, until=None, action=None):
+    """values_list() queryset of one export, in primary key order"""
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export: {kind!r}")
+    model, columns = EXPORTS[kind]
+
+    queryset = model.objects.all()
+    if election is not None:
+        if kind != 'votes':
+            raise ExportError("The election filter only applies to vote exports.")
+        queryset = queryset.filter(election_id=election)
+    if action is not None:
+        if kind != 'audit':
+            raise ExportError("The action filter only applies to audit log exports.")
+        queryset = queryset.filter(action=action)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lte=until)
+    return queryset.order_by('pk').values_list(*columns)
+
+
+class _LineBuffer:
+    """File-like object for csv.writer that just returns what is written"""
+
+    def write(self, value):
+        return value
+
+
+def _plain(row):
+    # Full-precision ISO timestamps in both formats
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(_plain(row))
+
+
+def _ndjson_lines(columns, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, _plain(row)))) + '\n'
+
+
+def _batched(lines):
+    """Join lines into pieces of about BUFFER_SIZE bytes"""
+    batch = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        batch.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(batch)
+            batch = []
+            size = 0
+    if batch:
+        yield b''.join(batch)
+
+
+def _gzipped(pieces):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(queryset, format='csv', compress=False):
+    """Generator of bytes serializing an export queryset"""
+    if format not in FORMATS:
+        raise ExportError(f"Unknown format: {format!r}")
+    columns = queryset.query.values_select
+    rows = queryset.iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+    lines = (_csv_lines if format == 'csv' else _ndjson_lines)(columns, rows)
+    pieces = _batched(lines)
+    return _gzipped(pieces) if compress else pieces
+
+
+async def astream(pieces):
+    """Async iterator over a stream_export generator, producing one piece at a time in the sync thread"""
+    produce = sync_to_async(next)
+    try:
+        while True:
+            piece = await produce(pieces, None)
+            if piece is None:
+                break
+            yield piece
+    finally:
+        # Client gone: release the database cursor
+        await sync_to_async(pieces.close)()
+
+
+def export_filename(kind, format='csv', compress=False, election=None):
+    name = f'{kind}-election-{election}' if election is not None else kind
+    name = f"{name}-{timezone.now():%Y%m%d-%H%M%S}.{FORMATS[format][1]}"
+    return f'{name}.gz' if compress else name
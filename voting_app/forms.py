@@ -3,7 +3,19 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from .models import UserProfile, Vote, Candidate, Election
+from .models import UserProfile, Candidate, Election
+
+
+def validate_voter_age(date_of_birth):
+    """Validate age requirement (18+); shared by registration and voter-roll imports"""
+    today = timezone.now().date()
+    age = today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+    
+    if age < 18:
+        raise ValidationError("You must be at least 18 years old to register.")
+    
+    if date_of_birth > today:
+        raise ValidationError("Date of birth cannot be in the future.")
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -48,15 +60,7 @@ class CustomUserCreationForm(UserCreationForm):
     def clean_date_of_birth(self):
         """Validate age requirement (18+)"""
         date_of_birth = self.cleaned_data['date_of_birth']
-        today = timezone.now().date()
-        age = today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
-        
-        if age < 18:
-            raise ValidationError("You must be at least 18 years old to register.")
-        
-        if date_of_birth > today:
-            raise ValidationError("Date of birth cannot be in the future.")
-        
+        validate_voter_age(date_of_birth)
         return date_of_birth
 
     def save(self, commit=True):
@@ -78,7 +82,7 @@ class CustomUserCreationForm(UserCreationForm):
 
 
 class VoteForm(forms.Form):
-    """Form for casting votes in an election"""
+    """Ballot shown on the election page; votes are cast by voting.cast_ballot"""
     candidate = forms.ModelChoiceField(
         queryset=None,
         widget=forms.RadioSelect,
@@ -93,42 +97,13 @@ class VoteForm(forms.Form):
         self.fields['candidate'].queryset = election.candidates.all()
         self.fields['candidate'].label = "Select your candidate:"
 
-    def clean_candidate(self):
-        """Validate voting constraints"""
-        candidate = self.cleaned_data['candidate']
-        
-        # Check if user has already voted in this election
-        if Vote.objects.filter(voter=self.user, election=self.election).exists():
-            raise ValidationError("You have already voted in this election.")
-        
-        # Check if election is ongoing
-        if not self.election.is_ongoing:
-            raise ValidationError("Voting is not currently open for this election.")
-        
-        # Check if user is eligible to vote
-        if hasattr(self.user, 'userprofile') and not self.user.userprofile.is_eligible:
-            raise ValidationError("You are not eligible to vote.")
-        
-        return candidate
-
-    def save(self, ip_address=None):
-        """Save the vote"""
-        candidate = self.cleaned_data['candidate']
-        vote = Vote.objects.create(
-            voter=self.user,
-            candidate=candidate,
-            election=self.election,
-            ip_address=ip_address
-        )
-        return vote
-
 
 class ElectionForm(forms.ModelForm):
     """Form for creating/editing elections (admin use)"""
     
     class Meta:
         model = Election
-        fields = ['title', 'description', 'start_time', 'end_time', 'is_active']
+        fields = ['title', 'description', 'start_time', 'end_time', 'minimum_voter_age', 'is_active']
         widgets = {
             'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             'end_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
@@ -0,0 +1,127 @@
+"""
+Cached home page sections.
+
+The ongoing/upcoming/finished lists only change when an election starts or
+ends, or when an election is edited. They are cached until the next
+start_time/end_time boundary (capped at HOME_CACHE_MAX_TTL seconds) and
+dropped by the Election save/delete signals, so they are read from the
+primary database. Vote totals come from the tally store in a single grouped
+query (on the replica, if any), cached separately for HOME_VOTE_TOTALS_TTL
+seconds.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from .models import Election, VoteTally
+from .routing import use_primary
+
+HOME_SECTIONS_KEY = 'home:sections'
+HOME_VOTE_TOTALS_KEY = 'home:vote_totals'
+
+
+def _section_querysets(now):
+    return {
+        'ongoing_elections': Election.objects.filter(
+            is_active=True,
+            start_time__lte=now,
+            end_time__gte=now
+        ),
+        'upcoming_elections': Election.objects.filter(
+            is_active=True,
+            start_time__gt=now,
+            end_time__gt=now
+        ),
+        'finished_elections': Election.objects.filter(
+            end_time__lt=now
+        ).order_by('-end_time')[:5],
+    }
+
+
+def _next_end_queryset(now):
+    # Any election ending (active or not) can enter the finished list
+    return Election.objects.filter(end_time__gte=now)
+
+
+def _totals_queryset(election_ids):
+    return VoteTally.objects.filter(election_id__in=election_ids).order_by().values(
+        'election_id'
+    ).annotate(total=Sum('votes')).values_list('election_id', 'total')
+
+
+def _ttl_until(boundaries, now):
+    """Seconds until the earliest boundary, capped at HOME_CACHE_MAX_TTL"""
+    ttl = getattr(settings, 'HOME_CACHE_MAX_TTL', 60)
+    for boundary in boundaries:
+        if boundary is not None:
+            ttl = min(ttl, math.ceil((boundary - now).total_seconds()))
+    return max(ttl, 1)
+
+
+def get_home_sections():
+    """Return the home page election lists, from the cache when possible"""
+    sections = cache.get(HOME_SECTIONS_KEY)
+    if sections is None:
+        now = timezone.now()
+        with use_primary():
+            sections = {name: list(queryset) for name, queryset in _section_querysets(now).items()}
+            next_end = _next_end_queryset(now).aggregate(next_end=Min('end_time'))['next_end']
+        boundaries = [election.start_time for election in sections['upcoming_elections']] + [next_end]
+        cache.set(HOME_SECTIONS_KEY, sections, _ttl_until(boundaries, now))
+    return sections
+
+
+def get_vote_totals(election_ids):
+    """Return {election_id: total votes} from the tally store, refreshed periodically"""
+    totals = cache.get(HOME_VOTE_TOTALS_KEY)
+    if totals is None or not set(election_ids) <= totals.keys():
+        totals = dict.fromkeys(election_ids, 0)
+        totals.update(_totals_queryset(election_ids))
+        cache.set(HOME_VOTE_TOTALS_KEY, totals, getattr(settings, 'HOME_VOTE_TOTALS_TTL', 10))
+    return totals
+
+
+def _attach_totals(sections, totals):
+    for elections in sections.values():
+        for election in elections:
+            election.total_votes = totals[election.id]
+    return sections
+
+
+def get_home_context():
+    """Build the home page context with vote totals attached to each election"""
+    sections = get_home_sections()
+    totals = get_vote_totals([election.id for elections in sections.values() for election in elections])
+    return _attach_totals(sections, totals)
+
+
+async def aget_home_context():
+    """Async counterpart of get_home_context"""
+    sections = await cache.aget(HOME_SECTIONS_KEY)
+    if sections is None:
+        now = timezone.now()
+        with use_primary():
+            sections = {
+                name: [election async for election in queryset]
+                for name, queryset in _section_querysets(now).items()
+            }
+            next_end = (await _next_end_queryset(now).aaggregate(next_end=Min('end_time')))['next_end']
+        boundaries = [election.start_time for election in sections['upcoming_elections']] + [next_end]
+        await cache.aset(HOME_SECTIONS_KEY, sections, _ttl_until(boundaries, now))
+
+    election_ids = [election.id for elections in sections.values() for election in elections]
+    totals = await cache.aget(HOME_VOTE_TOTALS_KEY)
+    if totals is None or not set(election_ids) <= totals.keys():
+        totals = dict.fromkeys(election_ids, 0)
+        totals.update([row async for row in _totals_queryset(election_ids)])
+        await cache.aset(HOME_VOTE_TOTALS_KEY, totals, getattr(settings, 'HOME_VOTE_TOTALS_TTL', 10))
+
+    return _attach_totals(sections, totals)
+
+
+def invalidate_home():
+    """Drop the cached sections (called when elections change)"""
+    cache.delete(HOME_SECTIONS_KEY)
@@ -0,0 +1,386 @@
+"""
+Per-request instrumentation.
+
+RequestMetricsMiddleware measures every request: wall time, number of SQL
+queries (and how many of them wrote), time spent in the database and cache
+hits/misses. Each request is
+logged as one JSON line on the "voting_app.requests" logger (INFO), and the
+numbers are added to rolling per-view histograms kept in the process (see
+snapshot()). Requests slower than REQUEST_SLOW_THRESHOLD_MS are logged at
+WARNING together with their most repeated SQL statements, which is how an
+N+1 regression shows up: the same SELECT with a different id, dozens of
+times.
+
+SQL is measured with an execute wrapper installed on every database
+connection. The measurements of the current request live in a context
+variable, which asgiref copies into sync_to_async threads, so async views
+are covered as well. Cache lookups are counted by the cache backends of
+this module (LocMemCache, RedisCache), which the settings use instead of
+Django's own. Request counts, latencies and cache lookups also go to the
+Prometheus metrics of voting_app.metrics.
+
+Statements are grouped by their SQL text with the parameters left out, and
+"IN (%s, %s, ...)" lists of any length count as the same statement.
+
+Settings:
+    REQUEST_METRICS_ENABLED     Measure requests at all (default True)
+    REQUEST_SLOW_THRESHOLD_MS   Log requests slower than this with their SQL (default 500)
+    REQUEST_SLOW_TOP_SQL        Repeated statements listed per slow request (default 5)
+    REQUEST_METRICS_WINDOW      Seconds covered by the rolling histograms (default 300)
+    REQUEST_METRICS_HEADERS     Add X-Query-Count, X-DB-Writes and Server-Timing headers (default False)
+"""
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache.backends import locmem, redis
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import metrics
+
+logger = logging.getLogger('voting_app.requests')
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+WRITE_COUNT_HEADER = 'X-DB-Writes'
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Upper bounds of the histogram buckets (an overflow bucket follows)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+DB_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 1000)
+
+_IN_LIST = re.compile(r'\bIN \((?:%s,\s*)*%s\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def normalize_sql(sql):
+    """SQL text used to group repeated statements"""
+    return _IN_LIST.sub('IN (%s, ...)', _WHITESPACE.sub(' ', sql).strip())
+
+
+class RequestStats:
+    """What one request did, filled in by the execute wrapper and the cache backends"""
+
+    __slots__ = ('queries', 'writes', 'db_time', 'statements', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.writes = 0
+        self.db_time = 0.0
+        # normalized SQL -> [executions, seconds]
+        self.statements = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        normalized = normalize_sql(sql)
+        if normalized[:7].upper().startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        entry = self.statements.setdefault(normalized, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+    def repeated_sql(self, limit=5):
+        """Statements run more than once, most frequent first"""
+        repeated = sorted(
+            ((sql, count, seconds) for sql, (count, seconds) in self.statements.items() if count > 1),
+            key=lambda item: (-item[1], -item[2]),
+        )
+        return [
+            {'sql': sql, 'count': count, 'db_ms': round(seconds * 1000, 2)}
+            for sql, count, seconds in repeated[:limit]
+        ]
+
+
+def _measure_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    # Sent on every (re)connect of the same wrapper object
+    if _measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_measure_query)
+
+
+def _install_on_thread_connections():
+    # Connections opened in this thread before the middleware was loaded
+    for connection in connections.all(initialized_only=True):
+        install_query_wrapper(None, connection)
+
+
+@contextmanager
+def measure():
+    """Collect RequestStats for the code in the block (requests, commands, tests)"""
+    _install_on_thread_connections()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class RollingHistogram:
+    """
+    Fixed-bucket histogram over the last `window` seconds.
+
+    The window is split into `slots` sub-histograms; an observation goes to
+    the slot of the current time and a slot is cleared when it comes round
+    again, so old observations drop out without storing them one by one.
+    """
+
+    def __init__(self, bounds, window=300, slots=10):
+        self.bounds = tuple(bounds)
+        self.slots = slots
+        self.slot_seconds = window / slots
+        self._epochs = [None] * slots
+        self._counts = [[0] * (len(self.bounds) + 1) for _ in range(slots)]
+        self._sums = [0.0] * slots
+        self._maxima = [0.0] * slots
+
+    def observe(self, value, now=None):
+        epoch = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        slot = epoch % self.slots
+        if self._epochs[slot] != epoch:
+            self._epochs[slot] = epoch
+            self._counts[slot] = [0] * (len(self.bounds) + 1)
+            self._sums[slot] = 0.0
+            self._maxima[slot] = 0.0
+        self._counts[slot][bisect_left(self.bounds, value)] += 1
+        self._sums[slot] += value
+        self._maxima[slot] = max(self._maxima[slot], value)
+
+    def snapshot(self, now=None):
+        """{'count', 'sum', 'max', 'buckets': [(upper bound, count)], 'p50', 'p95', 'p99'}"""
+        epoch = int((time.monotonic() if now is None else now) // self.slot_seconds)
+        counts = [0] * (len(self.bounds) + 1)
+        total = maximum = 0.0
+        for slot in range(self.slots):
+            if self._epochs[slot] is None or self._epochs[slot] <= epoch - self.slots:
+                continue
+            counts = [a + b for a, b in zip(counts, self._counts[slot])]
+            total += self._sums[slot]
+            maximum = max(maximum, self._maxima[slot])
+        count = sum(counts)
+        snapshot = {
+            'count': count,
+            'sum': round(total, 3),
+            'max': round(maximum, 3),
+            'buckets': list(zip(self.bounds + (float('inf'),), counts)),
+        }
+        for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            snapshot[name] = self._quantile(counts, count, quantile, maximum)
+        return snapshot
+
+    def _quantile(self, counts, count, quantile, maximum):
+        # Upper bound of the bucket holding the quantile (the maximum for the overflow bucket)
+        if not count:
+            return None
+        seen = 0
+        for bound, bucket in zip(self.bounds, counts):
+            seen += bucket
+            if seen >= quantile * count:
+                return round(min(bound, maximum), 3)
+        return round(maximum, 3)
+
+
+class ViewMetrics:
+    """Rolling histograms and lifetime counters of one view"""
+
+    def __init__(self, window):
+        self.latency_ms = RollingHistogram(LATENCY_BUCKETS_MS, window)
+        self.queries = RollingHistogram(QUERY_BUCKETS, window)
+        self.db_ms = RollingHistogram(DB_TIME_BUCKETS_MS, window)
+        self.requests = 0
+        self.slow = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class MetricsRegistry:
+    """Per-view metrics of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, status, duration_ms, stats, slow):
+        window = getattr(settings, 'REQUEST_METRICS_WINDOW', 300)
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics(window)
+            metrics.latency_ms.observe(duration_ms)
+            metrics.queries.observe(stats.queries)
+            metrics.db_ms.observe(stats.db_time * 1000)
+            metrics.requests += 1
+            metrics.slow += slow
+            metrics.errors += status >= 500
+            metrics.cache_hits += stats.cache_hits
+            metrics.cache_misses += stats.cache_misses
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {
+                    'requests': metrics.requests,
+                    'slow': metrics.slow,
+                    'errors': metrics.errors,
+                    'cache_hits': metrics.cache_hits,
+                    'cache_misses': metrics.cache_misses,
+                    'latency_ms': metrics.latency_ms.snapshot(),
+                    'queries': metrics.queries.snapshot(),
+                    'db_ms': metrics.db_ms.snapshot(),
+                }
+                for view, metrics in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def snapshot():
+    """Per-view request metrics of this process"""
+    return registry.snapshot()
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+def _finish(request, response, stats, started):
+    duration_ms = (time.perf_counter() - started) * 1000
+    view = _view_name(request)
+    status = response.status_code if response is not None else 500
+    slow = duration_ms >= getattr(settings, 'REQUEST_SLOW_THRESHOLD_MS', 500)
+    registry.record(view, status, duration_ms, stats, slow)
+    metrics.REQUESTS.inc(view=view, status=f'{status // 100}xx')
+    metrics.REQUEST_LATENCY.observe(duration_ms / 1000, view=view)
+
+    record = {
+        'view': view,
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'db_queries': stats.queries,
+        'db_writes': stats.writes,
+        'db_ms': round(stats.db_time * 1000, 2),
+        'cache_hits': stats.cache_hits,
+        'cache_misses': stats.cache_misses,
+    }
+    if slow:
+        record['slow'] = True
+        record['repeated_sql'] = stats.repeated_sql(getattr(settings, 'REQUEST_SLOW_TOP_SQL', 5))
+        logger.warning(json.dumps(record))
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record))
+
+    if response is not None and getattr(settings, 'REQUEST_METRICS_HEADERS', False):
+        response[QUERY_COUNT_HEADER] = str(stats.queries)
+        response[WRITE_COUNT_HEADER] = str(stats.writes)
+        response['Server-Timing'] = (
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", total;dur={duration_ms:.1f}'
+        )
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = None
+        with measure() as stats:
+            try:
+                response = self.get_response(request)
+            finally:
+                _finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        stats = RequestStats()
+        token = _current.set(stats)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            _finish(request, response, stats, started)
+        return response
+
+
+class CacheMetricsMixin:
+    """Counts get() hits and misses for the current request"""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version)
+        _count_lookups(hits=value is not self._missing, misses=value is self._missing)
+        return default if value is self._missing else value
+
+
+def _count_lookups(hits, misses):
+    if hits:
+        metrics.CACHE_LOOKUPS.inc(hits, result='hit')
+    if misses:
+        metrics.CACHE_LOOKUPS.inc(misses, result='miss')
+    stats = _current.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+class LocMemCache(CacheMetricsMixin, locmem.LocMemCache):
+    # BaseCache.get_many() and aget() go through get()
+    pass
+
+
+class RedisCache(CacheMetricsMixin, redis.RedisCache):
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        _count_lookups(hits=len(values), misses=len(keys) - len(values))
+        return values
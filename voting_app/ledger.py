@@ -0,0 +1,463 @@
+"""
+Tamper-evident vote ledger.
+
+Every vote carries a receipt: the SHA-256 of its ballot (election, voter,
+candidate, timestamp) and a random salt, set when the vote is cast. The
+voter is shown the receipt; without the salt it does not reveal the choice.
+
+Votes are not chained as they are cast, which would make every vote
+transaction wait for the previous one. Instead a sealer (the lifecycle
+scheduler, every LEDGER_SEAL_INTERVAL seconds, and once more when the
+election closes) takes the unsealed votes of an election in batches of up
+to LEDGER_BATCH_SIZE, numbers them (Vote.ledger_position) and writes a
+LedgerBlock with:
+
+    merkle_root    Merkle tree over the batch's receipts (RFC 6962 hashing)
+    chain_hash     hash of the block, chained to the previous block's
+    election_root  Merkle tree over all the election's blocks so far
+
+The tree over blocks is kept incrementally: appending block k stores its
+leaf and the O(log k) complete subtrees it closes (LedgerNode), and the
+election root is folded from the O(log k) subtrees that cover all blocks.
+An inclusion proof for a receipt is its path inside its block plus the
+path of that block in the election tree: about log2(votes) hashes, built
+from one block of receipts and O(log k) stored nodes.
+
+Any change to a sealed vote (its candidate, voter or timestamp, or a
+deletion) changes a receipt or a block's size and breaks the block's root,
+its chain hash and the election root. Publish the latest chain hash and
+election root (the closing receiver writes them to the audit log) and keep
+them outside the database: somebody who can rewrite the database can also
+recompute every hash after it. verify_ledger re-checks an election with one
+worker process per CPU core.
+
+Settings:
+    LEDGER_BATCH_SIZE     Votes per block (default 1024)
+    LEDGER_SEAL_INTERVAL  Seconds between two sealing passes of the scheduler (default 10)
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import secrets
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from .models import Election, LedgerBlock, LedgerNode, Vote
+from .routing import use_primary
+
+logger = logging.getLogger(__name__)
+
+GENESIS = '0' * 64
+
+
+def _batch_size():
+    return getattr(settings, 'LEDGER_BATCH_SIZE', 1024)
+
+
+# Hashing
+
+def _sha256(*parts):
+    return hashlib.sha256(b''.join(parts)).digest()
+
+
+def leaf_hash(data):
+    return _sha256(b'\x00', data)
+
+
+def node_hash(left, right):
+    return _sha256(b'\x01', left, right)
+
+
+def _split(size):
+    """Largest power of two below size"""
+    return 1 << ((size - 1).bit_length() - 1)
+
+
+def merkle_root(leaves):
+    """RFC 6962 tree hash over leaf hashes"""
+    if not leaves:
+        return _sha256()
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return node_hash(merkle_root(leaves[:k]), merkle_root(leaves[k:]))
+
+
+def merkle_path(leaves, index):
+    """Audit path of leaves[index], leaf to root"""
+    if len(leaves) <= 1:
+        return []
+    k = _split(len(leaves))
+    if index < k:
+        return merkle_path(leaves[:k], index) + [merkle_root(leaves[k:])]
+    return merkle_path(leaves[k:], index - k) + [merkle_root(leaves[:k])]
+
+
+def root_from_path(leaf, index, size, path):
+    """Fold an audit path back into the root (RFC 9162, 2.1.3.2); None if the path does not fit"""
+    if index >= size:
+        return None
+    fn, sn, root = index, size - 1, leaf
+    for sibling in path:
+        if sn == 0:
+            return None
+        if fn & 1 or fn == sn:
+            root = node_hash(sibling, root)
+            while not fn & 1 and fn:
+                fn >>= 1
+                sn >>= 1
+        else:
+            root = node_hash(root, sibling)
+        fn >>= 1
+        sn >>= 1
+    return root if sn == 0 else None
+
+
+def block_hash(previous_hash, election_id, index, first_position, size, root):
+    header = f'{election_id}:{index}:{first_position}:{size}'.encode()
+    return _sha256(bytes.fromhex(previous_hash), header, bytes.fromhex(root)).hex()
+
+
+# Receipts
+
+def commitment(vote):
+    """Receipt of a vote: hash of its ballot and salt"""
+    timestamp = vote.timestamp
+    if timezone.is_aware(timestamp):
+        timestamp = timestamp.astimezone(dt_timezone.utc)
+    ballot = f'vote:v1|{vote.election_id}|{vote.voter_id}|{vote.candidate_id}|{timestamp.isoformat()}|{vote.salt}'
+    return hashlib.sha256(ballot.encode()).hexdigest()
+
+
+def stamp(vote):
+    """Give a new vote its salt and receipt"""
+    if not vote.salt:
+        vote.salt = secrets.token_hex(16)
+    vote.receipt = commitment(vote)
+    return vote
+
+
+# Tree over blocks: perfect subtrees are stored as LedgerNode(level, index)
+
+def _peaks(size):
+    """(level, index) of the complete subtrees covering blocks [0, size), left to right"""
+    peaks, start = [], 0
+    for level in range(size.bit_length() - 1, -1, -1):
+        if size & (1 << level):
+            peaks.append((level, start >> level))
+            start += 1 << level
+    return peaks
+
+
+def _bag(digests):
+    """Election root from the peak digests (right to left, as RFC 6962 splits)"""
+    root = digests[-1]
+    for digest in reversed(digests[:-1]):
+        root = node_hash(digest, root)
+    return root
+
+
+def _nodes(election_id, keys):
+    keys = set(keys)
+    if not keys:
+        return {}
+    levels = {level for level, _ in keys}
+    indexes = {index for _, index in keys}
+    rows = LedgerNode.objects.filter(election_id=election_id, level__in=levels, index__in=indexes)
+    return {
+        (level, index): bytes.fromhex(digest)
+        for level, index, digest in rows.values_list('level', 'index', 'digest')
+        if (level, index) in keys
+    }
+
+
+def _append_node(election_id, block_index, block_root):
+    """Store block `block_index` in the tree over blocks and return the new election root"""
+    digest = leaf_hash(bytes.fromhex(block_root))
+    created = [LedgerNode(election_id=election_id, level=0, index=block_index, digest=digest.hex())]
+    # Left siblings this block completes a subtree with
+    siblings = [
+        (level, (block_index >> level) - 1)
+        for level in range(block_index.bit_length())
+        if (block_index >> level) & 1
+    ]
+    size = block_index + 1
+    known = _nodes(election_id, siblings + _peaks(size))
+    known[(0, block_index)] = digest
+    level, index = 0, block_index
+    while index & 1:
+        digest = node_hash(known[(level, index - 1)], digest)
+        level, index = level + 1, index >> 1
+        known[(level, index)] = digest
+        created.append(LedgerNode(election_id=election_id, level=level, index=index, digest=digest.hex()))
+    LedgerNode.objects.bulk_create(created)
+    return _bag([known[peak] for peak in _peaks(size)]).hex()
+
+
+def _upper_path(index, size, nodes):
+    """Audit path of block `index` in the tree over `size` blocks, from stored subtrees"""
+    def subtree(start, end):
+        count = end - start
+        if count & (count - 1) == 0:
+            level = count.bit_length() - 1
+            return nodes[(level, start >> level)]
+        k = _split(count)
+        return node_hash(subtree(start, start + k), subtree(start + k, end))
+
+    def path(start, end):
+        if end - start <= 1:
+            return []
+        k = _split(end - start)
+        if index < start + k:
+            return path(start, start + k) + [subtree(start + k, end)]
+        return path(start + k, end) + [subtree(start, start + k)]
+
+    return path(0, size)
+
+
+# Sealing
+
+def _place(votes):
+    """Write the salt, receipt and position of sealed votes (bulk_update's CASE expressions are slow on big batches)"""
+    opts = Vote._meta
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {table} SET {salt} = %s, {receipt} = %s, {position} = %s WHERE {pk} = %s'.format(
+        table=quote(opts.db_table),
+        salt=quote(opts.get_field('salt').column),
+        receipt=quote(opts.get_field('receipt').column),
+        position=quote(opts.get_field('ledger_position').column),
+        pk=quote(opts.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(vote.salt, vote.receipt, vote.ledger_position, vote.pk) for vote in votes])
+
+
+def seal_batch(election_id):
+    """Seal the oldest unsealed votes of an election into one block; returns it, or None"""
+    with use_primary(), transaction.atomic():
+        # One sealer per election at a time. NO KEY UPDATE does not conflict with
+        # the key share lock a vote insert takes on its election
+        list(Election.objects.select_for_update(no_key=True).filter(pk=election_id).values_list('pk'))
+        votes = list(
+            Vote.objects.filter(election_id=election_id, ledger_position__isnull=True)
+            .order_by('pk')[:_batch_size()]
+        )
+        if not votes:
+            return None
+        last = LedgerBlock.objects.filter(election_id=election_id).order_by('-index').first()
+        index = last.index + 1 if last else 0
+        first_position = last.first_position + last.size if last else 0
+        previous_hash = last.chain_hash if last else GENESIS
+
+        for position, vote in enumerate(votes, first_position):
+            if not vote.receipt:
+                # Written without cast_ballot (bulk loads, the admin)
+                stamp(vote)
+            vote.ledger_position = position
+        _place(votes)
+
+        root = merkle_root([leaf_hash(bytes.fromhex(vote.receipt)) for vote in votes]).hex()
+        return LedgerBlock.objects.create(
+            election_id=election_id, index=index, first_position=first_position, size=len(votes),
+            merkle_root=root, previous_hash=previous_hash,
+            chain_hash=block_hash(previous_hash, election_id, index, first_position, len(votes), root),
+            election_root=_append_node(election_id, index, root),
+        )
+
+
+def seal(election_id):
+    """Seal all unsealed votes of an election; returns the number of blocks written"""
+    blocks = 0
+    while seal_batch(election_id) is not None:
+        blocks += 1
+    if blocks:
+        logger.info("Sealed %d ledger block(s) of election %s", blocks, election_id)
+    return blocks
+
+
+def seal_pending(now=None):
+    """Sealing pass over the elections that have opened; returns {election id: blocks written}"""
+    now = now or timezone.now()
+    sealed = {}
+    for election_id in Election.objects.filter(start_time__lte=now).values_list('pk', flat=True):
+        # An index probe on (election, ledger_position) per election
+        if Vote.objects.filter(election_id=election_id, ledger_position__isnull=True).exists():
+            sealed[election_id] = seal(election_id)
+    return sealed
+
+
+def head(election_id):
+    """The latest block of an election, or None"""
+    return LedgerBlock.objects.filter(election_id=election_id).order_by('-index').first()
+
+
+# Inclusion proofs
+
+def inclusion_proof(election_id, receipt):
+    """
+    Proof that a receipt is part of the election's ledger, or None when no
+    sealed vote has it (yet).
+    """
+    with use_primary():
+        vote = Vote.objects.filter(
+            election_id=election_id, receipt=receipt, ledger_position__isnull=False
+        ).only('ledger_position').first()
+        if vote is None:
+            return None
+        position = vote.ledger_position
+        block = LedgerBlock.objects.filter(
+            election_id=election_id, first_position__lte=position
+        ).order_by('-index').first()
+        latest = head(election_id)
+        receipts = list(
+            Vote.objects.filter(
+                election_id=election_id, ledger_position__gte=block.first_position,
+                ledger_position__lt=block.first_position + block.size,
+            ).order_by('ledger_position').values_list('receipt', flat=True)
+        )
+        size = latest.index + 1
+        siblings = [(level, (block.index >> level) ^ 1) for level in range(size.bit_length())]
+        nodes = _nodes(election_id, siblings + _peaks(size))
+
+    leaves = [leaf_hash(bytes.fromhex(value)) for value in receipts]
+    return {
+        'election_id': election_id,
+        'receipt': receipt,
+        'position': position,
+        'block': {
+            'index': block.index,
+            'first_position': block.first_position,
+            'size': block.size,
+            'merkle_root': block.merkle_root,
+            'chain_hash': block.chain_hash,
+        },
+        'block_path': [digest.hex() for digest in merkle_path(leaves, position - block.first_position)],
+        'blocks': size,
+        'election_path': [digest.hex() for digest in _upper_path(block.index, size, nodes)],
+        'election_root': latest.election_root,
+        'head_chain_hash': latest.chain_hash,
+    }
+
+
+def verify_proof(proof):
+    """Check an inclusion proof on its own (no database)"""
+    block = proof['block']
+    root = root_from_path(
+        leaf_hash(bytes.fromhex(proof['receipt'])), proof['position'] - block['first_position'], block['size'],
+        [bytes.fromhex(digest) for digest in proof['block_path']],
+    )
+    if root is None or root.hex() != block['merkle_root']:
+        return False
+    root = root_from_path(
+        leaf_hash(root), block['index'], proof['blocks'],
+        [bytes.fromhex(digest) for digest in proof['election_path']],
+    )
+    return root is not None and root.hex() == proof['election_root']
+
+
+# Verification
+
+def verify_blocks(election_id, blocks):
+    """
+    Recompute the receipts and Merkle roots of some blocks of an election.
+    `blocks` is a list of (index, first_position, size, merkle_root);
+    returns a list of problems.
+    """
+    problems = []
+    for index, first_position, size, expected in blocks:
+        votes = Vote.objects.filter(
+            election_id=election_id, ledger_position__gte=first_position, ledger_position__lt=first_position + size,
+        ).order_by('ledger_position').only(
+            'election_id', 'voter_id', 'candidate_id', 'timestamp', 'salt', 'receipt', 'ledger_position'
+        )
+        leaves = []
+        for vote in votes.iterator(chunk_size=2000):
+            if commitment(vote) != vote.receipt:
+                problems.append(f"Block {index}: vote {vote.pk} at position {vote.ledger_position} was altered")
+            leaves.append(leaf_hash(bytes.fromhex(vote.receipt)))
+        if len(leaves) != size:
+            problems.append(f"Block {index}: {size - len(leaves)} of {size} votes are missing")
+        elif merkle_root(leaves).hex() != expected:
+            problems.append(f"Block {index}: Merkle root does not match")
+    return problems
+
+
+def _verify_chunk(args):
+    """Worker process: verify a chunk of blocks on its own database connection"""
+    try:
+        return verify_blocks(*args)
+    finally:
+        connections.close_all()
+
+
+def _chunks(items, count):
+    size = -(-len(items) // count)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def verify_election(election_id, workers=None):
+    """
+    Re-check an election's whole ledger; returns a list of problems (empty
+    when intact). Blocks are recomputed by `workers` processes (default: one
+    per CPU core); the chain and the election tree are checked here.
+    """
+    workers = workers or os.cpu_count() or 1
+    with use_primary():
+        blocks = list(LedgerBlock.objects.filter(election_id=election_id).order_by('index'))
+        stored = {
+            (level, index): digest
+            for level, index, digest in LedgerNode.objects.filter(election_id=election_id).values_list(
+                'level', 'index', 'digest'
+            )
+        }
+        unsealed = Vote.objects.filter(election_id=election_id, ledger_position__isnull=True).count()
+        end = blocks[-1].first_position + blocks[-1].size if blocks else 0
+        stray = Vote.objects.filter(election_id=election_id, ledger_position__gte=end).count()
+
+    problems = []
+    if unsealed:
+        problems.append(f"{unsealed} vote(s) not sealed yet")
+    if stray:
+        problems.append(f"{stray} vote(s) placed after the last block")
+
+    # Chain and election tree: cheap, in order
+    previous_hash, position, peaks = GENESIS, 0, []
+    for block in blocks:
+        if block.previous_hash != previous_hash or block.first_position != position:
+            problems.append(f"Block {block.index}: does not follow block {block.index - 1}")
+        expected = block_hash(
+            block.previous_hash, election_id, block.index, block.first_position, block.size, block.merkle_root
+        )
+        if block.chain_hash != expected:
+            problems.append(f"Block {block.index}: chain hash does not match")
+        previous_hash, position = block.chain_hash, block.first_position + block.size
+
+        digest, level, index = leaf_hash(bytes.fromhex(block.merkle_root)), 0, block.index
+        if stored.get((0, index)) != digest.hex():
+            problems.append(f"Block {block.index}: stored tree node does not match")
+        while index & 1:
+            left = peaks.pop()
+            digest, level, index = node_hash(left, digest), level + 1, index >> 1
+            if stored.get((level, index)) != digest.hex():
+                problems.append(f"Block {block.index}: stored tree node at level {level} does not match")
+        peaks.append(digest)
+        if _bag(peaks).hex() != block.election_root:
+            problems.append(f"Block {block.index}: election root does not match")
+
+    # Receipts and block roots: the bulk of the work, spread over processes
+    work = [(block.index, block.first_position, block.size, block.merkle_root) for block in blocks]
+    if workers > 1 and len(work) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Children open their own connections
+        connections.close_all()
+        chunks = [(election_id, chunk) for chunk in _chunks(work, workers * 4)]
+        with multiprocessing.get_context('fork').Pool(min(workers, len(chunks))) as pool:
+            for chunk_problems in pool.imap(_verify_chunk, chunks):
+                problems.extend(chunk_problems)
+    else:
+        with use_primary():
+            problems.extend(verify_blocks(election_id, work))
+    return problems
@@ -0,0 +1,110 @@
+"""
+Election lifecycle scheduler.
+
+An election's state is derived from start_time and end_time at read time,
+so nothing happens at the boundaries by itself. The run_election_scheduler
+command calls LifecycleScheduler.tick() in a loop, sleeping until the next
+boundary, and sends a signal for each transition:
+
+    election_opening  ELECTION_WARMUP_LEAD seconds before start_time
+    election_opened   at start_time
+    election_closed   ELECTION_CLOSE_GRACE seconds after end_time, once votes in
+                      flight have committed (and for any finished election not
+                      yet finalized)
+
+The receivers in signals.py warm the ballot cache before an election opens,
+rebuild the home page sections right after each boundary and, at closing,
+finalize the election (results.finalize_election seals the ledger, checks
+the tallies and writes the results snapshot) and cache the rendered
+results payload. This way the first visitors after a boundary do not pay
+for that work. Warm caches only reach the web workers through a shared
+cache backend; the results snapshot is stored in the database and helps
+with any backend.
+
+Closing is driven by "finished but not finalized", so a scheduler that was
+down catches up when it restarts. An election already finalized by the
+results page or the finalize_elections command was closed the same way. Receivers must be idempotent because
+opening and opened can repeat after a restart.
+"""
+import logging
+from datetime import timedelta
+
+from django.db.models import Min, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Election
+from .results import close_grace
+
+logger = logging.getLogger(__name__)
+
+# Sent with election=<Election>
+election_opening = Signal()
+election_opened = Signal()
+election_closed = Signal()
+
+
+class LifecycleScheduler:
+    """Detects election transitions between ticks and sends the lifecycle signals"""
+
+    def __init__(self, lead=300, max_sleep=30):
+        self.lead = timedelta(seconds=lead)
+        self.max_sleep = max_sleep
+        self.last_tick = None
+        # (election id, start_time) pairs already warmed by this process
+        self.warmed = set()
+
+    def tick(self, now=None):
+        """Send the signals for transitions due at `now`; returns [(event, election)]"""
+        now = now or timezone.now()
+        events = []
+
+        opening = Election.objects.filter(is_active=True, start_time__gt=now, start_time__lte=now + self.lead)
+        for election in opening:
+            key = (election.id, election.start_time)
+            if key not in self.warmed:
+                self.warmed.add(key)
+                events.append(('opening', election))
+
+        if self.last_tick is not None:
+            opened = Election.objects.filter(
+                is_active=True, start_time__gt=self.last_tick, start_time__lte=now, end_time__gt=now
+            )
+            events.extend(('opened', election) for election in opened)
+
+        closed = Election.objects.filter(
+            end_time__lt=now - close_grace(), result_snapshot__isnull=True
+        ).order_by('end_time')
+        events.extend(('closed', election) for election in closed)
+
+        signals = {'opening': election_opening, 'opened': election_opened, 'closed': election_closed}
+        for event, election in events:
+            # A failing hook is retried on a later tick (closing) or skipped; others still run
+            for receiver, result in signals[event].send_robust(sender=Election, election=election):
+                if isinstance(result, Exception):
+                    logger.error(
+                        "Election %s %s hook %r failed", election.id, event, receiver, exc_info=result
+                    )
+
+        self.last_tick = now
+        return events
+
+    def next_wakeup(self, now=None):
+        """Seconds until the next boundary (warm-up, start or closing), at most max_sleep"""
+        now = now or timezone.now()
+        grace = close_grace()
+        boundaries = Election.objects.filter(end_time__gte=now - grace).aggregate(
+            next_start=Min('start_time', filter=Q(is_active=True, start_time__gt=now)),
+            next_warmup=Min('start_time', filter=Q(is_active=True, start_time__gt=now + self.lead)),
+            next_end=Min('end_time'),
+        )
+        candidates = [now + timedelta(seconds=self.max_sleep)]
+        if boundaries['next_start'] is not None:
+            candidates.append(boundaries['next_start'])
+        if boundaries['next_warmup'] is not None:
+            candidates.append(boundaries['next_warmup'] - self.lead)
+        if boundaries['next_end'] is not None:
+            candidates.append(boundaries['next_end'] + grace)
+        # The boundary itself does not count yet; wake just after it
+        return max(0.0, (min(candidates) - now).total_seconds()) + 0.05
+
@@ -0,0 +1,196 @@
+"""
+Live election status over Server-Sent Events.
+
+Each election that has subscribers gets one producer task per worker
+process. The task recomputes the status every LIVE_STATUS_INTERVAL seconds and
+fans the same message out to all connected clients, so the database load
+does not grow with the number of open browsers. Idle connections receive a
+heartbeat comment every LIVE_STATUS_HEARTBEAT seconds.
+
+Streaming needs the ASGI application (online_voting_system.asgi); under WSGI
+each open stream would pin a worker, so the view answers 501 there.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+from .entity_cache import aget_election, get_election
+from .models import Election
+from .results import aget_final_results, get_final_results
+from .tallies import aelection_total
+
+
+def _finished_status(final_results):
+    return {
+        'is_ongoing': False,
+        'is_upcoming': False,
+        'is_finished': True,
+        'total_votes': final_results['total_votes'],
+        'time_left': None,
+    }
+
+
+def _election_status(election):
+    data = {
+        'is_ongoing': election.is_ongoing,
+        'is_upcoming': election.is_upcoming,
+        'is_finished': election.is_finished,
+        'total_votes': election.total_votes,
+        'time_left': None,
+    }
+
+    if election.is_ongoing:
+        time_left = election.end_time - timezone.now()
+        data['time_left'] = int(time_left.total_seconds())
+
+    return data
+
+
+def compute_status(election_id):
+    """
+    Build the public status of an election.
+
+    Raises Election.DoesNotExist for unknown elections.
+    """
+    final_results = get_final_results(election_id)
+    if final_results is not None:
+        return _finished_status(final_results)
+
+    return _election_status(get_election(election_id))
+
+
+async def acompute_status(election_id):
+    """Async counterpart of compute_status"""
+    final_results = await aget_final_results(election_id)
+    if final_results is not None:
+        return _finished_status(final_results)
+
+    election = await aget_election(election_id)
+    election.total_votes = await aelection_total(election_id)
+    return _election_status(election)
+
+
+class ElectionChannel:
+    """Subscribers of one election and the task producing its messages"""
+
+    def __init__(self, election_id):
+        self.election_id = election_id
+        self.subscribers = set()
+        self.task = None
+        self.last_message = None
+
+
+class StatusBroadcaster:
+    """Shares one periodically computed status message per election among all subscribers"""
+
+    def __init__(self, interval=2.0, heartbeat=15.0):
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.channels = {}
+        self.counters = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'messages_computed': 0,
+            'messages_sent': 0,
+            'heartbeats_sent': 0,
+            'compute_errors': 0,
+        }
+
+    def subscribe(self, election_id):
+        """Register a subscriber queue and make sure the election's producer is running"""
+        channel = self.channels.get(election_id)
+        if channel is None:
+            channel = self.channels[election_id] = ElectionChannel(election_id)
+
+        # Only the latest message matters; slow clients skip intermediate ones
+        queue = asyncio.Queue(maxsize=1)
+        if channel.last_message is not None:
+            queue.put_nowait(channel.last_message)
+        channel.subscribers.add(queue)
+        self.counters['connections_opened'] += 1
+
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.create_task(self._produce(channel))
+        return queue
+
+    def unsubscribe(self, election_id, queue):
+        channel = self.channels.get(election_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(queue)
+        self.counters['connections_closed'] += 1
+        if not channel.subscribers:
+            if channel.task is not None:
+                channel.task.cancel()
+            del self.channels[election_id]
+
+    async def _produce(self, channel):
+        while channel.subscribers:
+            try:
+                status = await acompute_status(channel.election_id)
+            except Election.DoesNotExist:
+                message = DELETED
+            except Exception:
+                self.counters['compute_errors'] += 1
+                await asyncio.sleep(self.interval)
+                continue
+            else:
+                message = format_event('status', status)
+            self.counters['messages_computed'] += 1
+            channel.last_message = message
+
+            for queue in list(channel.subscribers):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(message)
+            if message is DELETED:
+                # Nothing left to report; stream() ends after sending it
+                return
+            await asyncio.sleep(self.interval)
+
+    async def stream(self, election_id):
+        """Async iterator of SSE frames for one client"""
+        queue = self.subscribe(election_id)
+        try:
+            yield f'retry: {int(self.interval * 1000)}\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    self.counters['heartbeats_sent'] += 1
+                    yield ': heartbeat\n\n'
+                    continue
+                self.counters['messages_sent'] += 1
+                yield message
+                if message is DELETED:
+                    break
+        finally:
+            self.unsubscribe(election_id, queue)
+
+    def stats(self):
+        """Counters plus open connections, overall and per election"""
+        per_election = {
+            election_id: len(channel.subscribers)
+            for election_id, channel in self.channels.items()
+        }
+        return dict(
+            self.counters,
+            connections=sum(per_election.values()),
+            connections_per_election=per_election,
+        )
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+# Sent once when the election is gone, then the stream ends
+DELETED = format_event('deleted', {})
+
+
+broadcaster = StatusBroadcaster(
+    interval=getattr(settings, 'LIVE_STATUS_INTERVAL', 2.0),
+    heartbeat=getattr(settings, 'LIVE_STATUS_HEARTBEAT', 15.0),
+)
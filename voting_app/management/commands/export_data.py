@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from voting_app.exports import EXPORTS, FORMATS, ExportError, export_queryset, parse_moment, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream votes or audit log entries as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--election', type=int, help="Only votes of this election")
+        parser.add_argument('--action', help="Only audit entries with this action")
+        parser.add_argument('--since', help="ISO date or datetime (inclusive)")
+        parser.add_argument('--until', help="ISO date or datetime (inclusive)")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output")
+        parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            queryset = export_queryset(
+                options['kind'],
+                election=options['election'],
+                since=parse_moment(options['since']) if options['since'] else None,
+                until=parse_moment(options['until'], end_of_day=True) if options['until'] else None,
+                action=options['action'],
+            )
+            content = stream_export(queryset, format=options['format'], compress=options['gzip'])
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for piece in content:
+                    output.write(piece)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            output = getattr(self.stdout._out, 'buffer', None)
+            if output is None:
+                # Text stream (e.g. call_command(stdout=StringIO()))
+                if options['gzip']:
+                    raise CommandError("--gzip needs --output or a binary stdout.")
+                for piece in content:
+                    self.stdout.write(piece.decode('utf-8'), ending='')
+                return
+            for piece in content:
+                output.write(piece)
+            output.flush()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from voting_app.models import Election
+from voting_app.results import cache_results, close_grace, finalize_election
+
+
+class Command(BaseCommand):
+    help = "Close finished elections that have not been finalized yet: seal the ledger, check tallies, snapshot results"
+
+    def handle(self, *args, **options):
+        elections = Election.objects.filter(
+            # Votes in flight at end_time get ELECTION_CLOSE_GRACE seconds to commit
+            end_time__lt=timezone.now() - close_grace(),
+            result_snapshot__isnull=True
+        )
+
+        finalized = 0
+        for election in elections:
+            cache_results(finalize_election(election))
+            finalized += 1
+            self.stdout.write(f"Finalized: {election.title}")
+
+        self.stdout.write(self.style.SUCCESS(f"Finalized {finalized} election(s)."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from voting_app.audit import get_audit_buffer
+
+
+class Command(BaseCommand):
+    help = "Write audit entries spilled to AUDIT_LOG_SPOOL_DIR (e.g. by crashed workers) to the database"
+
+    def handle(self, *args, **options):
+        buffer = get_audit_buffer()
+        if buffer.spool_dir is None:
+            self.stdout.write(self.style.WARNING("AUDIT_LOG_SPOOL_DIR is not configured."))
+            return
+
+        replayed = buffer.replay_spool()
+        self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} audit entries from {buffer.spool_dir}."))
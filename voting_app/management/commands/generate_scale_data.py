@@ -0,0 +1,144 @@
+"""
+Seed a database with election-day scale data for benchmarks and load tests.
+
+Creates N voters (all sharing one password, hashed once), a mix of ongoing,
+upcoming and finished elections with their candidates, and votes for a
+configurable share of the voters in every ongoing or finished election.
+Everything is written with bulk_create; tallies are rebuilt and finished
+elections finalized at the end, so the database looks like a live
+deployment rather than a fresh one.
+"""
+import random
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from voting_app.models import Candidate, Election, UserProfile, Vote
+from voting_app.results import cache_results, finalize_election, is_settled
+from voting_app.tallies import rebuild_tallies
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Generate voters, elections, candidates and votes at scale (benchmarks, load tests)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--elections', type=int, default=10)
+        parser.add_argument('--candidates', type=int, default=4, help="Candidates per election")
+        parser.add_argument('--turnout', type=float, default=0.5, help="Share of voters voting in each open or finished election")
+        parser.add_argument('--password', default='scale-pass-123', help="Password of every generated voter")
+        parser.add_argument('--prefix', default='scale', help="Username/voter ID prefix (must be unused)")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users with the prefix {prefix!r} already exist; pick another --prefix.")
+        if not 0 <= options['turnout'] <= 1:
+            raise CommandError("--turnout must be between 0 and 1.")
+
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+
+        with transaction.atomic():
+            organizer = User.objects.create_user(f'{prefix}-organizer', is_staff=True)
+            voter_ids = self.create_voters(prefix, options['users'], make_password(options['password']), rng)
+            elections = self.create_elections(prefix, options['elections'], organizer)
+            candidates = self.create_candidates(elections, options['candidates'])
+            votes = self.create_votes(elections, candidates, voter_ids, options['turnout'], rng)
+
+        rebuild_tallies()
+        finished = [election for election in elections if is_settled(election)]
+        for election in finished:
+            cache_results(finalize_election(election))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(voter_ids)} voters, {len(elections)} elections ({len(finished)} finished), "
+            f"{sum(len(c) for c in candidates.values())} candidates and {votes} votes "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+
+    def create_voters(self, prefix, count, password, rng):
+        for start in range(0, count, BATCH_SIZE):
+            numbers = range(start, min(start + BATCH_SIZE, count))
+            User.objects.bulk_create([
+                User(
+                    username=f'{prefix}-voter-{n}',
+                    email=f'{prefix}-voter-{n}@example.com',
+                    first_name='Voter',
+                    last_name=str(n),
+                    password=password,
+                )
+                for n in numbers
+            ])
+        user_ids = list(
+            User.objects.filter(username__startswith=f'{prefix}-voter-').values_list('id', flat=True)
+        )
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            UserProfile.objects.bulk_create([
+                UserProfile(
+                    user_id=user_id,
+                    voter_id=f'{prefix}-{user_id}',
+                    date_of_birth=date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 50)),
+                )
+                for user_id in user_ids[start:start + BATCH_SIZE]
+            ])
+        return user_ids
+
+    def create_elections(self, prefix, count, organizer):
+        now = timezone.now()
+        elections = []
+        for n in range(count):
+            # Half ongoing, a quarter upcoming, a quarter finished
+            phase = n % 4
+            if phase in (0, 1):
+                start, end = now - timedelta(hours=1 + n), now + timedelta(days=1 + n)
+            elif phase == 2:
+                start, end = now + timedelta(days=1 + n), now + timedelta(days=2 + n)
+            else:
+                start, end = now - timedelta(days=2 + n), now - timedelta(days=1 + n)
+            elections.append(Election(
+                title=f'{prefix} election {n}',
+                description=f'Generated election {n}',
+                start_time=start,
+                end_time=end,
+                is_active=True,
+                created_by=organizer,
+            ))
+        Election.objects.bulk_create(elections)
+        return list(Election.objects.filter(title__startswith=f'{prefix} election ').order_by('id'))
+
+    def create_candidates(self, elections, per_election):
+        Candidate.objects.bulk_create([
+            Candidate(election=election, name=f'Candidate {n}', party=f'Party {n % 3}')
+            for election in elections
+            for n in range(per_election)
+        ])
+        candidates = {}
+        for candidate_id, election_id in Candidate.objects.filter(
+            election__in=elections
+        ).values_list('id', 'election_id'):
+            candidates.setdefault(election_id, []).append(candidate_id)
+        return candidates
+
+    def create_votes(self, elections, candidates, voter_ids, turnout, rng):
+        created = 0
+        for election in elections:
+            if election.is_upcoming or not candidates.get(election.id):
+                continue
+            voters = rng.sample(voter_ids, int(len(voter_ids) * turnout))
+            choices = candidates[election.id]
+            for start in range(0, len(voters), BATCH_SIZE):
+                Vote.objects.bulk_create([
+                    Vote(voter_id=voter_id, election=election, candidate_id=rng.choice(choices))
+                    for voter_id in voters[start:start + BATCH_SIZE]
+                ])
+            created += len(voters)
+        return created
@@ -0,0 +1,307 @@
+"""
+Bulk voter-roll import.
+
+Streams a CSV with the columns
+
+    username, email, first_name, last_name, voter_id, date_of_birth[, phone_number][, password]
+
+validates each row like the registration form, hashes passwords across a
+process pool and bulk_creates User/UserProfile rows chunk by chunk. Every
+committed chunk is recorded in a progress file, so an interrupted import can
+simply be re-run. With --invite (or when a row has no password) the account
+gets an unusable password and an invite link for the password-reset-confirm
+page is written to --invites-out.
+
+The progress file also records how far --invites-out and --errors-out had
+been written; a re-run cuts them back to that point and processes the
+unrecorded chunk again, so no line is written twice. Voters of that chunk
+who were committed before the interruption are skipped as already
+registered, and those still without a usable password get a fresh invite.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.tokens import default_token_generator
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from voting_app.forms import validate_voter_age
+from voting_app.models import UserProfile
+
+REQUIRED_COLUMNS = ('username', 'email', 'first_name', 'last_name', 'voter_id', 'date_of_birth')
+
+username_validator = UnicodeUsernameValidator()
+
+
+def _init_worker():
+    django.setup()
+
+
+def hash_password(args):
+    """Validate and hash one password (runs in a pool process)"""
+    password, username, email, first_name, last_name = args
+    try:
+        validate_password(
+            password,
+            user=User(username=username, email=email, first_name=first_name, last_name=last_name)
+        )
+    except ValidationError as e:
+        return None, e.messages
+    return make_password(password), None
+
+
+def clean_row(row):
+    """Validate a CSV row the way CustomUserCreationForm does; returns (data, errors)"""
+    data = {key: (row.get(key) or '').strip() for key in REQUIRED_COLUMNS + ('phone_number',)}
+    data['password'] = row.get('password') or ''
+    errors = []
+
+    for key in REQUIRED_COLUMNS:
+        if not data[key]:
+            errors.append(f"{key} is required.")
+    if errors:
+        return data, errors
+
+    try:
+        username_validator(data['username'])
+    except ValidationError as e:
+        errors.extend(e.messages)
+    if len(data['username']) > 150:
+        errors.append("username has more than 150 characters.")
+    try:
+        validate_email(data['email'])
+    except ValidationError as e:
+        errors.extend(e.messages)
+    for key, max_length in (('first_name', 30), ('last_name', 30), ('voter_id', 20), ('phone_number', 15)):
+        if len(data[key]) > max_length:
+            errors.append(f"{key} has more than {max_length} characters.")
+    try:
+        data['date_of_birth'] = date.fromisoformat(data['date_of_birth'])
+        validate_voter_age(data['date_of_birth'])
+    except ValueError:
+        errors.append("date_of_birth must be YYYY-MM-DD.")
+    except ValidationError as e:
+        errors.extend(e.messages)
+    return data, errors
+
+
+class Command(BaseCommand):
+    help = "Import voters from a CSV file in bulk (resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Password hashing processes")
+        parser.add_argument(
+            '--invite',
+            action='store_true',
+            help="Ignore the password column; set unusable passwords and write invite links"
+        )
+        parser.add_argument('--invites-out', help="CSV file for invite links (username, email, path)")
+        parser.add_argument('--errors-out', help="CSV file for rejected rows (line, voter_id, errors)")
+        parser.add_argument('--state', help="Progress file (default: <csv_path>.progress)")
+        parser.add_argument('--restart', action='store_true', help="Ignore saved progress and start over")
+
+    def handle(self, *args, **options):
+        csv_path = Path(options['csv_path'])
+        if not csv_path.exists():
+            raise CommandError(f"{csv_path} does not exist.")
+        self.state_path = Path(options['state'] or f'{csv_path}.progress')
+        resume_from, written = 0, {}
+        if self.state_path.exists() and not options['restart']:
+            state = json.loads(self.state_path.read_text())
+            resume_from, written = state['line'], state['written']
+            self.stdout.write(f"Resuming after row {resume_from}.")
+
+        self.invite = options['invite']
+        self.workers = options['workers'] or 1
+        self.outputs = {
+            name: self.open_output(options[option], written.get(name, 0))
+            for name, option in (('invites', 'invites_out'), ('rejects', 'errors_out'))
+            if options[option]
+        }
+        self.invites = self.outputs.get('invites')
+        self.rejects = self.outputs.get('rejects')
+        self.totals = {'created': 0, 'rejected': 0, 'skipped': 0}
+
+        started = time.monotonic()
+        processed = resume_from
+        try:
+            with open(csv_path, newline='', encoding='utf-8-sig') as handle, \
+                    ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+                reader = csv.DictReader(handle)
+                missing = set(REQUIRED_COLUMNS) - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f"Missing columns: {', '.join(sorted(missing))}")
+
+                chunk = []
+                for line, row in enumerate(reader, start=1):
+                    if line <= resume_from:
+                        continue
+                    chunk.append((line, row))
+                    if len(chunk) >= options['chunk_size']:
+                        self.import_chunk(chunk, pool)
+                        processed = line
+                        self.save_progress(processed)
+                        self.report(processed - resume_from, started)
+                        chunk = []
+                if chunk:
+                    self.import_chunk(chunk, pool)
+                    processed = chunk[-1][0]
+                    self.save_progress(processed)
+        finally:
+            for output in self.outputs.values():
+                output.close()
+
+        self.report(processed - resume_from, started)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {self.totals['created']} created, {self.totals['skipped']} already registered, "
+            f"{self.totals['rejected']} rejected."
+        ))
+
+    def open_output(self, path, size):
+        """Open an output CSV for appending, dropped back to `size` bytes (0: a new import)"""
+        output = open(path, 'a', newline='')
+        output.truncate(size)
+        return output
+
+    def save_progress(self, line):
+        """Record the rows done and, once they are on disk, the output sizes that go with them"""
+        written = {}
+        for name, output in self.outputs.items():
+            output.flush()
+            os.fsync(output.fileno())
+            written[name] = output.tell()
+        partial = self.state_path.with_name(f'{self.state_path.name}.tmp')
+        partial.write_text(json.dumps({'line': line, 'written': written}))
+        partial.replace(self.state_path)
+
+    def report(self, rows, started):
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(f"{rows} rows processed ({rate:.0f} rows/s), {self.totals['created']} created")
+
+    def reject(self, line, data, errors):
+        self.totals['rejected'] += 1
+        if self.rejects is not None:
+            csv.writer(self.rejects).writerow([line, data.get('voter_id', ''), ' '.join(errors)])
+
+    def import_chunk(self, chunk, pool):
+        rows = []
+        seen = {'username': set(), 'email': set(), 'voter_id': set()}
+        for line, row in chunk:
+            data, errors = clean_row(row)
+            for key in seen:
+                if data[key] in seen[key]:
+                    errors.append(f"Duplicate {key} within the file.")
+                seen[key].add(data[key])
+            if errors:
+                self.reject(line, data, errors)
+            else:
+                rows.append((line, data))
+
+        # Uniqueness against the database, one query per column for the whole chunk
+        existing_voter_ids = set(UserProfile.objects.filter(
+            voter_id__in=[data['voter_id'] for _, data in rows]
+        ).values_list('voter_id', flat=True))
+        existing_usernames = set(User.objects.filter(
+            username__in=[data['username'] for _, data in rows]
+        ).values_list('username', flat=True))
+        existing_emails = set(User.objects.filter(
+            email__in=[data['email'] for _, data in rows]
+        ).values_list('email', flat=True))
+
+        accepted = []
+        skipped = []
+        for line, data in rows:
+            if data['voter_id'] in existing_voter_ids:
+                # Already imported (e.g. a re-run without the progress file)
+                self.totals['skipped'] += 1
+                skipped.append(data['voter_id'])
+            elif data['username'] in existing_usernames:
+                self.reject(line, data, ["A user with that username already exists."])
+            elif data['email'] in existing_emails:
+                self.reject(line, data, ["This email is already registered."])
+            else:
+                accepted.append((line, data))
+
+        with_password = [(line, data) for line, data in accepted if data['password'] and not self.invite]
+        hashed = pool.map(
+            hash_password,
+            [(data['password'], data['username'], data['email'], data['first_name'], data['last_name'])
+             for _, data in with_password],
+            chunksize=max(1, len(with_password) // (4 * self.workers))
+        )
+        passwords = {}
+        for (line, data), (password, errors) in zip(with_password, hashed):
+            if errors:
+                self.reject(line, data, errors)
+            else:
+                passwords[line] = password
+
+        users = []
+        profiles = []
+        for line, data in accepted:
+            if data['password'] and not self.invite and line not in passwords:
+                continue  # Rejected by the password validators
+            user = User(
+                username=data['username'],
+                email=data['email'],
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+            )
+            if line in passwords:
+                user.password = passwords[line]
+            else:
+                user.set_unusable_password()
+            users.append(user)
+            profiles.append(data)
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            user_ids = dict(User.objects.filter(
+                username__in=[user.username for user in users]
+            ).values_list('username', 'id'))
+            UserProfile.objects.bulk_create([
+                UserProfile(
+                    user_id=user_ids[data['username']],
+                    voter_id=data['voter_id'],
+                    phone_number=data['phone_number'],
+                    date_of_birth=data['date_of_birth'],
+                )
+                for data in profiles
+            ])
+        self.totals['created'] += len(users)
+
+        if self.invites is not None:
+            for user in users:
+                user.pk = user_ids[user.username]
+            # Imported before, maybe by a run that stopped before writing their invites
+            users += User.objects.filter(userprofile__voter_id__in=skipped).order_by('pk')
+            self.write_invites(users)
+
+    def write_invites(self, users):
+        writer = csv.writer(self.invites)
+        for user in users:
+            if user.has_usable_password():
+                continue
+            path = reverse('password_reset_confirm', kwargs={
+                'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+                'token': default_token_generator.make_token(user),
+            })
+            writer.writerow([user.username, user.email, path])
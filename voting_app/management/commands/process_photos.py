@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from voting_app.models import Candidate
+from voting_app.photos import process_photo
+
+
+class Command(BaseCommand):
+    help = "Render photo variants for candidates whose current photo has not been processed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-render every photo (e.g. after changing sizes)")
+
+    def handle(self, *args, **options):
+        candidates = Candidate.objects.exclude(photo='').exclude(photo__isnull=True).only('id', 'photo', 'photo_variants')
+
+        processed = 0
+        for candidate in candidates.iterator():
+            if not options['all'] and candidate.photo_variants.get('source') == candidate.photo.name:
+                continue
+            if process_photo(candidate.pk, force=options['all']):
+                processed += 1
+                self.stdout.write(f"Processed: {candidate.photo.name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} photo(s)."))
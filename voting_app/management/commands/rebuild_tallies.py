@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from voting_app.models import Election
+from voting_app.tallies import rebuild_tallies, verify_tallies
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or, with --verify, check) the vote tally store from Vote rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, help="Only process the election with this ID")
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Report mismatches without changing anything; exits non-zero on drift"
+        )
+
+    def handle(self, *args, **options):
+        election = None
+        if options['election'] is not None:
+            try:
+                election = Election.objects.get(id=options['election'])
+            except Election.DoesNotExist:
+                raise CommandError(f"Election {options['election']} does not exist.")
+
+        if options['verify']:
+            mismatches = verify_tallies(election)
+        else:
+            mismatches = rebuild_tallies(election)
+
+        for candidate_id, tallied, votes in mismatches:
+            self.stdout.write(f"Candidate {candidate_id}: tally={tallied} votes={votes}")
+
+        if options['verify'] and mismatches:
+            raise CommandError(f"{len(mismatches)} tally mismatch(es) found.")
+
+        if options['verify']:
+            self.stdout.write(self.style.SUCCESS("Tally store matches Vote rows."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {len(mismatches)} tally row(s)."))
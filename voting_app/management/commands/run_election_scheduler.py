@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from voting_app import ledger
+from voting_app.lifecycle import LifecycleScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the election lifecycle scheduler (cache warm-up before opening, ledger sealing, "
+        "finalization at closing)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lead',
+            type=float,
+            default=getattr(settings, 'ELECTION_WARMUP_LEAD', 300),
+            help="Seconds before start_time to warm caches"
+        )
+        parser.add_argument(
+            '--max-sleep',
+            type=float,
+            default=getattr(settings, 'ELECTION_SCHEDULER_MAX_SLEEP', 30),
+            help="Longest pause between checks (picks up edited elections)"
+        )
+        parser.add_argument(
+            '--seal-interval',
+            type=float,
+            default=getattr(settings, 'LEDGER_SEAL_INTERVAL', 10),
+            help="Seconds between two passes sealing new votes into the ledger"
+        )
+        parser.add_argument('--once', action='store_true', help="Run a single check and exit")
+
+    def handle(self, *args, **options):
+        scheduler = LifecycleScheduler(lead=options['lead'], max_sleep=options['max_sleep'])
+        while True:
+            for event, election in scheduler.tick():
+                self.stdout.write(f"{event}: {election.title} (#{election.id})")
+            for election_id, blocks in ledger.seal_pending().items():
+                self.stdout.write(f"ledger: sealed {blocks} block(s) of election #{election_id}")
+            if options['once']:
+                break
+            delay = min(scheduler.next_wakeup(), options['seal_interval'])
+            close_old_connections()
+            time.sleep(delay)
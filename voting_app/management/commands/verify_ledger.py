@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting_app import ledger
+from voting_app.models import Election
+
+
+class Command(BaseCommand):
+    help = "Re-check an election's vote ledger: receipts, block roots, the hash chain and the election root"
+
+    def add_arguments(self, parser):
+        parser.add_argument('election', type=int, help="ID of the election to verify")
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes recomputing blocks (default: one per CPU core)"
+        )
+        parser.add_argument('--seal', action='store_true', help="Seal the votes not in the ledger yet first")
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(id=options['election'])
+        except Election.DoesNotExist:
+            raise CommandError(f"Election {options['election']} does not exist.")
+
+        if options['seal']:
+            self.stdout.write(f"Sealed {ledger.seal(election.id)} block(s).")
+
+        started = time.monotonic()
+        problems = ledger.verify_election(election.id, workers=options['workers'])
+        elapsed = time.monotonic() - started
+
+        for problem in problems:
+            self.stdout.write(problem)
+        if problems:
+            raise CommandError(f"{len(problems)} ledger problem(s) found.")
+
+        latest = ledger.head(election.id)
+        if latest is None:
+            self.stdout.write(self.style.SUCCESS("No votes in the ledger."))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Ledger intact: {latest.first_position + latest.size} votes in {latest.index + 1} block(s), "
+            f"verified in {elapsed:.2f}s with {options['workers']} worker(s)."
+        ))
+        self.stdout.write(f"Chain hash:    {latest.chain_hash}")
+        self.stdout.write(f"Election root: {latest.election_root}")
@@ -0,0 +1,455 @@
+"""
+Prometheus metrics shared by all worker processes.
+
+Every process writes its counters, histograms and gauges to its own
+memory-mapped file in METRICS_DIR (metrics-<pid>.db): an append-only table
+of (sample key, float64) entries, so an increment is a dictionary lookup
+and an 8-byte write. The /metrics view reads the files of all processes,
+sums them and renders the Prometheus text format. No lock is shared between
+processes, and nothing is read from the Vote table at scrape time: votes
+are counted as they are cast.
+
+Counters and histograms of processes that have exited keep counting, so
+totals do not drop when gunicorn recycles a worker: a starting process
+folds the files of exited processes (including one that had its pid) into
+metrics-aggregate.db and removes them, so METRICS_DIR holds one file per
+live process plus the aggregate. Gauges only count live processes. Merging
+and scraping exclude each other through a lock file, so a scrape never
+counts a merged file twice or misses it.
+
+Settings:
+    METRICS_DIR    Directory of the per-process files (default <tmp>/voting-metrics)
+    METRICS_TOKEN  Bearer token required by /metrics (default None, no token)
+"""
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+FILE_PREFIX = 'metrics-'
+FILE_SUFFIX = '.db'
+AGGREGATE_FILE = f'{FILE_PREFIX}aggregate{FILE_SUFFIX}'
+LOCK_FILE = 'metrics.lock'
+
+INITIAL_FILE_SIZE = 64 * 1024
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; the request latency buckets of voting_app.instrumentation in ms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_HEADER = struct.Struct('I')
+_LENGTH = struct.Struct('I')
+_VALUE = struct.Struct('d')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _file_pid(path):
+    """Pid of a per-process value file, None for the aggregate or other files"""
+    try:
+        return int(path.name[len(FILE_PREFIX):-len(FILE_SUFFIX)])
+    except ValueError:
+        return None
+
+
+def _is_gauge(key):
+    return isinstance(REGISTRY.get(json.loads(key)[0]), Gauge)
+
+
+class ValueFile:
+    """
+    Append-only key -> float64 table in a memory-mapped file.
+
+    Layout: a 4-byte "bytes used" header, then entries of a 4-byte key
+    length, the UTF-8 key padded to 8 bytes and an 8-byte value. The header
+    is written after the entry, so readers never see half an entry.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        # Always a new file: Store merges the file of an earlier process with our pid first
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        os.ftruncate(self._fd, INITIAL_FILE_SIZE)
+        self._size = INITIAL_FILE_SIZE
+        self._map = mmap.mmap(self._fd, self._size)
+        self._used = 8
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions = {}
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode()
+            padded = len(encoded) + (-(_LENGTH.size + len(encoded)) % 8)
+            entry_size = _LENGTH.size + padded + _VALUE.size
+            if self._used + entry_size > self._size:
+                self._grow(self._used + entry_size)
+            _LENGTH.pack_into(self._map, self._used, len(encoded))
+            self._map[self._used + _LENGTH.size:self._used + _LENGTH.size + len(encoded)] = encoded
+            position = self._used + _LENGTH.size + padded
+            _VALUE.pack_into(self._map, position, 0.0)
+            self._used += entry_size
+            _HEADER.pack_into(self._map, 0, self._used)
+            self._positions[key] = position
+        return position
+
+    def _grow(self, needed):
+        while self._size < needed:
+            self._size *= 2
+        self._map.close()
+        os.ftruncate(self._fd, self._size)
+        self._map = mmap.mmap(self._fd, self._size)
+
+    def add(self, key, amount):
+        position = self._position(key)
+        _VALUE.pack_into(self._map, position, _VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def set(self, key, value):
+        _VALUE.pack_into(self._map, self._position(key), value)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @staticmethod
+    def read(path):
+        """Yield (key, value) pairs of a value file"""
+        data = Path(path).read_bytes()
+        if len(data) < _HEADER.size:
+            return
+        used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+        offset = 8
+        while offset + _LENGTH.size <= used:
+            length = _LENGTH.unpack_from(data, offset)[0]
+            key = data[offset + _LENGTH.size:offset + _LENGTH.size + length].decode()
+            offset += _LENGTH.size + length + (-(_LENGTH.size + length) % 8)
+            yield key, _VALUE.unpack_from(data, offset)[0]
+            offset += _VALUE.size
+
+
+class Store:
+    """This process's value file, reopened after a fork"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def directory(self):
+        return Path(getattr(settings, 'METRICS_DIR', None) or Path(tempfile.gettempdir()) / 'voting-metrics')
+
+    @contextmanager
+    def _locked(self, directory, operation):
+        """Hold the directory's lock file (shared to scrape, exclusive to merge)"""
+        with open(directory / LOCK_FILE, 'a') as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def _ensure_open(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            directory = self.directory()
+            directory.mkdir(parents=True, exist_ok=True)
+            with self._locked(directory, fcntl.LOCK_EX):
+                self._merge_exited(directory)
+            self._file = ValueFile(directory / f'{FILE_PREFIX}{pid}{FILE_SUFFIX}')
+            self._pid = pid
+
+    def _merge_exited(self, directory):
+        """
+        Add the counters of exited processes to the aggregate file and remove
+        their files (caller holds the exclusive lock). A file with our own pid
+        is left by an earlier process that had the same pid.
+        """
+        exited = []
+        for path in directory.glob(f'{FILE_PREFIX}*{FILE_SUFFIX}'):
+            pid = _file_pid(path)
+            if pid is not None and (pid == os.getpid() or not _pid_alive(pid)):
+                exited.append(path)
+        if not exited:
+            return
+
+        aggregate = directory / AGGREGATE_FILE
+        totals = defaultdict(float)
+        for path in exited + ([aggregate] if aggregate.exists() else []):
+            for key, value in ValueFile.read(path):
+                if not _is_gauge(key):
+                    totals[key] += value
+
+        staging = directory / f'.{AGGREGATE_FILE}.{os.getpid()}'
+        staging.unlink(missing_ok=True)
+        merged = ValueFile(staging)
+        for key, value in totals.items():
+            merged.set(key, value)
+        merged.close()
+        os.replace(staging, aggregate)
+        for path in exited:
+            path.unlink()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._ensure_open()
+            self._file.add(key, amount)
+
+    def set(self, key, value):
+        with self._lock:
+            self._ensure_open()
+            self._file.set(key, value)
+
+    def collect(self):
+        """{key: summed value} over all processes; gauges of dead processes are left out"""
+        totals = defaultdict(float)
+        directory = self.directory()
+        if not directory.exists():
+            return totals
+        with self._locked(directory, fcntl.LOCK_SH):
+            for path in directory.glob(f'{FILE_PREFIX}*{FILE_SUFFIX}'):
+                pid = _file_pid(path)
+                if pid is None and path.name != AGGREGATE_FILE:
+                    continue
+                alive = None
+                try:
+                    for key, value in ValueFile.read(path):
+                        if _is_gauge(key):
+                            if alive is None:
+                                alive = pid is not None and _pid_alive(pid)
+                            if not alive:
+                                continue
+                        totals[key] += value
+                except FileNotFoundError:
+                    continue
+        return totals
+
+    def reset(self):
+        """Remove all value files, including the aggregate (tests)"""
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+            self._pid = None
+            for path in self.directory().glob(f'{FILE_PREFIX}*{FILE_SUFFIX}'):
+                path.unlink(missing_ok=True)
+
+
+store = Store()
+
+REGISTRY = {}
+
+
+def _key(name, sample, labels):
+    return json.dumps([name, sample, labels], separators=(',', ':'))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        if len(labels) != len(self.labelnames) or not all(name in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return [[name, str(labels[name])] for name in self.labelnames]
+
+    def _key(self, labels):
+        cache_key = tuple(sorted(labels.items()))
+        key = self._keys.get(cache_key)
+        if key is None:
+            key = self._keys[cache_key] = _key(self.name, '', self._labels(labels))
+        return key
+
+    def samples(self, values):
+        """[(sample name, labels, value)] of this metric in the collected values"""
+        return sorted(
+            (self.name + sample, labels, value) for (name, sample, labels), value in values.get(self.name, ())
+        )
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store.add(self._key(labels), amount)
+
+
+class Gauge(Metric):
+    """Per-process value, summed over the live processes"""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        store.set(self._key(labels), value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        index = bisect_left(self.buckets, value)
+        bound = self.buckets[index] if index < len(self.buckets) else math.inf
+        # Buckets are stored non-cumulative and added up when rendered
+        store.add(_key(self.name, '_bucket', labels + [['le', _format_value(bound)]]), 1)
+        store.add(_key(self.name, '_sum', labels), value)
+        store.add(_key(self.name, '_count', labels), 1)
+
+    def samples(self, values):
+        series = defaultdict(lambda: {'buckets': defaultdict(float), 'sum': 0.0, 'count': 0.0})
+        for (name, sample, labels), value in values.get(self.name, ()):
+            if sample == '_bucket':
+                series[tuple(map(tuple, labels[:-1]))]['buckets'][labels[-1][1]] += value
+            else:
+                series[tuple(map(tuple, labels))][sample[1:]] += value
+
+        samples = []
+        for labels, data in sorted(series.items()):
+            labels = [list(pair) for pair in labels]
+            cumulative = 0.0
+            for bound in self.buckets + (math.inf,):
+                le = _format_value(bound)
+                cumulative += data['buckets'].get(le, 0.0)
+                samples.append((self.name + '_bucket', labels + [['le', le]], cumulative))
+            samples.append((self.name + '_sum', labels, data['sum']))
+            samples.append((self.name + '_count', labels, data['count']))
+        return samples
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return f'{value:.1f}'
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{label}="{_escape(text)}"' for label, text in labels) + '}'
+    return f'{name} {_format_value(value)}'
+
+
+def render(extra=()):
+    """
+    All metrics in the Prometheus text exposition format.
+
+    `extra` holds (name, type, help, value) tuples computed at scrape time.
+    """
+    values = defaultdict(list)
+    for key, value in store.collect().items():
+        name, sample, labels = json.loads(key)
+        values[name].append(((name, sample, labels), value))
+
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        lines.extend(_format_sample(*sample) for sample in metric.samples(values))
+    for name, metric_type, documentation, value in extra:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.append(_format_sample(name, [], value))
+    return '\n'.join(lines) + '\n'
+
+
+def cache_hit_ratio(values=None):
+    """Share of cache lookups that hit, over all processes (None before any lookup)"""
+    values = store.collect() if values is None else values
+    hits = values.get(_key(CACHE_LOOKUPS.name, '', [['result', 'hit']]), 0.0)
+    misses = values.get(_key(CACHE_LOOKUPS.name, '', [['result', 'miss']]), 0.0)
+    return hits / (hits + misses) if hits + misses else None
+
+
+VOTES_CAST = Counter(
+    'voting_votes_cast_total', "Votes recorded, by election", ['election'],
+)
+VOTE_REJECTIONS = Counter(
+    'voting_vote_rejections_total', "Ballots rejected, by reason", ['reason'],
+)
+REGISTRATIONS = Counter(
+    'voting_registrations_total', "Voters registered through the sign-up form",
+)
+REQUESTS = Counter(
+    'voting_http_requests_total', "HTTP requests, by view and status class", ['view', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'voting_http_request_duration_seconds', "Wall time of HTTP requests, by view", ['view'],
+)
+CACHE_LOOKUPS = Counter(
+    'voting_cache_lookups_total', "Cache get() calls, by result (hit or miss)", ['result'],
+)
+ENTITY_CACHE_LOOKUPS = Counter(
+    'voting_entity_cache_lookups_total', "Election/candidate reads, by the tier that served them", ['tier'],
+)
+AUDIT_BUFFER_DEPTH = Gauge(
+    'voting_audit_buffer_depth', "Audit entries queued in memory and not yet written",
+)
+DB_POOL_SIZE = Gauge(
+    'voting_db_pool_connections', "Connections open in the database pools", ['alias'],
+)
+DB_POOL_AVAILABLE = Gauge(
+    'voting_db_pool_connections_idle', "Pooled connections not lent to a request", ['alias'],
+)
+DB_POOL_MAX_SIZE = Gauge(
+    'voting_db_pool_connections_max', "Connections the database pools may open", ['alias'],
+)
+DB_POOL_WAITING = Gauge(
+    'voting_db_pool_requests_waiting', "Requests waiting for a pooled connection", ['alias'],
+)
+DB_POOL_CHECKOUTS = Counter(
+    'voting_db_pool_checkouts_total', "Connections lent out by the database pools", ['alias'],
+)
+DB_POOL_QUEUED = Counter(
+    'voting_db_pool_checkouts_queued_total', "Checkouts that had to wait for a connection", ['alias'],
+)
+DB_POOL_WAIT = Counter(
+    'voting_db_pool_checkout_wait_seconds_total', "Time spent waiting for pooled connections", ['alias'],
+)
+DB_POOL_ERRORS = Counter(
+    'voting_db_pool_checkout_errors_total', "Checkouts that timed out or failed", ['alias'],
+)
+DB_POOL_CONNECTIONS_OPENED = Counter(
+    'voting_db_pool_connections_opened_total', "Connections opened by the database pools", ['alias'],
+)
+DB_POOL_CONNECTIONS_LOST = Counter(
+    'voting_db_pool_connections_lost_total', "Pooled connections found broken and discarded", ['alias'],
+)
+ADMISSION_ADMITTED = Counter(
+    'voting_admission_admitted_total', "Guarded requests let through to the view", ['scope'],
+)
+ADMISSION_REJECTIONS = Counter(
+    'voting_admission_rejections_total', "Guarded requests turned away, by reason (rate_user, rate_ip, overload)",
+    ['scope', 'reason'],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'voting_admission_in_flight', "Guarded requests in progress",
+)
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_tallies(apps, schema_editor):
+    Candidate = apps.get_model('voting_app', 'Candidate')
+    VoteTally = apps.get_model('voting_app', 'VoteTally')
+    candidates = Candidate.objects.annotate(vote_total=Count('votes')).values_list('id', 'election_id', 'vote_total')
+    VoteTally.objects.bulk_create(
+        VoteTally(candidate_id=candidate_id, election_id=election_id, votes=votes)
+        for candidate_id, election_id, votes in candidates
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('candidate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tally', to='voting_app.candidate')),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='voting_app.election')),
+            ],
+        ),
+        migrations.RunPython(backfill_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0002_votetally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_votes', models.PositiveIntegerField(default=0)),
+                ('results', models.JSONField(default=list, help_text='Candidates ordered by votes, with counts and percentages')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('election', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result_snapshot', to='voting_app.election')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0004_auditlog_event_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['-timestamp'], name='auditlog_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', '-timestamp'], name='auditlog_action_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='election',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['end_time', 'start_time'], name='election_active_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='election',
+            index=models.Index(fields=['-end_time'], name='election_end_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0006_candidate_photo_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='minimum_voter_age',
+            field=models.PositiveSmallIntegerField(default=18, help_text='Age voters must have reached on the day the election opens'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('is_eligible', True)), fields=['date_of_birth'], name='profile_eligible_dob_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting_app', '0007_eligibility'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('first_position', models.PositiveBigIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('merkle_root', models.CharField(help_text='Merkle root of the receipts in this block', max_length=64)),
+                ('previous_hash', models.CharField(max_length=64)),
+                ('chain_hash', models.CharField(help_text='Hash of this block chained to the previous one', max_length=64)),
+                ('election_root', models.CharField(help_text="Merkle root over the election's blocks up to and including this one", max_length=64)),
+                ('sealed_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+            options={
+                'ordering': ['election', 'index'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField()),
+                ('index', models.PositiveIntegerField()),
+                ('digest', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='ledger_position',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='receipt',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='salt',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['receipt'], name='vote_receipt_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('election', 'ledger_position'), name='vote_ledger_position_unique'),
+        ),
+        migrations.AddField(
+            model_name='ledgerblock',
+            name='election',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_blocks', to='voting_app.election'),
+        ),
+        migrations.AddField(
+            model_name='ledgernode',
+            name='election',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_nodes', to='voting_app.election'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ledgerblock',
+            unique_together={('election', 'index')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='ledgernode',
+            unique_together={('election', 'level', 'index')},
+        ),
+    ]
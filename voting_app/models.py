@@ -1,8 +1,9 @@
 from django.db import models
+from django.db.models import Sum
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from PIL import Image
+from django.utils.functional import cached_property
 
 
 class UserProfile(models.Model):
@@ -14,6 +15,17 @@ class UserProfile(models.Model):
     is_eligible = models.BooleanField(default=True, help_text="Whether user is eligible to vote")
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Eligible voter counts and lists: age rules are ranges on
+            # date_of_birth (see voting_app/eligibility.py)
+            models.Index(
+                fields=['date_of_birth'],
+                condition=models.Q(is_eligible=True),
+                name='profile_eligible_dob_idx'
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.user.username} - {self.voter_id}"
     
@@ -31,12 +43,27 @@ class Election(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     is_active = models.BooleanField(default=False)
+    minimum_voter_age = models.PositiveSmallIntegerField(
+        default=18, help_text="Age voters must have reached on the day the election opens"
+    )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_elections')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # home(): active elections that have not ended yet. Partial on is_active
+            # (SQLite cannot seek on a bare boolean column); end_time leads because
+            # it stays selective as finished elections pile up.
+            models.Index(
+                fields=['end_time', 'start_time'],
+                condition=models.Q(is_active=True),
+                name='election_active_window_idx'
+            ),
+            # home(): recently finished elections
+            models.Index(fields=['-end_time'], name='election_end_time_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -64,10 +91,10 @@ class Election(models.Model):
         now = timezone.now()
         return self.end_time < now
     
-    @property
+    @cached_property
     def total_votes(self):
-        """Get total number of votes cast in this election"""
-        return self.votes.count()
+        """Get total number of votes cast in this election (from the tally store)"""
+        return self.tallies.aggregate(total=Sum('votes'))['total'] or 0
 
 
 class Candidate(models.Model):
@@ -77,6 +104,13 @@ class Candidate(models.Model):
     party = models.CharField(max_length=100, blank=True)
     bio = models.TextField(blank=True, help_text="Candidate biography/manifesto")
     photo = models.ImageField(upload_to='candidate_photos/', blank=True, null=True)
+    # Filled in by the photo worker (voting_app/photos.py)
+    photo_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    photo_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    photo_variants = models.JSONField(
+        default=dict, blank=True, editable=False,
+        help_text="Resized JPEG/WebP renditions of the current photo"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -86,21 +120,61 @@ class Candidate(models.Model):
     def __str__(self):
         return f"{self.name} - {self.election.title}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Photo name as stored, to detect replaced uploads on save
+        instance._stored_photo = instance.__dict__.get('photo')
+        return instance
+    
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        photo_saved = update_fields is None or 'photo' in update_fields
+        
+        # Images are processed in the background, and only when the file changed
+        self._photo_changed = photo_saved and bool(self.photo) and (
+            not self.photo._committed or self.photo.name != getattr(self, '_stored_photo', None)
+        )
+        if self._photo_changed:
+            self.photo_width = self.photo_height = None
+        elif photo_saved and not self.photo:
+            self.photo_width = self.photo_height = None
+            self.photo_variants = {}
         
-        # Resize image if uploaded
-        if self.photo:
-            img = Image.open(self.photo.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                img.save(self.photo.path)
+        super().save(*args, **kwargs)
+        self._stored_photo = self.photo.name if self.photo else None
     
-    @property
+    def photo_sources(self):
+        """URLs and sizes of the photo and its processed variants, or None without a photo"""
+        if not self.photo:
+            return None
+        sources = {
+            'url': self.photo.url,
+            'width': self.photo_width,
+            'height': self.photo_height,
+            'variants': [],
+        }
+        # Variants of a previous upload are ignored until the new one is processed
+        if self.photo_variants.get('source') == self.photo.name:
+            storage = self.photo.storage
+            sources['variants'] = [
+                {
+                    'width': variant['width'],
+                    'height': variant['height'],
+                    'jpeg': storage.url(variant['jpeg']),
+                    'webp': storage.url(variant['webp']),
+                }
+                for variant in self.photo_variants['sizes']
+            ]
+        return sources
+    
+    @cached_property
     def vote_count(self):
-        """Get number of votes for this candidate"""
-        return self.votes.count()
+        """Get number of votes for this candidate (from the tally store)"""
+        try:
+            return self.tally.votes
+        except VoteTally.DoesNotExist:
+            return 0
     
     @property
     def vote_percentage(self):
@@ -116,12 +190,28 @@ class Vote(models.Model):
     voter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='votes')
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='votes')
     election = models.ForeignKey(Election, on_delete=models.CASCADE, related_name='votes')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the ballot is cast: it is part of the vote's receipt
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
+    # Vote ledger (voting_app/ledger.py): receipt = hash of the ballot and salt,
+    # position = place in the election's ledger once its batch is sealed
+    salt = models.CharField(max_length=32, blank=True, editable=False)
+    receipt = models.CharField(max_length=64, blank=True, editable=False)
+    ledger_position = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
     
     class Meta:
         unique_together = ['voter', 'election']  # Ensure one vote per user per election
         ordering = ['-timestamp']
+        indexes = [
+            # Per-candidate counts within an election (covers the GROUP BY)
+            models.Index(fields=['election', 'candidate'], name='vote_election_candidate_idx'),
+            # Inclusion proofs look votes up by receipt
+            models.Index(fields=['receipt'], name='vote_receipt_idx'),
+        ]
+        constraints = [
+            # Also finds the votes a sealer has not placed yet (position NULL)
+            models.UniqueConstraint(fields=['election', 'ledger_position'], name='vote_ledger_position_unique'),
+        ]
     
     def __str__(self):
         return f"{self.voter.username} voted for {self.candidate.name} in {self.election.title}"
@@ -141,16 +231,76 @@ class Vote(models.Model):
             raise ValidationError("User is not eligible to vote.")
 
 
+class VoteTally(models.Model):
+    """Materialized vote counter for a candidate, kept in step with Vote rows"""
+    candidate = models.OneToOneField(Candidate, on_delete=models.CASCADE, related_name='tally')
+    election = models.ForeignKey(Election, on_delete=models.CASCADE, related_name='tallies')
+    votes = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.candidate.name}: {self.votes}"
+
+
+class LedgerBlock(models.Model):
+    """A sealed batch of an election's votes in the vote ledger"""
+    election = models.ForeignKey(Election, on_delete=models.CASCADE, related_name='ledger_blocks')
+    index = models.PositiveIntegerField()
+    first_position = models.PositiveBigIntegerField()
+    size = models.PositiveIntegerField()
+    merkle_root = models.CharField(max_length=64, help_text="Merkle root of the receipts in this block")
+    previous_hash = models.CharField(max_length=64)
+    chain_hash = models.CharField(max_length=64, help_text="Hash of this block chained to the previous one")
+    election_root = models.CharField(
+        max_length=64, help_text="Merkle root over the election's blocks up to and including this one"
+    )
+    sealed_at = models.DateTimeField(default=timezone.now, editable=False)
+    
+    class Meta:
+        unique_together = ['election', 'index']
+        ordering = ['election', 'index']
+    
+    def __str__(self):
+        return f"{self.election.title} - block {self.index}"
+
+
+class LedgerNode(models.Model):
+    """Complete subtree of the Merkle tree over an election's ledger blocks (for inclusion proofs)"""
+    election = models.ForeignKey(Election, on_delete=models.CASCADE, related_name='ledger_nodes')
+    level = models.PositiveSmallIntegerField()
+    index = models.PositiveIntegerField()
+    digest = models.CharField(max_length=64)
+    
+    class Meta:
+        unique_together = ['election', 'level', 'index']
+
+
+class ResultSnapshot(models.Model):
+    """Immutable final results of a finished election"""
+    election = models.OneToOneField(Election, on_delete=models.CASCADE, related_name='result_snapshot')
+    total_votes = models.PositiveIntegerField(default=0)
+    results = models.JSONField(default=list, help_text="Candidates ordered by votes, with counts and percentages")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Results - {self.election.title}"
+
+
 class AuditLog(models.Model):
     """Model to track important system events for security"""
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     action = models.CharField(max_length=100)
     details = models.TextField(blank=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when the (possibly batched) row is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Admin changelist: newest first, optionally filtered by action
+            models.Index(fields=['-timestamp'], name='auditlog_timestamp_idx'),
+            models.Index(fields=['action', '-timestamp'], name='auditlog_action_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.action} - {self.timestamp}"
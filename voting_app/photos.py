@@ -0,0 +1,173 @@
+"""
+Candidate photo processing.
+
+Saving a candidate never decodes its photo. When the photo file changes,
+the candidate id is handed (after commit) to a background worker thread
+that renders JPEG and WebP variants at each of CANDIDATE_PHOTO_SIZES,
+records the original dimensions and stores the variant list on the
+candidate with a single UPDATE. The update only applies if the candidate
+still has the same photo, so a slow job never overwrites a newer upload.
+
+Variants of a photo are only used once they are recorded for that exact
+file (see Candidate.photo_sources); until then pages fall back to the
+original. Jobs lost with a worker process are picked up by the
+process_photos management command.
+
+Settings:
+    CANDIDATE_PHOTO_ASYNC    Process on a background thread (default True; False processes inline after commit)
+    CANDIDATE_PHOTO_SIZES    Longest side of each variant in pixels (default (96, 192, 384))
+    CANDIDATE_PHOTO_QUALITY  JPEG/WebP encoder quality (default 82)
+"""
+import io
+import logging
+import os
+import queue
+import threading
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .ballots import invalidate_ballot
+from .models import Candidate
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'candidate_photos/variants'
+
+
+def _encode(image, format, quality):
+    if format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        converted = image.convert('RGBA')
+        background.paste(converted, mask=converted.getchannel('A'))
+        image = background
+    output = io.BytesIO()
+    image.save(output, format=format, quality=quality, optimize=format == 'JPEG')
+    return ContentFile(output.getvalue())
+
+
+def render_variants(image, source_name, storage):
+    """Save resized JPEG and WebP copies of an image; returns their descriptions"""
+    sizes = sorted(getattr(settings, 'CANDIDATE_PHOTO_SIZES', (96, 192, 384)))
+    quality = getattr(settings, 'CANDIDATE_PHOTO_QUALITY', 82)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    stem = PurePosixPath(source_name).stem
+    variants = []
+    for size in sizes:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        variant = {'width': resized.width, 'height': resized.height}
+        for key, format in (('jpeg', 'JPEG'), ('webp', 'WEBP')):
+            name = f'{VARIANT_DIR}/{stem}-{size}.{key if key == "webp" else "jpg"}'
+            variant[key] = storage.save(name, _encode(resized, format, quality))
+        variants.append(variant)
+        if max(image.size) <= size:
+            break  # Never upscale; this variant is already full size
+    return variants
+
+
+def _variant_files(variants):
+    return {variant[key] for variant in variants.get('sizes', ()) for key in ('jpeg', 'webp')}
+
+
+def process_photo(candidate_id, force=False):
+    """
+    Render the variants of a candidate's current photo.
+
+    Returns True if the candidate was updated, False if there was nothing
+    to do (no photo, already processed unless force, or replaced meanwhile).
+    """
+    candidate = Candidate.objects.filter(pk=candidate_id).only('id', 'election_id', 'photo', 'photo_variants').first()
+    if candidate is None or not candidate.photo:
+        return False
+    source = candidate.photo.name
+    previous = candidate.photo_variants or {}
+    if previous.get('source') == source and not force:
+        return False
+
+    storage = candidate.photo.storage
+    with storage.open(source) as handle:
+        image = ImageOps.exif_transpose(Image.open(handle))
+        image.load()
+    variants = {'source': source, 'sizes': render_variants(image, source, storage)}
+
+    updated = Candidate.objects.filter(pk=candidate_id, photo=source).update(
+        photo_width=image.width,
+        photo_height=image.height,
+        photo_variants=variants,
+    )
+    # Drop whichever set of files is no longer referenced
+    stale = _variant_files(previous if updated else variants) - _variant_files(variants if updated else previous)
+    for name in stale:
+        storage.delete(name)
+    if updated:
+        invalidate_ballot(candidate.election_id)
+    return bool(updated)
+
+
+class PhotoWorker:
+    """Background thread processing candidate photos one at a time"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.counters = {'enqueued': 0, 'processed': 0, 'skipped': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        """(Re)start the worker thread, e.g. after a fork into a new worker"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        self._pid = pid
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='candidate-photo-worker', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, candidate_id):
+        with self._lock:
+            self._ensure_started()
+            self._queue.put(candidate_id)
+            self.counters['enqueued'] += 1
+
+    def _run(self):
+        while True:
+            candidate_id = self._queue.get()
+            try:
+                if process_photo(candidate_id):
+                    self.counters['processed'] += 1
+                else:
+                    self.counters['skipped'] += 1
+            except Exception:
+                self.counters['failed'] += 1
+                logger.exception("Could not process photo of candidate %s", candidate_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued photo has been processed"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def stats(self):
+        return dict(self.counters, depth=self._queue.qsize())
+
+
+worker = PhotoWorker()
+
+
+def schedule_processing(candidate):
+    """Process a candidate's new photo once the current transaction commits"""
+    candidate_id = candidate.pk
+    if getattr(settings, 'CANDIDATE_PHOTO_ASYNC', True):
+        transaction.on_commit(lambda: worker.enqueue(candidate_id))
+    else:
+        transaction.on_commit(lambda: process_photo(candidate_id))
@@ -0,0 +1,223 @@
+"""
+Final results for finished elections.
+
+Once an election is over its results cannot change, so they are computed once
+(from the tally store) into a ResultSnapshot row and served from the cache
+afterwards. A cached entry carries everything the results page needs, so
+repeat hits do not touch the database at all. Snapshots are built and read
+from the primary database: editing an election deletes its snapshot, and a
+lagging replica must not bring it back into the cache.
+
+A ballot checked just before end_time may still be committing after it, so
+the snapshot is only taken ELECTION_CLOSE_GRACE seconds after the end, with
+the election row locked: on PostgreSQL every vote insert holds a key-share
+lock on it until it commits, so the snapshot waits for the last of them.
+Until then finished elections show provisional results that are not cached.
+
+finalize_election is the one closing routine, whoever gets there first (the
+scheduler, the finalize_elections command or the first visitor of the
+results page): under that lock it seals the remaining votes into the
+ledger, records the head to publish in the audit log, corrects drifted
+tallies from the Vote rows and only then writes the snapshot.
+
+Cached payloads never expire on a shared cache, where editing or deleting an
+election drops them for every worker. With a per-process default cache
+(LocMem, i.e. no REDIS_URL) that only reaches the worker that made the
+change, so payloads are then kept for RESULTS_LOCAL_CACHE_TTL seconds.
+
+Settings:
+    ELECTION_CLOSE_GRACE     Seconds after end_time before results are frozen (default 5)
+    RESULTS_LOCAL_CACHE_TTL  Seconds a payload is cached with a per-process cache (default 5)
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import audit, ledger, tallies
+from .entity_cache import shared_backend
+from .models import Election, ResultSnapshot
+from .routing import use_primary
+
+logger = logging.getLogger(__name__)
+
+RESULTS_CACHE_KEY = 'election_results:{}'
+
+
+def close_grace():
+    return timedelta(seconds=getattr(settings, 'ELECTION_CLOSE_GRACE', 5))
+
+
+def is_settled(election, now=None):
+    """Whether an election ended long enough ago for its results to be frozen"""
+    return election.end_time + close_grace() < (now or timezone.now())
+
+
+def build_results(election):
+    """Compute the ordered candidate results of an election from the tally store"""
+    candidates = list(
+        election.candidates.select_related('tally').order_by('-tally__votes', 'name')
+    )
+    total_votes = sum(candidate.vote_count for candidate in candidates)
+
+    results = [
+        {
+            'id': candidate.id,
+            'name': candidate.name,
+            'party': candidate.party,
+            'photo': candidate.photo_sources(),
+            'vote_count': candidate.vote_count,
+            'percentage': round(candidate.vote_count / total_votes * 100, 2) if total_votes > 0 else 0,
+        }
+        for candidate in candidates
+    ]
+    return total_votes, results
+
+
+def _close(election):
+    """Seal the ledger, publish its head and check the tallies (caller holds the election lock)"""
+    ledger.seal(election.id)
+    latest = ledger.head(election.id)
+    if latest is not None:
+        # The record to publish: later changes to the votes no longer match it
+        audit.record(
+            None, 'LEDGER_SEALED',
+            f'Election {election.id}: {latest.first_position + latest.size} votes, '
+            f'chain hash {latest.chain_hash}, election root {latest.election_root}',
+            None,
+        )
+    corrected = tallies.rebuild_tallies(election)
+    if corrected:
+        logger.warning("Corrected %d drifted tallies of election %s before finalizing", len(corrected), election.id)
+
+
+def finalize_election(election):
+    """
+    Close a finished election: seal its ledger, check its tallies and write
+    the results snapshot.
+
+    Returns the existing snapshot if the election was already finalized.
+    """
+    if not is_settled(election):
+        raise ValueError(f"Election {election.id} has not finished yet.")
+
+    with use_primary():
+        try:
+            return ResultSnapshot.objects.get(election=election)
+        except ResultSnapshot.DoesNotExist:
+            pass
+
+        try:
+            with transaction.atomic():
+                # Wait for vote transactions still in flight on this election
+                Election.objects.select_for_update().only('pk').get(pk=election.pk)
+                snapshot = ResultSnapshot.objects.filter(election=election).first()
+                if snapshot is not None:
+                    # Finalized by whoever held the lock before us
+                    return snapshot
+                _close(election)
+                total_votes, results = build_results(election)
+                return ResultSnapshot.objects.create(
+                    election=election,
+                    total_votes=total_votes,
+                    results=results
+                )
+        except IntegrityError:
+            # Finalized concurrently by another request
+            return ResultSnapshot.objects.get(election=election)
+
+
+def snapshot_payload(snapshot):
+    """Build the cacheable results payload for a snapshot"""
+    return _payload(snapshot.election, snapshot.results, snapshot.total_votes)
+
+
+def _payload(election, results, total_votes):
+    return {
+        'election': {
+            'id': election.id,
+            'pk': election.pk,
+            'title': election.title,
+            'description': election.description,
+            'start_time': election.start_time,
+            'end_time': election.end_time,
+        },
+        'organizer': election.created_by.get_full_name() or election.created_by.username,
+        'candidates': results,
+        'total_votes': total_votes,
+    }
+
+
+def closing_results(election):
+    """
+    Results payload of a finished election: from its (cached) snapshot once
+    the grace period is over, provisional and uncached until then.
+    """
+    if is_settled(election):
+        return cache_results(finalize_election(election))
+    total_votes, results = build_results(election)
+    return _payload(election, results, total_votes)
+
+
+def _timeout():
+    """No expiry when invalidation reaches every worker, else a short TTL"""
+    if shared_backend():
+        return None
+    return getattr(settings, 'RESULTS_LOCAL_CACHE_TTL', 5)
+
+
+def cache_results(snapshot):
+    """Store a snapshot payload in the cache (see _timeout for how long)"""
+    payload = snapshot_payload(snapshot)
+    cache.set(RESULTS_CACHE_KEY.format(snapshot.election_id), payload, _timeout())
+    return payload
+
+
+def get_final_results(election_id):
+    """
+    Return the cached results payload of a finalized election.
+
+    Falls back to the snapshot table on a cache miss and returns None if the
+    election has not been finalized.
+    """
+    payload = cache.get(RESULTS_CACHE_KEY.format(election_id))
+    if payload is not None:
+        return payload
+
+    try:
+        with use_primary():
+            snapshot = ResultSnapshot.objects.select_related('election__created_by').get(election_id=election_id)
+    except ResultSnapshot.DoesNotExist:
+        return None
+    return cache_results(snapshot)
+
+
+async def aget_final_results(election_id):
+    """Async counterpart of get_final_results"""
+    payload = await cache.aget(RESULTS_CACHE_KEY.format(election_id))
+    if payload is not None:
+        return payload
+
+    try:
+        with use_primary():
+            snapshot = await ResultSnapshot.objects.select_related('election__created_by').aget(election_id=election_id)
+    except ResultSnapshot.DoesNotExist:
+        return None
+    payload = snapshot_payload(snapshot)
+    await cache.aset(RESULTS_CACHE_KEY.format(election_id), payload, _timeout())
+    return payload
+
+
+def invalidate_results(election):
+    """
+    Drop cached results after an election was edited.
+
+    The snapshot itself is discarded only if the election is no longer
+    finished (e.g. its end time was moved into the future).
+    """
+    cache.delete(RESULTS_CACHE_KEY.format(election.id))
+    if not election.is_finished:
+        ResultSnapshot.objects.filter(election=election).delete()
@@ -0,0 +1,150 @@
+"""
+Read-replica routing.
+
+With a 'replica' alias in DATABASES, views decorated with @replica_reads
+(home, the election list, results and the status API) read this app's
+models from the replica; everything else (including sessions and users),
+and every write, uses the primary ('default').
+
+Read-your-writes: after a client's successful POST (a vote, a registration,
+an admin edit) ReplicaRoutingMiddleware sets a cookie that keeps the
+client's reads on the primary for REPLICA_PIN_SECONDS, longer than the
+replica is expected to lag. Reads inside a transaction on the primary stay
+on the primary too.
+
+Caches that are invalidated when data changes (the entity cache, home page
+sections, final results) are filled with use_primary(): a lagging replica
+would otherwise put rows that were just replaced back into the cache.
+Caches that only expire (home page vote totals) are filled from the replica.
+
+Settings:
+    DATABASE_ROUTERS      Must include 'voting_app.routing.ReplicaRouter'
+    REPLICA_PIN_SECONDS   Seconds a client reads from the primary after a write (default 10)
+    REPLICA_PIN_COOKIE    Name of the pinning cookie (default 'primary_pin')
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+REPLICA = 'replica'
+
+# Apps whose models may be read from the replica
+REPLICA_APPS = {'voting_app'}
+
+# Alias reads go to in the current request (None: the primary)
+_read_alias = ContextVar('voting_read_alias', default=None)
+
+
+def replica_available():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    """Send reads in the block to the replica, if there is one"""
+    token = _read_alias.set(REPLICA if replica_available() else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Keep reads in the block on the primary"""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(view):
+    """
+    Let a view read from the replica unless the client is pinned to the
+    primary (see ReplicaRoutingMiddleware). Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not getattr(request, 'read_replica', False):
+                return await view(request, *args, **kwargs)
+            with use_replica():
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(request, 'read_replica', False):
+                return view(request, *args, **kwargs)
+            with use_replica():
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Reads of this app's models follow the current request's alias; writes always go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[PRIMARY].in_atomic_block:
+            return None
+        # Sessions and users stay on the primary: a session created by a login
+        # must be found on the very next request
+        if model._meta.app_label not in REPLICA_APPS:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}:
+            return True
+        return None
+
+
+def _pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+def _pin_cookie():
+    return getattr(settings, 'REPLICA_PIN_COOKIE', 'primary_pin')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks requests that may read from the replica (request.read_replica) and
+    pins the client to the primary for a while after a successful write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.process_request(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        self.process_request(request)
+        return self.process_response(request, await self.get_response(request))
+
+    def process_request(self, request):
+        request.read_replica = replica_available() and _pin_cookie() not in request.COOKIES
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and response.status_code < 400:
+            # The browser drops the cookie when the window is over
+            response.set_cookie(_pin_cookie(), '1', max_age=_pin_seconds(), httponly=True, samesite='Lax')
+        return response
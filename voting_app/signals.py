@@ -0,0 +1,93 @@
+from django.core.signals import request_finished
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Election, Candidate, Vote
+from . import (
+    ballots, db_pool, entity_cache, homepage, lifecycle, photos, results, tallies, voter_index,
+)
+
+
+@receiver(post_save, sender=Candidate)
+def create_candidate_tally(sender, instance, created, **kwargs):
+    """Give every new candidate an empty tally row"""
+    if created:
+        tallies.ensure_tally(instance)
+
+
+@receiver(post_save, sender=Candidate)
+def process_candidate_photo(sender, instance, **kwargs):
+    """Render photo variants in the background when the photo file changed"""
+    if getattr(instance, '_photo_changed', False):
+        photos.schedule_processing(instance)
+
+
+@receiver(post_delete, sender=Vote)
+def retract_deleted_vote(sender, instance, **kwargs):
+    """Keep the tally store in step when votes are removed (e.g. via the admin)"""
+    tallies.retract_vote(instance)
+
+
+@receiver(post_delete, sender=Vote)
+def forget_deleted_vote(sender, instance, **kwargs):
+    """Let the voter vote again: clear their bit in the has-voted index"""
+    voter_index.vote_deleted(instance)
+
+
+@receiver(post_save, sender=Election)
+def invalidate_election_results(sender, instance, created, **kwargs):
+    """Drop cached final results when an election is edited"""
+    if not created:
+        results.invalidate_results(instance)
+
+
+@receiver(post_save, sender=Election)
+@receiver(post_delete, sender=Election)
+def invalidate_home_sections(sender, instance, **kwargs):
+    """Elections were added, edited or removed: rebuild the home page lists"""
+    homepage.invalidate_home()
+
+
+@receiver(post_save, sender=Election)
+@receiver(post_delete, sender=Election)
+def bump_election_cache_version(sender, instance, **kwargs):
+    """Move the cached election and its candidates to a new version"""
+    entity_cache.invalidate_election(instance.pk)
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+def bump_candidate_cache_version(sender, instance, **kwargs):
+    """Candidates were added, edited or removed: new version of the election's entries"""
+    entity_cache.invalidate_election(instance.election_id)
+
+
+# Election lifecycle hooks (sent by the run_election_scheduler command)
+
+@receiver(lifecycle.election_opening)
+def warm_opening_election(sender, election, **kwargs):
+    """Load the ballot into the cache before the first voters arrive"""
+    ballots.warm_ballot(election.id)
+
+
+@receiver(lifecycle.election_opened)
+def refresh_home_on_open(sender, election, **kwargs):
+    """Move the election to the ongoing list right away"""
+    homepage.invalidate_home()
+    homepage.get_home_context()
+
+
+@receiver(lifecycle.election_closed)
+def finalize_closed_election(sender, election, **kwargs):
+    """Close the election (ledger, tallies, snapshot), cache the results and refresh the home page"""
+    results.cache_results(results.finalize_election(election))
+    homepage.invalidate_home()
+    homepage.get_home_context()
+
+
+# Request lifecycle
+
+@receiver(request_finished)
+def publish_pool_metrics(sender, **kwargs):
+    """Export connection pool usage once the request has returned its connection"""
+    db_pool.publish()
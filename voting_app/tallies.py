@@ -0,0 +1,112 @@
+"""
+Vote tally store.
+
+VoteTally rows hold a running vote count per candidate so that results pages,
+the admin and the status API never have to COUNT(*) over the Vote table.
+The counters are updated inside the same transaction that writes the vote.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Candidate, Vote, VoteTally
+
+
+def ensure_tally(candidate):
+    """Create the (empty) tally row for a candidate if it does not exist yet"""
+    tally, _ = VoteTally.objects.get_or_create(
+        candidate=candidate,
+        defaults={'election_id': candidate.election_id}
+    )
+    return tally
+
+
+def record_vote(vote):
+    """Increment the tally for the candidate a vote was cast for"""
+    updated = VoteTally.objects.filter(candidate_id=vote.candidate_id).update(votes=F('votes') + 1)
+    if not updated:
+        tally, created = VoteTally.objects.get_or_create(
+            candidate_id=vote.candidate_id,
+            defaults={'election_id': vote.election_id, 'votes': 1}
+        )
+        if not created:
+            VoteTally.objects.filter(pk=tally.pk).update(votes=F('votes') + 1)
+
+
+def retract_vote(vote):
+    """Decrement the tally after a vote has been deleted"""
+    VoteTally.objects.filter(candidate_id=vote.candidate_id, votes__gt=0).update(votes=F('votes') - 1)
+
+
+async def aelection_total(election_id):
+    """Async counterpart of Election.total_votes"""
+    result = await VoteTally.objects.filter(election_id=election_id).aaggregate(total=Sum('votes'))
+    return result['total'] or 0
+
+
+def count_votes(election=None):
+    """Count Vote rows per candidate, returning {candidate_id: votes}"""
+    candidates = Candidate.objects.all()
+    votes = Vote.objects.all()
+    if election is not None:
+        candidates = candidates.filter(election=election)
+        votes = votes.filter(election=election)
+
+    counts = dict.fromkeys(candidates.values_list('id', flat=True), 0)
+    for row in votes.order_by().values('candidate_id').annotate(total=Count('id')):
+        counts[row['candidate_id']] = row['total']
+    return counts
+
+
+def verify_tallies(election=None):
+    """
+    Compare the tally store with the Vote table.
+
+    Returns a list of (candidate_id, tallied, actual) tuples for every
+    candidate whose counter does not match.
+    """
+    actual = count_votes(election)
+    tallies = VoteTally.objects.all()
+    if election is not None:
+        tallies = tallies.filter(election=election)
+    tallied = dict(tallies.values_list('candidate_id', 'votes'))
+
+    return [
+        (candidate_id, tallied.get(candidate_id), votes)
+        for candidate_id, votes in sorted(actual.items())
+        if tallied.get(candidate_id) != votes
+    ]
+
+
+def rebuild_tallies(election=None):
+    """
+    Recompute the tally store from Vote rows.
+
+    The election's tally rows are locked before the votes are counted, so a
+    vote committing meanwhile waits and increments the rebuilt counter
+    instead of being overwritten. Returns the list of mismatches that were
+    corrected (see verify_tallies).
+    """
+    with transaction.atomic():
+        locked = VoteTally.objects.select_for_update()
+        if election is not None:
+            locked = locked.filter(election=election)
+        list(locked.values_list('pk', flat=True))
+
+        mismatches = verify_tallies(election)
+        if not mismatches:
+            return mismatches
+
+        election_ids = dict(Candidate.objects.filter(
+            id__in=[candidate_id for candidate_id, _, _ in mismatches]
+        ).values_list('id', 'election_id'))
+
+        for candidate_id, tallied, votes in mismatches:
+            if tallied is None:
+                VoteTally.objects.create(
+                    candidate_id=candidate_id,
+                    election_id=election_ids[candidate_id],
+                    votes=votes
+                )
+            else:
+                VoteTally.objects.filter(candidate_id=candidate_id).update(votes=votes)
+    return mismatches
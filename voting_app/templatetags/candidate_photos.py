@@ -0,0 +1,49 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def _srcset(variants, key):
+    return ', '.join(f"{variant[key]} {variant['width']}w" for variant in variants)
+
+
+@register.simple_tag
+def candidate_photo(candidate, size, css_class='', alt=None):
+    """
+    Responsive <picture> for a candidate photo displayed at `size` CSS pixels.
+
+    Accepts a Candidate or a candidate dict from a results snapshot. Offers
+    the WebP and JPEG variants through srcset so the browser downloads the
+    smallest file that is sharp at the screen's pixel density.
+    """
+    if isinstance(candidate, dict):
+        sources = candidate.get('photo')
+        name = candidate.get('name', '')
+    else:
+        sources = candidate.photo_sources()
+        name = candidate.name
+    if not sources:
+        return ''
+
+    alt = name if alt is None else alt
+    style = f'width: {size}px; height: {size}px; object-fit: cover;'
+    variants = sources.get('variants') or []
+    if not variants:
+        # Not processed yet (or an older snapshot): serve the original
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" width="{}" height="{}" loading="lazy" decoding="async">',
+            sources['url'], alt, css_class, style, size, size
+        )
+
+    # Fallback src: the smallest variant that is sharp on a 2x display
+    fallback = next((variant for variant in variants if variant['width'] >= size * 2), variants[-1])
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}px">'
+        '<img src="{}" srcset="{}" sizes="{}px" alt="{}" class="{}" style="{}" width="{}" height="{}" '
+        'loading="lazy" decoding="async">'
+        '</picture>',
+        _srcset(variants, 'webp'), size,
+        fallback['jpeg'], _srcset(variants, 'jpeg'), size, alt, css_class, style, size, size
+    )
@@ -1,3 +1,2056 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import TestCase as PlainTestCase, mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from PIL import Image
+
+from online_voting_system.database import configure_postgres
+
+from . import (
+    admission, async_views, audit, ballots, db_pool, eligibility, entity_cache, exports, homepage, instrumentation,
+    ledger, lifecycle, live, metrics, photos, results, routing, tallies, voter_index, voting,
+)
+from .management.commands import import_voters
+from .models import Election, Candidate, Vote, UserProfile, AuditLog, LedgerBlock, ResultSnapshot, VoteTally
+from .templatetags.candidate_photos import candidate_photo
+
+SAVEPOINT_SQL = re.compile(r'^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b')
+
+
+# TestCase never commits, so entity cache versions would not be bumped;
+# rate limit buckets and has-voted bitmaps would outlive the test that filled them
+@override_settings(ENTITY_CACHE_ENABLED=False, ADMISSION_CONTROL_ENABLED=False, VOTER_INDEX_ENABLED=False)
+class VotingTestCase(TestCase):
+    """Common fixture: one ongoing election with two candidates and a voter"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.admin = User.objects.create_user('admin', password='admin-pass', is_staff=True)
+        cls.election = Election.objects.create(
+            title='Council Election',
+            description='Annual council election',
+            start_time=now - timedelta(hours=1),
+            end_time=now + timedelta(hours=1),
+            is_active=True,
+            created_by=cls.admin
+        )
+        cls.alice = Candidate.objects.create(election=cls.election, name='Alice')
+        cls.bob = Candidate.objects.create(election=cls.election, name='Bob')
+        cls.voter = cls.create_voter('voter')
+
+    @classmethod
+    def create_voter(cls, username, **profile):
+        user = User.objects.create_user(username, password='voter-pass')
+        UserProfile.objects.create(
+            user=user,
+            voter_id=f'V-{username}',
+            date_of_birth=profile.pop('date_of_birth', date(1990, 1, 1)),
+            **profile
+        )
+        return user
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """Like assertNumQueries, but ignores the savepoints added by TestCase's own transaction"""
+        with CaptureQueriesContext(connection) as context:
+            yield
+        queries = [query['sql'] for query in context.captured_queries if not SAVEPOINT_SQL.match(query['sql'])]
+        self.assertEqual(len(queries), budget, '\n'.join(queries))
+
+
+@override_settings(AUDIT_LOG_ASYNC=True)
+class CastVoteTests(VotingTestCase):
+    # Session + user lookup (2), ballot resolution (1), insert (1), tally update (1)
+    QUERIES_PER_VOTE = 5
+
+    def setUp(self):
+        self.client.force_login(self.voter)
+        self.url = reverse('cast_vote', args=[self.election.id])
+        # Keep queued audit entries in memory; they are written off the request path
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        self.audit_add = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_vote_query_budget(self):
+        with self.assertQueryBudget(self.QUERIES_PER_VOTE), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'candidate': self.alice.id})
+
+        self.assertRedirects(response, reverse('election_detail', args=[self.election.id]), fetch_redirect_response=False)
+        self.assertTrue(Vote.objects.filter(voter=self.voter, candidate=self.alice).exists())
+        self.assertEqual(Candidate.objects.get(pk=self.alice.pk).vote_count, 1)
+        self.assertEqual(self.audit_add.call_args.args[0]['action'], 'VOTE_CAST')
+
+    def test_duplicate_vote_rejected_by_constraint(self):
+        self.client.post(self.url, {'candidate': self.alice.id})
+
+        with self.assertQueryBudget(self.QUERIES_PER_VOTE - 1):
+            self.client.post(self.url, {'candidate': self.bob.id})
+
+        self.assertEqual(Vote.objects.filter(voter=self.voter).count(), 1)
+        self.assertEqual(Candidate.objects.get(pk=self.bob.pk).vote_count, 0)
+
+    def test_candidate_from_other_election_rejected(self):
+        other = Election.objects.create(
+            title='Other', description='', start_time=self.election.start_time,
+            end_time=self.election.end_time, is_active=True, created_by=self.admin
+        )
+        outsider = Candidate.objects.create(election=other, name='Outsider')
+
+        self.client.post(self.url, {'candidate': outsider.id})
+
+        self.assertFalse(Vote.objects.exists())
+
+    def test_ineligible_voter_rejected(self):
+        ineligible = self.create_voter('ineligible', is_eligible=False)
+        self.client.force_login(ineligible)
+
+        self.client.post(self.url, {'candidate': self.alice.id})
+
+        self.assertFalse(Vote.objects.exists())
+
+    def test_closed_election_rejected(self):
+        Election.objects.filter(pk=self.election.pk).update(end_time=timezone.now() - timedelta(minutes=1))
+
+        self.client.post(self.url, {'candidate': self.alice.id})
+
+        self.assertFalse(Vote.objects.exists())
+
+    def test_unknown_election_returns_404(self):
+        response = self.client.post(reverse('cast_vote', args=[999]), {'candidate': self.alice.id})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TallyTests(VotingTestCase):
+    def setUp(self):
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def vote(self, username, candidate):
+        return Vote.objects.create(
+            voter=self.create_voter(username), election=self.election, candidate=candidate
+        )
+
+    def tallies(self):
+        return dict(VoteTally.objects.filter(election=self.election).values_list('candidate_id', 'votes'))
+
+    def test_new_candidate_gets_empty_tally(self):
+        carol = Candidate.objects.create(election=self.election, name='Carol')
+
+        self.assertEqual(self.tallies()[carol.id], 0)
+
+    def test_cast_and_delete(self):
+        first = self.vote('first', self.alice)
+        tallies.record_vote(first)
+        tallies.record_vote(self.vote('second', self.alice))
+        tallies.record_vote(self.vote('third', self.bob))
+        self.assertEqual(self.tallies(), {self.alice.id: 2, self.bob.id: 1})
+
+        first.delete()
+
+        self.assertEqual(self.tallies(), {self.alice.id: 1, self.bob.id: 1})
+        self.assertEqual(Election.objects.get(pk=self.election.pk).total_votes, 2)
+        self.assertEqual(tallies.verify_tallies(self.election), [])
+
+    def test_cast_ballot_updates_tally(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.cast_ballot(self.voter, self.election.id, self.alice.id)
+
+        self.assertEqual(self.tallies(), {self.alice.id: 1, self.bob.id: 0})
+
+    def test_record_vote_recreates_missing_tally(self):
+        VoteTally.objects.filter(candidate=self.bob).delete()
+
+        tallies.record_vote(self.vote('first', self.bob))
+
+        self.assertEqual(self.tallies()[self.bob.id], 1)
+
+    def test_retract_never_goes_negative(self):
+        vote = self.vote('first', self.alice)
+
+        vote.delete()
+
+        self.assertEqual(self.tallies()[self.alice.id], 0)
+
+    def test_rebuild_tallies(self):
+        self.vote('first', self.alice)
+        self.vote('second', self.alice)
+        VoteTally.objects.filter(candidate=self.bob).update(votes=7)
+
+        self.assertEqual(tallies.rebuild_tallies(self.election), [(self.alice.id, 0, 2), (self.bob.id, 7, 0)])
+        self.assertEqual(self.tallies(), {self.alice.id: 2, self.bob.id: 0})
+        self.assertEqual(tallies.rebuild_tallies(self.election), [])
+
+    def test_rebuild_creates_missing_tally(self):
+        self.vote('first', self.bob)
+        VoteTally.objects.filter(candidate=self.bob).delete()
+
+        self.assertEqual(tallies.rebuild_tallies(), [(self.bob.id, None, 1)])
+        self.assertEqual(self.tallies(), {self.alice.id: 0, self.bob.id: 1})
+
+    def test_rebuild_tallies_command(self):
+        self.vote('first', self.alice)
+        out = StringIO()
+
+        with self.assertRaisesMessage(CommandError, '1 tally mismatch(es) found.'):
+            call_command('rebuild_tallies', '--verify', stdout=out)
+        self.assertIn(f"Candidate {self.alice.id}: tally=0 votes=1", out.getvalue())
+        self.assertEqual(self.tallies()[self.alice.id], 0)
+
+        call_command('rebuild_tallies', '--election', str(self.election.id), stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_tallies', '--verify', stdout=out)
+
+        self.assertIn("Tally store matches Vote rows.", out.getvalue())
+        self.assertEqual(self.tallies()[self.alice.id], 1)
+
+    def test_rebuild_tallies_command_unknown_election(self):
+        with self.assertRaisesMessage(CommandError, 'Election 999 does not exist.'):
+            call_command('rebuild_tallies', '--election', '999')
+
+    def test_migration_backfill(self):
+        self.vote('first', self.alice)
+        self.vote('second', self.alice)
+        self.vote('third', self.bob)
+        VoteTally.objects.all().delete()
+        migration = import_module('voting_app.migrations.0002_votetally')
+
+        migration.backfill_tallies(django_apps, None)
+
+        self.assertEqual(self.tallies(), {self.alice.id: 2, self.bob.id: 1})
+
+
+class ResultSnapshotTests(VotingTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        self.audit_add = patcher.start()
+        self.addCleanup(patcher.stop)
+        voting.cast_ballot(self.voter, self.election.id, self.alice.id)
+        self.client.force_login(self.voter)
+        self.url = reverse('election_results', args=[self.election.id])
+
+    def close(self, election, seconds_ago):
+        Election.objects.filter(pk=election.pk).update(end_time=timezone.now() - timedelta(seconds=seconds_ago))
+        election.refresh_from_db()
+
+    def test_snapshot_written_once_and_cached(self):
+        self.close(self.election, 60)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.context['total_votes'], 1)
+        snapshot = ResultSnapshot.objects.get(election=self.election)
+        self.assertEqual([row['name'] for row in snapshot.results], ['Alice', 'Bob'])
+        # Session and user only: the payload comes from the cache
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'voting_app_' in query['sql']])
+        self.assertEqual(response.context['candidates'][0]['vote_count'], 1)
+        self.assertEqual(results.finalize_election(self.election), snapshot)
+
+    def test_first_visitor_closes_election(self):
+        # Drifted tally, votes not sealed yet
+        VoteTally.objects.filter(candidate=self.bob).update(votes=5)
+        self.close(self.election, 60)
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertLogs('voting_app.results', 'WARNING'):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.context['total_votes'], 1)
+        self.assertEqual(ResultSnapshot.objects.get(election=self.election).total_votes, 1)
+        self.assertEqual(Candidate.objects.get(pk=self.bob.pk).vote_count, 0)
+        self.assertFalse(Vote.objects.filter(election=self.election, ledger_position__isnull=True).exists())
+        self.assertEqual(LedgerBlock.objects.filter(election=self.election).count(), 1)
+        [entry] = [call.args[0] for call in self.audit_add.call_args_list]
+        self.assertEqual(entry['action'], 'LEDGER_SEALED')
+        # The scheduler finds nothing left to close
+        self.assertEqual(lifecycle.LifecycleScheduler().tick(), [])
+
+    @override_settings(RESULTS_LOCAL_CACHE_TTL=7)
+    def test_cache_timeout_follows_backend(self):
+        self.close(self.election, 60)
+        snapshot = results.finalize_election(self.election)
+        key = results.RESULTS_CACHE_KEY.format(self.election.id)
+
+        with mock.patch('voting_app.results.cache') as results_cache:
+            results.cache_results(snapshot)
+            # Edits only reach this worker's LocMem cache: do not serve stale results for long
+            results_cache.set.assert_called_once_with(key, mock.ANY, 7)
+
+            with mock.patch('voting_app.results.shared_backend', return_value=True):
+                results.cache_results(snapshot)
+            results_cache.set.assert_called_with(key, mock.ANY, None)
+
+    def test_provisional_during_grace_period(self):
+        self.close(self.election, 1)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.context['total_votes'], 1)
+        self.assertFalse(ResultSnapshot.objects.exists())
+        self.assertIsNone(results.get_final_results(self.election.id))
+        with self.assertRaises(ValueError):
+            results.finalize_election(self.election)
+
+    def test_late_vote_in_grace_period_counted(self):
+        self.close(self.election, 1)
+        late = self.create_voter('late')
+        # Checked before end_time, committed after it
+        vote = Vote.objects.create(voter=late, candidate=self.bob, election=self.election)
+        tallies.record_vote(vote)
+        self.close(self.election, 60)
+
+        snapshot = results.finalize_election(self.election)
+
+        self.assertEqual(snapshot.total_votes, 2)
+
+    def test_invalidated_when_election_edited(self):
+        self.close(self.election, 60)
+        self.client.get(self.url)
+        self.assertIsNotNone(results.get_final_results(self.election.id))
+
+        self.election.title = 'Council Election (recount)'
+        self.election.save()
+        self.assertEqual(results.get_final_results(self.election.id)['election']['title'], 'Council Election (recount)')
+
+        self.election.end_time = timezone.now() + timedelta(hours=1)
+        self.election.save()
+        self.assertIsNone(results.get_final_results(self.election.id))
+        self.assertFalse(ResultSnapshot.objects.exists())
+
+    def test_finalize_elections_command(self):
+        recent = Election.objects.create(
+            title='Recent', description='', start_time=self.election.start_time,
+            end_time=timezone.now() - timedelta(seconds=1), created_by=self.admin,
+        )
+        self.close(self.election, 60)
+
+        stdout = StringIO()
+        call_command('finalize_elections', stdout=stdout)
+
+        self.assertIn('Finalized 1 election(s).', stdout.getvalue())
+        self.assertTrue(LedgerBlock.objects.filter(election=self.election).exists())
+        self.assertEqual(list(ResultSnapshot.objects.values_list('election', flat=True)), [self.election.id])
+        self.assertEqual(cache.get(results.RESULTS_CACHE_KEY.format(self.election.id))['total_votes'], 1)
+        self.assertIsNone(cache.get(results.RESULTS_CACHE_KEY.format(recent.id)))
+
+
+class AuditBufferTests(VotingTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool_dir = Path(directory.name)
+
+    def make_buffer(self, **kwargs):
+        buffer = audit.AuditBuffer(flush_interval=3600, **kwargs)
+        # The flusher thread exits straight away; the tests flush explicitly
+        patcher = mock.patch.object(buffer, '_run')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return buffer
+
+    def entry(self, n=0):
+        return audit.make_entry(self.voter, 'TEST', f'entry {n}', '127.0.0.1')
+
+    def logged(self):
+        return list(AuditLog.objects.filter(action='TEST').order_by('details').values_list('details', flat=True))
+
+    def spool_files(self, suffix):
+        return sorted(path for path in self.spool_dir.iterdir() if path.name.endswith(suffix))
+
+    def test_flush_in_batches(self):
+        buffer = self.make_buffer(batch_size=2)
+        for n in range(5):
+            buffer.add(self.entry(n))
+        self.assertEqual(buffer.stats()['depth'], 5)
+
+        self.assertEqual(buffer.flush(), 5)
+
+        self.assertEqual(self.logged(), [f'entry {n}' for n in range(5)])
+        stats = buffer.stats()
+        self.assertEqual((stats['enqueued'], stats['flushed'], stats['batches'], stats['depth']), (5, 5, 3, 0))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_full_buffer_flushes_in_caller(self):
+        buffer = self.make_buffer(max_size=3)
+
+        for n in range(3):
+            buffer.add(self.entry(n))
+
+        self.assertEqual(len(self.logged()), 3)
+        self.assertEqual(buffer.stats()['sync_flushes'], 1)
+
+    def test_journal_removed_after_flush(self):
+        buffer = self.make_buffer(spool_dir=self.spool_dir)
+        buffer.add(self.entry(0))
+        buffer.add(self.entry(1))
+
+        [segment] = self.spool_files(audit.ACTIVE_SUFFIX)
+        self.assertEqual([json.loads(line)['details'] for line in segment.read_text().splitlines()], ['entry 0', 'entry 1'])
+
+        buffer.flush()
+
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+    def test_failed_flush_spills_and_replays(self):
+        buffer = self.make_buffer(batch_size=2, spool_dir=self.spool_dir)
+        for n in range(5):
+            buffer.add(self.entry(n))
+
+        real_bulk_create = AuditLog.objects.bulk_create
+        calls = []
+
+        def flaky_bulk_create(objs, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise DatabaseError('database is down')
+            return real_bulk_create(objs, **kwargs)
+
+        with mock.patch.object(AuditLog.objects, 'bulk_create', side_effect=flaky_bulk_create), \
+                self.assertLogs('voting_app.audit', 'ERROR'):
+            self.assertEqual(buffer.flush(), 2)
+
+        self.assertEqual(self.spool_files(audit.ACTIVE_SUFFIX), [])
+        [spill] = self.spool_files(audit.SPILL_SUFFIX)
+        self.assertEqual(len(spill.read_text().splitlines()), 3)
+        self.assertEqual((buffer.stats()['flush_failures'], buffer.stats()['spilled']), (1, 3))
+
+        self.assertEqual(buffer.replay_spool(), 3)
+
+        self.assertEqual(self.logged(), [f'entry {n}' for n in range(5)])
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+        self.assertEqual(buffer.stats()['replayed'], 3)
+
+    def test_failed_flush_without_spool_drops_entries(self):
+        buffer = self.make_buffer()
+        buffer.add(self.entry())
+
+        with mock.patch.object(AuditLog.objects, 'bulk_create', side_effect=DatabaseError('database is down')), \
+                self.assertLogs('voting_app.audit', 'ERROR') as logs:
+            buffer.flush()
+
+        self.assertIn('Dropped 1 audit entries', '\n'.join(logs.output))
+        self.assertEqual(buffer.stats()['spilled'], 1)
+
+    def test_replay_segments_of_dead_workers_only(self):
+        dead = self.spool_dir / f'audit-999999-1{audit.ACTIVE_SUFFIX}'
+        live = self.spool_dir / f'audit-{os.getpid()}-1{audit.ACTIVE_SUFFIX}'
+        dead.write_text(json.dumps(self.entry(0)) + '\n')
+        live.write_text(json.dumps(self.entry(1)) + '\n')
+        buffer = self.make_buffer(spool_dir=self.spool_dir)
+
+        with mock.patch('voting_app.audit._pid_alive', side_effect=lambda pid: pid != 999999):
+            self.assertEqual(buffer.replay_spool(), 1)
+
+        self.assertEqual(self.logged(), ['entry 0'])
+        self.assertEqual(list(self.spool_dir.iterdir()), [live])
+
+    def test_failed_replay_keeps_segment(self):
+        spill = self.spool_dir / f'audit-999999-1-1{audit.SPILL_SUFFIX}'
+        spill.write_text(json.dumps(self.entry()) + '\n')
+        buffer = self.make_buffer(spool_dir=self.spool_dir)
+
+        with mock.patch.object(AuditLog.objects, 'bulk_create', side_effect=DatabaseError('database is down')), \
+                self.assertLogs('voting_app.audit', 'ERROR'):
+            self.assertEqual(buffer.replay_spool(), 0)
+
+        self.assertEqual(list(self.spool_dir.iterdir()), [spill])
+
+    def test_flush_audit_spool_command(self):
+        spill = self.spool_dir / f'audit-999999-1-1{audit.SPILL_SUFFIX}'
+        spill.write_text(json.dumps(self.entry()) + '\n')
+        out = StringIO()
+
+        with mock.patch('voting_app.audit.get_audit_buffer', return_value=self.make_buffer(spool_dir=self.spool_dir)):
+            call_command('flush_audit_spool', stdout=out)
+
+        self.assertIn('Replayed 1 audit entries', out.getvalue())
+        self.assertEqual(self.logged(), ['entry 0'])
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_async_record_queues_on_commit(self):
+        with mock.patch('voting_app.audit.get_audit_buffer') as get_buffer:
+            with self.captureOnCommitCallbacks() as callbacks:
+                audit.record(self.voter, 'TEST', 'queued', '127.0.0.1')
+            get_buffer.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+
+        [entry] = get_buffer.return_value.add.call_args.args
+        self.assertEqual((entry['user_id'], entry['action'], entry['details']), (self.voter.pk, 'TEST', 'queued'))
+        self.assertEqual(self.logged(), [])
+
+    @override_settings(AUDIT_LOG_ASYNC=False)
+    def test_sync_record_writes_inline(self):
+        with mock.patch('voting_app.audit.get_audit_buffer') as get_buffer:
+            audit.record(self.voter, 'TEST', 'inline', '127.0.0.1')
+
+        get_buffer.assert_not_called()
+        self.assertEqual(self.logged(), ['inline'])
+
+
+class AdminChangelistTests(VotingTestCase):
+    """Changelists must not issue per-row queries"""
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser('root', password='root-pass')
+        self.client.force_login(self.superuser)
+
+    def add_election(self, index, voters=3):
+        election = Election.objects.create(
+            title=f'Election {index}', description='', start_time=self.election.start_time,
+            end_time=self.election.end_time, is_active=True, created_by=self.admin
+        )
+        candidates = [
+            Candidate.objects.create(election=election, name=f'Candidate {n}', party=f'Party {n}')
+            for n in range(2)
+        ]
+        for n in range(voters):
+            voter = self.create_voter(f'voter-{index}-{n}')
+            vote = Vote.objects.create(voter=voter, election=election, candidate=candidates[n % 2])
+            tallies.record_vote(vote)
+            AuditLog.objects.create(user=voter, action='VOTE_CAST', details=election.title)
+        return election
+
+    CHANGELISTS = (
+        'voting_app_election', 'voting_app_candidate', 'voting_app_vote',
+        'voting_app_auditlog', 'voting_app_userprofile', 'auth_user',
+    )
+
+    def changelist_queries(self, changelist):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(f'admin:{changelist}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries if not SAVEPOINT_SQL.match(query['sql'])]
+
+    def test_query_count_independent_of_rows(self):
+        self.add_election(1)
+        small = {changelist: self.changelist_queries(changelist) for changelist in self.CHANGELISTS}
+        for index in range(2, 8):
+            self.add_election(index)
+
+        for changelist in self.CHANGELISTS:
+            with self.subTest(changelist=changelist):
+                large = self.changelist_queries(changelist)
+                self.assertEqual(len(large), len(small[changelist]), '\n'.join(large))
+
+    def test_sort_candidates_by_votes(self):
+        election = self.add_election(1, voters=3)
+        url = reverse('admin:voting_app_candidate_changelist')
+
+        response = self.client.get(url, {'election__id__exact': election.id, 'o': '-4'})
+
+        candidates = list(response.context['cl'].result_list)
+        self.assertEqual([candidate._vote_count for candidate in candidates], [2, 1])
+        self.assertContains(response, '66.67%')
+
+
+class IndexUsageTests(VotingTestCase):
+    """Guard the composite indexes against silent plan regressions (SQLite and PostgreSQL)"""
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny; make the planner show whether the index is usable
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f'No plan expectations for {connection.vendor}')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_home_active_elections(self):
+        now = timezone.now()
+        ongoing = Election.objects.filter(is_active=True, start_time__lte=now, end_time__gte=now)
+        upcoming = Election.objects.filter(is_active=True, start_time__gt=now, end_time__gt=now)
+
+        self.assertUsesIndex(ongoing, 'election_active_window_idx')
+        self.assertUsesIndex(upcoming, 'election_active_window_idx')
+
+    def test_home_finished_elections(self):
+        finished = Election.objects.filter(end_time__lt=timezone.now()).order_by('-end_time')[:5]
+
+        self.assertUsesIndex(finished, 'election_end_time_idx')
+
+    def test_votes_grouped_by_candidate(self):
+        counts = Vote.objects.filter(election=self.election).order_by().values('candidate_id').annotate(total=Count('id'))
+
+        self.assertUsesIndex(counts, 'vote_election_candidate_idx')
+
+    def test_eligible_voters(self):
+        self.assertUsesIndex(eligibility.eligible_voters(self.election), 'profile_eligible_dob_idx')
+
+    def test_audit_log_changelist(self):
+        self.assertUsesIndex(AuditLog.objects.order_by('-timestamp')[:100], 'auditlog_timestamp_idx')
+        self.assertUsesIndex(
+            AuditLog.objects.filter(action='VOTE_CAST').order_by('-timestamp')[:100],
+            'auditlog_action_time_idx'
+        )
+
+
+class LiveStreamTests(VotingTestCase):
+
+    def setUp(self):
+        self.url = reverse('api_election_stream', args=[self.election.id])
+        # Keep the client streams, which the test client does not close
+        self.streams = []
+        stream = live.broadcaster.stream
+
+        def open_stream(election_id):
+            self.streams.append(stream(election_id))
+            return self.streams[-1]
+        patcher = mock.patch.multiple(live.broadcaster, interval=0.01, heartbeat=0.05, stream=open_stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def read(self, stream, frames):
+        return [(await anext(stream)).decode() for _ in range(frames)]
+
+    def test_wsgi_not_supported(self):
+        self.client.force_login(self.voter)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 501)
+
+    async def test_status_and_heartbeat(self):
+        await self.async_client.aforce_login(self.voter)
+
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        retry, status = await self.read(stream, 2)
+
+        self.assertEqual(retry, 'retry: 10\n\n')
+        self.assertTrue(status.startswith('event: status\n'))
+        self.assertEqual(json.loads(status.split('data: ')[1])['total_votes'], 0)
+        self.assertEqual(live.broadcaster.stats()['connections_per_election'], {self.election.id: 1})
+        with mock.patch.object(live, 'acompute_status', side_effect=Exception):
+            frames = await self.read(stream, 5)
+        self.assertIn(': heartbeat\n\n', frames)
+        await self.streams[0].aclose()
+        self.assertEqual(live.broadcaster.stats()['connections'], 0)
+
+    async def test_stream_ends_after_deletion(self):
+        with mock.patch.object(live, 'acompute_status', side_effect=Election.DoesNotExist):
+            frames = [frame async for frame in live.broadcaster.stream(self.election.id)]
+
+        self.assertEqual(frames, ['retry: 10\n\n', live.DELETED])
+        self.assertEqual(live.broadcaster.channels, {})
+
+    async def test_unknown_election(self):
+        await self.async_client.aforce_login(self.voter)
+
+        response = await self.async_client.get(reverse('api_election_stream', args=[999]))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class HomePageCacheTests(VotingTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = timezone.now()
+        Election.objects.filter(pk=self.election.pk).update(end_time=self.now + timedelta(hours=1))
+
+    def create_election(self, title, start, end):
+        return Election.objects.create(
+            title=title, description='', start_time=self.now + start, end_time=self.now + end,
+            is_active=True, created_by=self.admin,
+        )
+
+    def cached_ttl(self):
+        """Build the sections at self.now and return the TTL they were cached with"""
+        with mock.patch('voting_app.homepage.cache') as home_cache, \
+                mock.patch('django.utils.timezone.now', return_value=self.now):
+            home_cache.get.return_value = None
+            homepage.get_home_sections()
+        key, _, ttl = home_cache.set.call_args.args
+        self.assertEqual(key, homepage.HOME_SECTIONS_KEY)
+        return ttl
+
+    def titles(self, context):
+        return {name: [election.title for election in elections] for name, elections in context.items()}
+
+    def test_ttl_until(self):
+        boundaries = [self.now + timedelta(seconds=30.2), None, self.now + timedelta(seconds=45)]
+
+        self.assertEqual(homepage._ttl_until(boundaries, self.now), 31)
+        self.assertEqual(homepage._ttl_until([self.now - timedelta(seconds=5)], self.now), 1)
+        self.assertEqual(homepage._ttl_until([None], self.now), 60)
+
+    @override_settings(HOME_CACHE_MAX_TTL=7200)
+    def test_ttl_runs_until_next_end(self):
+        self.assertEqual(self.cached_ttl(), 3600)
+
+    @override_settings(HOME_CACHE_MAX_TTL=7200)
+    def test_ttl_runs_until_next_start(self):
+        self.create_election('Upcoming', timedelta(minutes=10), timedelta(hours=2))
+
+        self.assertEqual(self.cached_ttl(), 600)
+
+    def test_ttl_capped(self):
+        self.create_election('Upcoming', timedelta(minutes=10), timedelta(hours=2))
+
+        self.assertEqual(self.cached_ttl(), 60)
+
+    def test_sections_served_from_cache(self):
+        first = self.titles(homepage.get_home_context())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(homepage.get_home_context()), first)
+        self.assertEqual(first['ongoing_elections'], ['Council Election'])
+
+    def test_invalidated_on_election_save(self):
+        homepage.get_home_context()
+
+        upcoming = self.create_election('Upcoming', timedelta(minutes=10), timedelta(hours=2))
+
+        self.assertIsNone(cache.get(homepage.HOME_SECTIONS_KEY))
+        self.assertEqual(self.titles(homepage.get_home_context())['upcoming_elections'], ['Upcoming'])
+
+        upcoming.title = 'Renamed'
+        upcoming.save()
+
+        self.assertEqual(self.titles(homepage.get_home_context())['upcoming_elections'], ['Renamed'])
+
+    def test_invalidated_on_election_delete(self):
+        self.assertEqual(self.titles(homepage.get_home_context())['ongoing_elections'], ['Council Election'])
+
+        self.election.delete()
+
+        self.assertIsNone(cache.get(homepage.HOME_SECTIONS_KEY))
+        self.assertEqual(self.titles(homepage.get_home_context())['ongoing_elections'], [])
+
+    async def test_async_context_shares_cache(self):
+        sections = await sync_to_async(homepage.get_home_context)()
+
+        context = await homepage.aget_home_context()
+
+        self.assertEqual(self.titles(context), self.titles(sections))
+
+
+class CandidatePhotoTests(VotingTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media = Path(directory.name)
+        override = override_settings(
+            MEDIA_ROOT=directory.name, CANDIDATE_PHOTO_ASYNC=False, CANDIDATE_PHOTO_SIZES=(16, 32, 64),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, name='portrait.png', size=(48, 24), mode='RGBA'):
+        output = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(output, format='PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def set_photo(self, candidate, **kwargs):
+        """Upload a photo and run the after-commit processing"""
+        with self.captureOnCommitCallbacks(execute=True):
+            candidate.photo = self.upload(**kwargs)
+            candidate.save()
+        return Candidate.objects.get(pk=candidate.pk)
+
+    def stored(self):
+        return sorted(str(path.relative_to(self.media)) for path in self.media.rglob('*') if path.is_file())
+
+    def test_variants_rendered_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.alice.photo = self.upload()
+            self.alice.save()
+        self.assertEqual(len(self.stored()), 1)
+        self.assertIsNone(Candidate.objects.get(pk=self.alice.pk).photo_width)
+
+        for callback in callbacks:
+            callback()
+
+        alice = Candidate.objects.get(pk=self.alice.pk)
+        self.assertEqual((alice.photo_width, alice.photo_height), (48, 24))
+        self.assertEqual(alice.photo_variants['source'], alice.photo.name)
+        sizes = alice.photo_variants['sizes']
+        # 64 would upscale the 48px original, so rendering stops at full size
+        self.assertEqual([(variant['width'], variant['height']) for variant in sizes], [(16, 8), (32, 16), (48, 24)])
+        for variant in sizes:
+            for key, format in (('jpeg', 'JPEG'), ('webp', 'WEBP')):
+                with Image.open(self.media / variant[key]) as image:
+                    self.assertEqual((image.format, image.width), (format, variant['width']))
+        self.assertEqual(len(self.stored()), 7)
+
+    def test_unchanged_photo_not_reprocessed(self):
+        alice = self.set_photo(self.alice)
+
+        with mock.patch('voting_app.photos.schedule_processing') as schedule:
+            alice.name = 'Alice Smith'
+            alice.save()
+            Candidate.objects.get(pk=alice.pk).save(update_fields=['name'])
+        schedule.assert_not_called()
+
+        self.assertFalse(photos.process_photo(alice.pk))
+
+    def test_replaced_photo(self):
+        alice = self.set_photo(self.alice)
+        old_variants = photos._variant_files(alice.photo_variants)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            alice.photo = self.upload('replacement.png', size=(20, 20), mode='RGB')
+            alice.save()
+        pending = Candidate.objects.get(pk=alice.pk)
+        # Variants of the previous upload are not served for the new one
+        self.assertEqual(pending.photo_sources()['variants'], [])
+        self.assertIsNone(pending.photo_width)
+
+        for callback in callbacks:
+            callback()
+
+        alice = Candidate.objects.get(pk=alice.pk)
+        self.assertEqual([(variant['width'], variant['height']) for variant in alice.photo_variants['sizes']],
+                         [(16, 16), (20, 20)])
+        self.assertFalse(old_variants & set(self.stored()))
+
+    def test_photo_replaced_during_processing(self):
+        with self.captureOnCommitCallbacks():
+            self.alice.photo = self.upload()
+            self.alice.save()
+        render_variants = photos.render_variants
+
+        def render_then_replace(image, source_name, storage):
+            variants = render_variants(image, source_name, storage)
+            Candidate.objects.filter(pk=self.alice.pk).update(photo='candidate_photos/newer.png')
+            return variants
+
+        with mock.patch('voting_app.photos.render_variants', side_effect=render_then_replace):
+            self.assertFalse(photos.process_photo(self.alice.pk))
+
+        self.assertEqual(Candidate.objects.get(pk=self.alice.pk).photo_variants, {})
+        self.assertEqual(self.stored(), [self.alice.photo.name])
+
+    def test_removed_photo_clears_variants(self):
+        alice = self.set_photo(self.alice)
+
+        alice.photo = None
+        alice.save()
+
+        alice = Candidate.objects.get(pk=alice.pk)
+        self.assertEqual((alice.photo_variants, alice.photo_width), ({}, None))
+        self.assertIsNone(alice.photo_sources())
+
+    @override_settings(CANDIDATE_PHOTO_ASYNC=True)
+    def test_async_processing_enqueues_after_commit(self):
+        with mock.patch.object(photos.worker, 'enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.alice.photo = self.upload()
+                self.alice.save()
+                enqueue.assert_not_called()
+
+        enqueue.assert_called_once_with(self.alice.pk)
+
+    def test_worker_thread(self):
+        worker = photos.PhotoWorker()
+        outcomes = [True, False, OSError('truncated image')]
+
+        with mock.patch('voting_app.photos.process_photo', side_effect=outcomes) as process_photo, \
+                self.assertLogs('voting_app.photos', 'ERROR') as logs:
+            for candidate_id in (1, 2, 3):
+                worker.enqueue(candidate_id)
+            worker.join()
+
+        self.assertEqual([call.args for call in process_photo.call_args_list], [(1,), (2,), (3,)])
+        self.assertEqual(worker.stats(), {'enqueued': 3, 'processed': 1, 'skipped': 1, 'failed': 1, 'depth': 0})
+        self.assertIn('Could not process photo of candidate 3', logs.output[0])
+
+    def test_templatetag_falls_back_to_original(self):
+        with self.captureOnCommitCallbacks():
+            self.alice.photo = self.upload()
+            self.alice.save()
+
+        html = candidate_photo(Candidate.objects.get(pk=self.alice.pk), 80, alt='Alice')
+
+        self.assertTrue(html.startswith(f'<img src="/media/{self.alice.photo.name}" alt="Alice"'))
+        self.assertEqual(candidate_photo(self.bob, 80), '')
+        self.assertEqual(candidate_photo({'name': 'Bob', 'photo': None}, 80), '')
+
+    def test_templatetag_offers_variants(self):
+        alice = self.set_photo(self.alice)
+        variants = alice.photo_variants['sizes']
+
+        html = candidate_photo(alice, 16)
+
+        self.assertTrue(html.startswith('<picture><source type="image/webp" srcset="'))
+        self.assertIn(f"/media/{variants[0]['webp']} 16w, /media/{variants[1]['webp']} 32w", html)
+        # Sharp on a 2x display: the 32px rendition
+        self.assertIn(f'<img src="/media/{variants[1]["jpeg"]}"', html)
+        self.assertEqual(candidate_photo({'name': 'Alice', 'photo': alice.photo_sources()}, 16), html)
+
+    def test_process_photos_command(self):
+        for candidate in (self.alice, self.bob):
+            with self.captureOnCommitCallbacks():
+                candidate.photo = self.upload()
+                candidate.save()
+
+        out = StringIO()
+        call_command('process_photos', stdout=out)
+        self.assertIn('Processed 2 photo(s).', out.getvalue())
+
+        out = StringIO()
+        call_command('process_photos', stdout=out)
+        self.assertIn('Processed 0 photo(s).', out.getvalue())
+
+        out = StringIO()
+        call_command('process_photos', '--all', stdout=out)
+        self.assertIn('Processed 2 photo(s).', out.getvalue())
+
+
+class LifecycleSchedulerTests(VotingTestCase):
+
+    def setUp(self):
+        cache.clear()
+        entity_cache.entity_cache.local.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(entity_cache.entity_cache.local.clear)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = timezone.now()
+        self.upcoming = Election.objects.create(
+            title='Upcoming', description='', start_time=self.now + timedelta(minutes=10),
+            end_time=self.now + timedelta(hours=2), is_active=True, created_by=self.admin,
+        )
+        Candidate.objects.create(election=self.upcoming, name='Carol')
+        self.scheduler = lifecycle.LifecycleScheduler(lead=300, max_sleep=30)
+
+    def tick(self, seconds):
+        """Run a tick with the clock `seconds` after self.now"""
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timedelta(seconds=seconds)):
+            return [(event, election.title) for event, election in self.scheduler.tick()]
+
+    def test_transitions(self):
+        self.assertEqual(self.tick(240), [])
+        self.assertEqual(self.tick(360), [('opening', 'Upcoming')])
+        self.assertEqual(self.tick(420), [])
+        self.assertEqual(self.tick(660), [('opened', 'Upcoming')])
+        self.assertEqual(self.tick(720), [])
+        # A restarted scheduler warms again but does not know what already opened
+        self.scheduler = lifecycle.LifecycleScheduler(lead=300)
+        self.assertEqual(self.tick(540), [('opening', 'Upcoming')])
+
+    def test_closing_waits_for_grace_period(self):
+        voting.cast_ballot(self.voter, self.election.id, self.alice.id)
+        Election.objects.filter(pk=self.election.pk).update(end_time=self.now + timedelta(seconds=60))
+
+        self.assertEqual(self.tick(62), [])
+        self.assertFalse(ResultSnapshot.objects.exists())
+        self.assertEqual(self.tick(66), [('closed', 'Council Election')])
+        self.assertEqual(ResultSnapshot.objects.get().total_votes, 1)
+        self.assertEqual(LedgerBlock.objects.get().size, 1)
+        self.assertEqual(cache.get(results.RESULTS_CACHE_KEY.format(self.election.id))['total_votes'], 1)
+        self.assertEqual(self.tick(70), [])
+
+    def test_failing_hook_retried(self):
+        Election.objects.filter(pk=self.election.pk).update(end_time=self.now - timedelta(minutes=1))
+
+        with mock.patch.object(results, 'finalize_election', side_effect=RuntimeError):
+            with self.assertLogs('voting_app.lifecycle', 'ERROR'):
+                self.assertEqual(self.tick(0), [('closed', 'Council Election')])
+        self.assertEqual(self.tick(1), [('closed', 'Council Election')])
+        self.assertEqual(self.tick(2), [])
+
+    @override_settings(ENTITY_CACHE_ENABLED=True)
+    def test_ballot_warmed_and_home_refreshed(self):
+        self.tick(360)
+        with self.assertNumQueries(0):
+            ballot = ballots.get_ballot(self.upcoming.id)
+        self.assertEqual([candidate.name for candidate in ballot['candidates']], ['Carol'])
+
+        self.tick(400)
+        self.tick(660)
+        sections = cache.get(homepage.HOME_SECTIONS_KEY)
+        self.assertIn(self.upcoming, sections['ongoing_elections'])
+        self.assertNotIn(self.upcoming, sections['upcoming_elections'])
+
+    def test_next_wakeup(self):
+        Election.objects.filter(pk=self.election.pk).update(end_time=self.now + timedelta(hours=1))
+
+        def wakeup(seconds):
+            return self.scheduler.next_wakeup(self.now + timedelta(seconds=seconds))
+
+        self.assertAlmostEqual(wakeup(0), 30.05)
+        # Warm-up of Upcoming, then its start
+        self.assertAlmostEqual(wakeup(290), 10.05)
+        self.assertAlmostEqual(wakeup(590), 10.05)
+        # Closing of the council election, ELECTION_CLOSE_GRACE after its end
+        self.assertAlmostEqual(wakeup(3597), 8.05)
+        self.assertAlmostEqual(wakeup(3602), 3.05)
+
+
+class AsyncViewTests(VotingTestCase):
+    """The ASGI views, called directly (urls.py routes them only with ASYNC_VIEWS)"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        self.audit_add = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = AsyncRequestFactory()
+
+    def request(self, user, method='get', data=None):
+        request = getattr(self.factory, method)('/', data or {})
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
+        request._messages = default_storage(request)
+        return request
+
+    async def test_home(self):
+        response = await async_views.home(self.request(self.voter))
+
+        self.assertContains(response, 'Council Election')
+
+    async def test_detail_and_vote(self):
+        response = await async_views.election_detail(self.request(self.voter), pk=self.election.id)
+        self.assertContains(response, 'id="voteForm"')
+
+        request = self.request(self.voter, 'post', {'candidate': self.alice.id})
+        response = await async_views.cast_vote(request, election_id=self.election.id)
+        self.assertEqual(response.status_code, 302)
+        vote = await Vote.objects.select_related('candidate').aget(voter=self.voter)
+        self.assertEqual(vote.candidate, self.alice)
+        self.assertEqual(self.audit_add.call_args.args[0]['action'], 'VOTE_CAST')
+
+        response = await async_views.election_detail(self.request(self.voter), pk=self.election.id)
+        self.assertContains(response, vote.receipt)
+        self.assertNotContains(response, 'id="voteForm"')
+
+        request = self.request(self.voter, 'post', {'candidate': self.bob.id})
+        await async_views.cast_vote(request, election_id=self.election.id)
+        self.assertEqual([message.message for message in request._messages], ["You have already voted in this election."])
+        self.assertEqual(await Vote.objects.acount(), 1)
+
+    async def test_unknown_election(self):
+        with self.assertRaises(Http404):
+            await async_views.election_detail(self.request(self.voter), pk=999)
+        request = self.request(self.voter, 'post', {'candidate': self.alice.id})
+        with self.assertRaises(Http404):
+            await async_views.cast_vote(request, election_id=999)
+        with self.assertRaises(Http404):
+            await async_views.api_election_status(self.request(self.voter), election_id=999)
+
+    async def test_results(self):
+        await sync_to_async(voting.cast_ballot)(self.voter, self.election.id, self.alice.id)
+
+        response = await async_views.election_results(self.request(self.voter), election_id=self.election.id)
+        self.assertEqual(response.status_code, 302)
+        response = await async_views.election_results(self.request(self.admin), election_id=self.election.id)
+        self.assertContains(response, '100.0')
+
+        await Election.objects.filter(pk=self.election.pk).aupdate(end_time=timezone.now() - timedelta(minutes=1))
+        response = await async_views.election_results(self.request(self.voter), election_id=self.election.id)
+        self.assertContains(response, 'COMPLETED')
+        self.assertEqual((await ResultSnapshot.objects.aget()).total_votes, 1)
+
+    async def test_status(self):
+        response = await async_views.api_election_status(self.request(self.voter), election_id=self.election.id)
+
+        status = json.loads(response.content)
+        self.assertTrue(status['is_ongoing'])
+        self.assertEqual(status['total_votes'], 0)
+
+
+class ImportVotersTests(VotingTestCase):
+    HEADER = 'username,email,first_name,last_name,voter_id,date_of_birth,password\n'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.roll = self.directory / 'voters.csv'
+        self.roll.write_text(self.HEADER + ''.join(
+            f'invitee{index},invitee{index}@example.com,In,Vitee,INV-{index},1990-01-0{index},\n' for index in range(1, 5)
+        ) + (
+            'carol,carol@example.com,Carol,Smith,C-1,1985-05-05,Correct-Horse-9\n'
+            'dave,not-an-email,Dave,Jones,D-1,1985-05-05,\n'
+            'young,young@example.com,Young,Voter,Y-1,2020-01-01,\n'
+            'copy,copy@example.com,Copy,Cat,V-voter,1990-01-01,\n'
+        ))
+
+    def run_import(self):
+        stdout = StringIO()
+        call_command(
+            'import_voters', str(self.roll), '--workers', '1', '--chunk-size', '3',
+            '--invites-out', str(self.directory / 'invites.csv'),
+            '--errors-out', str(self.directory / 'rejected.csv'),
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def read(self, name):
+        with open(self.directory / name, newline='') as output:
+            return list(csv.reader(output))
+
+    def test_import(self):
+        self.run_import()
+
+        carol = User.objects.get(username='carol')
+        self.assertTrue(carol.check_password('Correct-Horse-9'))
+        self.assertEqual(carol.userprofile.voter_id, 'C-1')
+        invites = self.read('invites.csv')
+        self.assertEqual([row[0] for row in invites], [f'invitee{index}' for index in range(1, 5)])
+        invitee = User.objects.get(username='invitee1')
+        self.assertFalse(invitee.has_usable_password())
+        uidb64, token = invites[0][2].strip('/').split('/')[-2:]
+        self.assertEqual(uidb64, urlsafe_base64_encode(force_bytes(invitee.pk)))
+        self.assertTrue(default_token_generator.check_token(invitee, token))
+        self.assertEqual([(row[0], row[1]) for row in self.read('rejected.csv')], [('6', 'D-1'), ('7', 'Y-1')])
+        # The fixture voter already has V-voter: skipped, no invite (usable password)
+        self.assertFalse(User.objects.filter(username='copy').exists())
+
+        # Nothing left to do, nothing written twice
+        self.run_import()
+        self.assertEqual(len(self.read('invites.csv')), 4)
+        self.assertEqual(len(self.read('rejected.csv')), 2)
+
+    def test_resume_after_interruption(self):
+        save_progress = import_voters.Command.save_progress
+        calls = []
+
+        def interrupted(command, line):
+            calls.append(line)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            save_progress(command, line)
+
+        # The second chunk is committed, its invites and rejects written, its progress lost
+        with mock.patch.object(import_voters.Command, 'save_progress', interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import()
+        self.assertEqual(calls, [3, 6])
+        self.assertTrue(User.objects.filter(username='invitee4').exists())
+
+        output = self.run_import()
+
+        self.assertIn('Resuming after row 3.', output)
+        # invitee4 and carol from the interrupted chunk, plus the fixture voter
+        self.assertIn('3 already registered', output)
+        self.assertEqual([row[0] for row in self.read('invites.csv')], [f'invitee{index}' for index in range(1, 5)])
+        self.assertEqual([row[0] for row in self.read('rejected.csv')], ['6', '7'])
+        self.assertTrue(User.objects.filter(username='carol').exists())
+
+
+class ExportTests(VotingTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(3):
+            voter = cls.create_voter(f'exported-{index}')
+            Vote.objects.create(election=cls.election, candidate=cls.alice, voter=voter, ip_address='10.0.0.1')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_votes_csv(self):
+        response = self.client.get(reverse('export_votes'), {'election': self.election.id})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], rf'filename="votes-election-{self.election.id}-\d+-\d+\.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'election_id', 'election__title'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('exported-0', lines[1])
+
+    def test_audit_ndjson_gzip(self):
+        AuditLog.objects.create(user=self.admin, action='ELECTION_CREATED', details='created')
+        AuditLog.objects.create(user=self.admin, action='LOGIN', details='login')
+
+        response = self.client.get(reverse('export_audit_log'), {'format': 'ndjson', 'gzip': '1', 'action': 'LOGIN'})
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson.gz"'))
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+        self.assertEqual([(row['action'], row['user__username']) for row in rows], [('LOGIN', 'admin')])
+
+    def test_bad_parameters(self):
+        for kind, params in [
+            ('export_votes', {'format': 'xml'}),
+            ('export_votes', {'since': 'yesterday'}),
+            ('export_votes', {'until': '2024-02-30'}),
+            ('export_votes', {'election': 'council'}),
+            ('export_votes', {'action': 'LOGIN'}),
+            ('export_audit_log', {'election': self.election.id}),
+        ]:
+            with self.subTest(kind=kind, params=params):
+                self.assertEqual(self.client.get(reverse(kind), params).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(self.voter)
+
+        self.assertEqual(self.client.get(reverse('export_votes')).status_code, 302)
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.admin)
+
+        response = await self.async_client.get(reverse('export_votes'), {'format': 'ndjson'})
+
+        self.assertTrue(response.is_async)
+        rows = [json.loads(line) async for piece in response.streaming_content for line in piece.splitlines()]
+        self.assertEqual(len(rows), 3)
+
+    async def test_astream_is_lazy(self):
+        produced = []
+
+        def pieces():
+            for index in range(3):
+                produced.append(index)
+                yield b'%d' % index
+
+        stream = exports.astream(pieces())
+        self.assertEqual(await anext(stream), b'0')
+        self.assertEqual(produced, [0])
+        await stream.aclose()
+        self.assertEqual(produced, [0])
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('export_data', 'votes', '--format', 'ndjson', '--since', '2000-01-01', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'votes.csv.gz')
+            call_command('export_data', 'votes', '--election', str(self.election.id), '--gzip', '-o', path, stderr=StringIO())
+            with gzip.open(path, 'rt') as export:
+                self.assertEqual(len(export.read().splitlines()), 4)
+
+        with self.assertRaisesMessage(CommandError, 'Invalid date'):
+            call_command('export_data', 'audit', '--until', 'tomorrow', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, '--gzip needs --output'):
+            call_command('export_data', 'audit', '--gzip', stdout=StringIO())
+
+
+class RequestMetricsTests(VotingTestCase):
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.client.force_login(self.voter)
+
+    def test_repeated_sql_grouped(self):
+        with instrumentation.measure() as stats:
+            for candidate in (self.alice, self.bob):
+                Candidate.objects.get(pk=candidate.pk)
+            list(Candidate.objects.filter(pk__in=[self.alice.pk]))
+            list(Candidate.objects.filter(pk__in=[self.alice.pk, self.bob.pk]))
+
+        repeated = stats.repeated_sql()
+        self.assertEqual([entry['count'] for entry in repeated], [2, 2])
+        self.assertEqual(sum('IN (%s, ...)' in entry['sql'] for entry in repeated), 1)
+        self.assertEqual(stats.queries, 4)
+
+    @override_settings(REQUEST_SLOW_THRESHOLD_MS=0, REQUEST_METRICS_HEADERS=True)
+    def test_slow_request_logged(self):
+        with self.assertLogs('voting_app.requests', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+            response = self.client.get(reverse('home'))
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'home')
+        self.assertTrue(record['slow'])
+        self.assertGreater(record['cache_hits'], 0)
+        self.assertEqual(response[instrumentation.QUERY_COUNT_HEADER], str(record['db_queries']))
+
+        view_metrics = instrumentation.snapshot()['home']
+        self.assertEqual(view_metrics['requests'], 2)
+        self.assertEqual(view_metrics['latency_ms']['count'], 2)
+
+
+class PrometheusMetricsTests(VotingTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(METRICS_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.store.reset()
+        self.addCleanup(metrics.store.reset)
+        self.client.force_login(self.voter)
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_votes_and_rejections(self):
+        url = reverse('cast_vote', args=[self.election.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'candidate': self.alice.id})
+            self.client.post(url, {'candidate': self.bob.id})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('metrics'))
+
+        body = response.content.decode()
+        self.assertIn(f'voting_votes_cast_total{{election="{self.election.id}"}} 1.0', body)
+        self.assertIn('voting_vote_rejections_total{reason="already_voted"} 1.0', body)
+        self.assertIn('voting_http_request_duration_seconds_count{view="cast_vote"} 2.0', body)
+        self.assertIn('voting_http_request_duration_seconds_bucket{view="cast_vote",le="+Inf"} 2.0', body)
+        self.assertIn('voting_elections_open 1.0', body)
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'voting_app_vote"' in query['sql']])
+
+    def test_processes_aggregated(self):
+        metrics.VOTES_CAST.inc(election=99)
+        metrics.AUDIT_BUFFER_DEPTH.set(3)
+
+        def worker():
+            metrics.VOTES_CAST.inc(2, election=99)
+            metrics.AUDIT_BUFFER_DEPTH.set(5)
+
+        process = multiprocessing.get_context('fork').Process(target=worker)
+        process.start()
+        process.join()
+
+        body = metrics.render()
+        self.assertIn('voting_votes_cast_total{election="99"} 3.0', body)
+        # Gauges of exited processes are left out
+        self.assertIn('voting_audit_buffer_depth 3.0', body)
+
+    def write_value_file(self, pid, values):
+        """Leave a value file behind as if process `pid` had written it"""
+        value_file = metrics.ValueFile(metrics.store.directory() / f'metrics-{pid}.db')
+        for key, value in values.items():
+            value_file.set(key, value)
+        value_file.close()
+
+    def test_exited_processes_merged(self):
+        votes = metrics.VOTES_CAST._key({'election': 99})
+        depth = metrics.AUDIT_BUFFER_DEPTH._key({})
+        self.write_value_file(4999999, {votes: 4, depth: 7})
+        # Left by an earlier process that had our pid
+        self.write_value_file(os.getpid(), {votes: 2})
+
+        with mock.patch('voting_app.metrics._pid_alive', side_effect=lambda pid: pid != 4999999):
+            metrics.VOTES_CAST.inc(election=99)
+            body = metrics.render()
+
+        self.assertIn('voting_votes_cast_total{election="99"} 7.0', body)
+        self.assertNotIn('voting_audit_buffer_depth 7.0', body)
+        self.assertEqual(
+            sorted(path.name for path in metrics.store.directory().glob('metrics-*.db')),
+            sorted(['metrics-aggregate.db', f'metrics-{os.getpid()}.db']),
+        )
+
+        # Later exits add to the aggregate
+        self.write_value_file(4999998, {votes: 10})
+        process = multiprocessing.get_context('fork').Process(target=metrics.VOTES_CAST.inc, kwargs={'election': 99})
+        process.start()
+        process.join()
+
+        self.assertIn('voting_votes_cast_total{election="99"} 18.0', metrics.render())
+        self.assertEqual(
+            sorted(path.name for path in metrics.store.directory().glob('metrics-*.db')),
+            sorted(['metrics-aggregate.db', f'metrics-{os.getpid()}.db', f'metrics-{process.pid}.db']),
+        )
+
+    def test_connection_pool_usage(self):
+        pool = mock.Mock()
+        pool.get_stats.side_effect = [
+            {'pool_max': 10, 'pool_size': 4, 'pool_available': 1, 'requests_waiting': 2,
+             'requests_num': 120, 'requests_queued': 7, 'requests_wait_ms': 350, 'requests_errors': 1},
+            {'pool_max': 10, 'pool_size': 4, 'pool_available': 4,
+             'requests_num': 150, 'requests_queued': 7, 'requests_wait_ms': 350, 'requests_errors': 1, 'returns_bad': 1},
+        ]
+        with mock.patch.object(db_pool, 'pools', return_value={'default': pool}):
+            self.client.get(reverse('metrics'))
+            body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('voting_db_pool_connections{alias="default"} 4.0', body)
+        self.assertIn('voting_db_pool_connections_idle{alias="default"} 4.0', body)
+        self.assertIn('voting_db_pool_requests_waiting{alias="default"} 0.0', body)
+        # The pool's totals are exported, not added up per scrape
+        self.assertIn('voting_db_pool_checkouts_total{alias="default"} 150.0', body)
+        self.assertIn('voting_db_pool_checkout_wait_seconds_total{alias="default"} 0.35', body)
+        self.assertIn('voting_db_pool_checkout_errors_total{alias="default"} 1.0', body)
+        self.assertIn('voting_db_pool_connections_lost_total{alias="default"} 1.0', body)
+
+    def test_pools_not_created_or_opened_are_skipped(self):
+        opened, unopened = mock.Mock(closed=False), mock.Mock(closed=True)
+        wrapper = mock.Mock(_connection_pools={'default': opened, 'replica': unopened})
+        connections = mock.MagicMock()
+        connections.__iter__.return_value = iter(['default', 'replica', 'reports'])
+        connections.__getitem__.return_value = wrapper
+        connections.settings = {alias: {'OPTIONS': {'pool': True}} for alias in ('default', 'replica', 'reports')}
+        with mock.patch.object(db_pool, 'connections', connections):
+            self.assertEqual(db_pool.pools(), {'default': opened})
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_token_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+
+
+class EntityCacheTests(VotingTestCase):
+
+    def setUp(self):
+        entity_cache.entity_cache.local.clear()
+        cache.clear()
+        self.addCleanup(entity_cache.entity_cache.local.clear)
+        self.addCleanup(cache.clear)
+
+    @override_settings(ENTITY_CACHE_ENABLED=True)
+    def test_tiers_and_versioning(self):
+        counters = entity_cache.entity_cache.counters
+        before = dict(counters)
+        with self.assertNumQueries(1):
+            entity_cache.get_election(self.election.id)
+        with self.assertNumQueries(0):
+            election = entity_cache.get_election(self.election.id)
+        entity_cache.entity_cache.local.clear()
+        with self.assertNumQueries(0):
+            entity_cache.get_election(self.election.id)
+        self.assertEqual(counters['misses'] - before['misses'], 1)
+        self.assertEqual(counters['local_hits'] - before['local_hits'], 1)
+        self.assertEqual(counters['shared_hits'] - before['shared_hits'], 1)
+
+        # The version moves when the edit commits; other processes' entries go stale
+        election.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            election.save()
+        self.assertEqual(entity_cache.get_election(self.election.id).title, 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Candidate.objects.create(election=self.election, name='Carol')
+        self.assertEqual([c.name for c in entity_cache.get_candidates(self.election.id)], ['Alice', 'Bob', 'Carol'])
+
+    @override_settings(ENTITY_CACHE_ENABLED=True)
+    def test_hits_are_copies(self):
+        entity_cache.get_election(self.election.id).title = 'Changed in a view'
+
+        self.assertEqual(entity_cache.get_election(self.election.id).title, 'Council Election')
+
+    @override_settings(ENTITY_CACHE_ENABLED=True)
+    def test_views_read_through_cache(self):
+        self.client.force_login(self.voter)
+        detail = reverse('election_detail', args=[self.election.id])
+        self.client.get(detail)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(detail)
+        self.assertEqual([candidate.name for candidate in response.context['candidates']], ['Alice', 'Bob'])
+        entity_sql = re.compile(r'FROM "voting_app_(election|candidate)"')
+        self.assertFalse([query['sql'] for query in context.captured_queries if entity_sql.search(query['sql'])])
+
+        # Closed behind the cache's back: the vote is still checked against the database
+        Election.objects.filter(pk=self.election.pk).update(end_time=timezone.now() - timedelta(minutes=1))
+        self.client.post(reverse('cast_vote', args=[self.election.id]), {'candidate': self.alice.id})
+        self.assertFalse(Vote.objects.exists())
+
+        self.election.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.election.save()
+        self.assertEqual(self.client.get(detail).context['election'].title, 'Renamed')
+
+    def test_shared_tier_ttl(self):
+        # LocMem: other workers never see a version bump
+        self.assertEqual(entity_cache.entity_cache._ttl(), 5)
+        with mock.patch.object(entity_cache, 'shared_backend', return_value=True):
+            self.assertEqual(entity_cache.entity_cache._ttl(), 300)
+
+    def test_disabled(self):
+        with self.assertNumQueries(1):
+            entity_cache.get_election(self.election.id)
+        with self.assertNumQueries(1):
+            entity_cache.get_election(self.election.id)
+        self.assertEqual(len(entity_cache.entity_cache.local), 0)
+
+
+class SQLiteConcurrencyTests(PlainTestCase):
+    """
+    Parallel writers on a file database opened with the configured SQLite profile.
+
+    A plain unittest case: Django's test cases forbid connections to
+    databases they do not manage.
+    """
+    alias = 'concurrency'
+    writers = 8
+    transactions = 25
+
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.settings_dict['OPTIONS'].get('transaction_mode') != 'IMMEDIATE':
+            self.skipTest('Needs the concurrent SQLite profile')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings[self.alias] = dict(
+            connection.settings_dict, NAME=str(Path(directory.name) / 'concurrency.sqlite3')
+        )
+        self.addCleanup(self.drop_alias)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            cursor.execute('INSERT INTO counter VALUES (1, 0)')
+
+    def drop_alias(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+        del connections.settings[self.alias]
+
+    def test_connection_pragmas(self):
+        with connections[self.alias].cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['busy_timeout'], 20000)
+        self.assertGreater(pragmas['mmap_size'], 0)
+
+    def test_parallel_read_then_write_transactions(self):
+        # A deferred transaction would fail its lock upgrade here ("database is locked")
+        errors = []
+        start = threading.Barrier(self.writers)
+
+        def writer():
+            try:
+                start.wait()
+                for _ in range(self.transactions):
+                    with transaction.atomic(using=self.alias), connections[self.alias].cursor() as cursor:
+                        cursor.execute('SELECT value FROM counter WHERE id = 1')
+                        value = cursor.fetchone()[0]
+                        cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections[self.alias].close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT value FROM counter WHERE id = 1')
+            self.assertEqual(cursor.fetchone()[0], self.writers * self.transactions)
+
+
+class PostgresConnectionSettingsTests(PlainTestCase):
+
+    def configure(self, options=None, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return configure_postgres({'ENGINE': 'django.db.backends.postgresql', 'OPTIONS': options or {}})
+
+    def test_persistent_connections_by_default(self):
+        database = self.configure()
+
+        self.assertNotIn('pool', database['OPTIONS'])
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_pool_from_environment(self):
+        database = self.configure(DB_POOL='true', DB_POOL_MAX_SIZE='20', DB_POOL_TIMEOUT='2.5')
+
+        pool = database['OPTIONS']['pool']
+        self.assertEqual((pool['min_size'], pool['max_size'], pool['timeout']), (2, 20, 2.5))
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+
+    def test_pool_from_database_url(self):
+        # dj_database_url leaves the query string in OPTIONS
+        database = self.configure({'sslmode': 'require', 'pool': True, 'pool_min_size': 0}, DB_POOL_MAX_SIZE='4')
+
+        self.assertEqual(database['OPTIONS']['sslmode'], 'require')
+        self.assertNotIn('pool_min_size', database['OPTIONS'])
+        self.assertEqual(database['OPTIONS']['pool']['min_size'], 0)
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 4)
+
+    def test_database_url_without_query_string(self):
+        # The settings module extends MIDDLEWARE in place: import it in its own interpreter
+        environ = dict(os.environ, DATABASE_URL='postgresql://u:p@localhost:5432/db', SECRET_KEY='test', DB_PASSWORD='')
+        environ.pop('DB_POOL', None)
+        script = (
+            'import json; from online_voting_system import settings_postgresql as s; '
+            'print(json.dumps(s.DATABASES["default"]["OPTIONS"]))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], env=environ, cwd=settings.BASE_DIR, capture_output=True, text=True
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout), {'sslmode': 'require'})
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """Routing decisions only; QuerySet.db does not touch either database"""
+
+    def setUp(self):
+        patcher = mock.patch.object(routing, 'replica_available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_router(self):
+        self.assertEqual(Election.objects.all().db, 'default')
+        with routing.use_replica():
+            self.assertEqual(Election.objects.all().db, 'replica')
+            self.assertEqual(Vote.objects.all().db, 'replica')
+            # Sessions and users are always read from the primary
+            self.assertEqual(User.objects.all().db, 'default')
+            with routing.use_primary():
+                self.assertEqual(Election.objects.all().db, 'default')
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                self.assertEqual(Election.objects.all().db, 'default')
+        self.assertEqual(routing.ReplicaRouter().db_for_write(Vote), 'default')
+
+    def test_pinned_to_primary_after_post(self):
+        reads = []
+
+        @routing.replica_reads
+        def view(request):
+            reads.append(Election.objects.all().db)
+            return HttpResponse()
+
+        middleware = routing.ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+
+        self.assertNotIn('primary_pin', middleware(factory.get('/')).cookies)
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.cookies['primary_pin']['max-age'], 10)
+        pinned = factory.get('/')
+        pinned.COOKIES['primary_pin'] = '1'
+        middleware(pinned)
+
+        self.assertEqual(reads, ['replica', 'replica', 'default'])
+
+    def test_async_view(self):
+        reads = []
+
+        @routing.replica_reads
+        async def view(request):
+            reads.append(Election.objects.all().db)
+            return HttpResponse()
+
+        middleware = routing.ReplicaRoutingMiddleware(view)
+        async_to_sync(middleware)(RequestFactory().get('/'))
+
+        self.assertEqual(reads, ['replica'])
+
+
+@override_settings(
+    ADMISSION_CONTROL_ENABLED=True,
+    ADMISSION_LIMITS={'vote': {'user': '2/m', 'ip': '100/m'}, 'login': {'user': '1/m'}},
+)
+class AdmissionControlTests(VotingTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_login(self.voter)
+        self.url = reverse('cast_vote', args=[self.election.id])
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        bucket = admission.TokenBucket('admission:test', capacity=2, interval=30)
+        with mock.patch('voting_app.admission.time.time', return_value=1000.0):
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 30)
+        # One token back after one interval
+        with mock.patch('voting_app.admission.time.time', return_value=1030.0):
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 30)
+
+    def test_vote_rate_limited_per_user(self):
+        rejected = admission.counters['rate_limited']
+        self.client.post(self.url, {'candidate': self.alice.id})
+        self.client.post(self.url, {'candidate': self.alice.id})
+
+        response = self.client.post(self.url, {'candidate': self.alice.id})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 29)
+        self.assertEqual(admission.counters['rate_limited'], rejected + 1)
+        # A different voter has a bucket of their own; reads are never limited
+        self.client.force_login(self.create_voter('other'))
+        self.assertEqual(self.client.post(self.url, {'candidate': self.bob.id}).status_code, 302)
+        self.assertEqual(self.client.get(reverse('election_detail', args=[self.election.id])).status_code, 200)
+
+    def test_login_rate_limited_per_username(self):
+        credentials = {'username': 'Voter', 'password': 'wrong'}
+        self.client.post(reverse('login'), credentials)
+
+        response = self.client.post(reverse('login'), dict(credentials, username='voter'))
+
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(ADMISSION_LIMITS={'register': {'ip': '2/h'}})
+    def test_spoofed_forwarded_for_ignored(self):
+        self.client.logout()
+        url = reverse('register')
+        statuses = [
+            self.client.post(url, {}, HTTP_X_FORWARDED_FOR=f'198.51.100.{index}').status_code
+            for index in range(3)
+        ]
+        self.assertEqual(statuses[2], 429)
+
+        # Behind one proxy only its entry, the last one, counts
+        with self.settings(ADMISSION_TRUSTED_PROXIES=1):
+            statuses = [
+                self.client.post(url, {}, HTTP_X_FORWARDED_FOR=f'198.51.100.{index}, 203.0.113.7').status_code
+                for index in range(3)
+            ]
+            self.assertEqual(statuses[2], 429)
+            self.assertNotEqual(self.client.post(url, {}, HTTP_X_FORWARDED_FOR='203.0.113.8').status_code, 429)
+
+    @override_settings(ADMISSION_MAX_CONCURRENT=0, ADMISSION_RETRY_AFTER=3)
+    def test_overload_fails_fast(self):
+        overloaded = admission.counters['overloaded']
+
+        response = self.client.post(self.url, {'candidate': self.alice.id})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(admission.counters['overloaded'], overloaded + 1)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(admission.limiter.in_flight, 0)
+
+    @override_settings(ADMISSION_MAX_CONCURRENT=2)
+    def test_cap_shared_by_workers(self):
+        # Two requests in progress in other workers
+        cache.set(admission.IN_FLIGHT_KEY, 2, 60)
+
+        # Refused before the session and user are loaded
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {'candidate': self.alice.id})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(cache.get(admission.IN_FLIGHT_KEY), 2)
+
+        cache.set(admission.IN_FLIGHT_KEY, 1, 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'candidate': self.alice.id})
+        self.assertEqual(response.status_code, 302)
+        # The slot is given back once the view returns
+        self.assertEqual(cache.get(admission.IN_FLIGHT_KEY), 1)
+        self.assertEqual(admission.limiter.in_flight, 0)
+
+    @override_settings(ADMISSION_MAX_CONCURRENT=1)
+    def test_expired_count_starts_over(self):
+        limiter = admission.ConcurrencyLimiter()
+        self.assertTrue(limiter.acquire(1))
+        self.assertFalse(limiter.acquire(1))
+
+        cache.delete(admission.IN_FLIGHT_KEY)
+        limiter.release()
+
+        self.assertTrue(limiter.acquire(1))
+        self.assertEqual(limiter.peak, 1)
+
+    async def test_async_cap(self):
+        limiter = admission.ConcurrencyLimiter()
+
+        self.assertTrue(await limiter.aacquire(1))
+        self.assertFalse(await limiter.aacquire(1))
+        await limiter.arelease()
+
+        self.assertEqual(await cache.aget(admission.IN_FLIGHT_KEY), 0)
+
+    def test_health_endpoint_skips_sessions_and_database(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/healthz')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertIn('in_flight', response.json())
+
+
+@override_settings(VOTER_INDEX_ENABLED=True)
+class VoterIndexTests(VotingTestCase):
+    VOTE_SQL = re.compile(r'\bFROM "voting_app_vote"')
+
+    def setUp(self):
+        voter_index.clear()
+        self.addCleanup(voter_index.clear)
+        cache.clear()
+        self.client.force_login(self.voter)
+        self.detail_url = reverse('election_detail', args=[self.election.id])
+        patcher = mock.patch('voting_app.audit.AuditBuffer.add')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def vote_queries(self, context):
+        return [query['sql'] for query in context.captured_queries if self.VOTE_SQL.search(query['sql'])]
+
+    def test_memory_per_million_voters(self):
+        bitmap = voter_index.VoterBitmap()
+        for user_id in range(1, 1_000_001):
+            bitmap.add(user_id)
+
+        self.assertEqual(bitmap.count, 1_000_000)
+        self.assertIn(1_000_000, bitmap)
+        self.assertNotIn(1_000_001, bitmap)
+        # One bit per user id, plus one growth chunk at most
+        self.assertLessEqual(bitmap.memory_bytes, 125_001 + voter_index.GROWTH_BYTES)
+        self.assertLess(sys.getsizeof(bitmap.bits), 130 * 1024 + voter_index.GROWTH_BYTES)
+
+    def test_detail_page_and_repeat_vote(self):
+        self.client.get(self.detail_url)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.detail_url)
+        self.assertTrue(response.context['can_vote'])
+        self.assertEqual(self.vote_queries(context), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cast_vote', args=[self.election.id]), {'candidate': self.alice.id})
+        response = self.client.get(self.detail_url)
+        self.assertFalse(response.context['can_vote'])
+        self.assertEqual(response.context['user_vote'].candidate, self.alice)
+
+        # Refused before the ballot is resolved: only the session and user lookups
+        with self.assertQueryBudget(2), mock.patch('voting_app.voter_index.shared_backend', return_value=True):
+            self.client.post(reverse('cast_vote', args=[self.election.id]), {'candidate': self.bob.id})
+        self.assertEqual(Vote.objects.filter(voter=self.voter).count(), 1)
+        # With a per-process cache, plus the check that the vote still exists
+        with self.assertQueryBudget(3):
+            self.client.post(reverse('cast_vote', args=[self.election.id]), {'candidate': self.bob.id})
+        self.assertEqual(Vote.objects.filter(voter=self.voter).count(), 1)
+
+    def test_vote_deleted_by_another_worker(self):
+        url = reverse('cast_vote', args=[self.election.id])
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'candidate': self.alice.id})
+        self.assertTrue(voter_index.known_voter(self.election.id, self.voter.pk))
+
+        # Deleted by another worker, whose epoch bump stays in its own LocMem cache
+        Vote.objects.filter(voter=self.voter)._raw_delete(Vote.objects.db)
+        self.assertIn(self.voter.pk, voter_index._bitmaps[self.election.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'candidate': self.bob.id})
+
+        self.assertRedirects(response, self.detail_url, fetch_redirect_response=False)
+        self.assertEqual(Vote.objects.get(voter=self.voter).candidate, self.bob)
+
+    def test_follows_votes_from_other_processes(self):
+        other = self.create_voter('other')
+        self.assertFalse(voter_index.has_voted(self.election.id, other.pk, 0))
+
+        # Written without going through this process's cast_ballot
+        vote = Vote.objects.create(voter=other, candidate=self.bob, election=self.election)
+        self.assertTrue(voter_index.has_voted(self.election.id, other.pk, 1))
+        self.assertTrue(voter_index.known_voter(self.election.id, other.pk))
+
+        # Deleted by another process: the shared epoch and the total tell this one
+        Vote.objects.filter(pk=vote.pk)._raw_delete(Vote.objects.db)
+        cache.set(voter_index._epoch_key(self.election.id), 1)
+        self.assertFalse(voter_index.known_voter(self.election.id, other.pk))
+        self.assertFalse(voter_index.has_voted(self.election.id, other.pk, 0))
+
+    def test_votes_after_total_was_read(self):
+        first, second, late = (self.create_voter(name) for name in ('first', 'second', 'late'))
+        voter_index.has_voted(self.election.id, self.voter.pk, 0)
+        Vote.objects.create(voter=first, candidate=self.bob, election=self.election)
+        Vote.objects.create(voter=second, candidate=self.bob, election=self.election)
+
+        # The total (1) was read before the second vote committed: catch up, no rebuild
+        with mock.patch.object(voter_index, 'build') as build, CaptureQueriesContext(connection) as context:
+            self.assertTrue(voter_index.has_voted(self.election.id, second.pk, 1))
+            self.assertFalse(voter_index.has_voted(self.election.id, self.voter.pk, 2))
+        build.assert_not_called()
+        self.assertEqual(len(self.vote_queries(context)), 1)
+
+        # A lower id committed after a higher one was loaded: the gap remains, rebuild
+        Vote.objects.create(voter=late, candidate=self.bob, election=self.election)
+        voter_index.has_voted(self.election.id, late.pk, 3)
+        voter_index._bitmaps[self.election.id].discard(late.pk)
+        self.assertTrue(voter_index.has_voted(self.election.id, late.pk, 3))
+
+
+class EligibilityTests(VotingTestCase):
+
+    def years_ago(self, years, days=0):
+        return eligibility.age_cutoff(timezone.localdate(self.election.start_time), years) + timedelta(days=days)
+
+    def test_age_cutoff_matches_age(self):
+        def age(born, on):
+            return on.year - born.year - ((on.month, on.day) < (born.month, born.day))
+
+        for on in (date(2024, 2, 29), date(2025, 2, 28), date(2025, 3, 1), date(2025, 12, 31)):
+            cutoff = eligibility.age_cutoff(on, 18)
+            with self.subTest(on=on):
+                self.assertEqual(age(cutoff, on), 18)
+                self.assertEqual(age(cutoff + timedelta(days=1), on), 17)
+        self.assertEqual(age(date(2008, 2, 29), date(2026, 2, 28)), 17)
+        self.assertEqual(eligibility.age_cutoff(date(2026, 2, 28), 18), date(2008, 2, 28))
+
+    def test_eligible_counts_in_one_query(self):
+        Election.objects.filter(pk=self.election.pk).update(minimum_voter_age=21)
+        self.election.refresh_from_db()
+        open_to_all = Election.objects.create(
+            title='Referendum', description='', start_time=self.election.start_time,
+            end_time=self.election.end_time, is_active=True, created_by=self.admin
+        )
+        self.create_voter('nineteen', date_of_birth=self.years_ago(19))
+        self.create_voter('just-21', date_of_birth=self.years_ago(21))
+        self.create_voter('almost-21', date_of_birth=self.years_ago(21, days=1))
+        self.create_voter('flagged', is_eligible=False)
+
+        with self.assertNumQueries(1):
+            counts = eligibility.eligible_counts([self.election, open_to_all])
+
+        # 'voter' (born 1990) and 'just-21'; the referendum adds the under-21s
+        self.assertEqual(counts, {self.election.pk: 2, open_to_all.pk: 4})
+        self.assertEqual(
+            sorted(eligibility.eligible_voters(self.election).values_list('user__username', flat=True)),
+            ['just-21', 'voter'],
+        )
+        with self.assertNumQueries(2):
+            rows = eligibility.turnout([self.election, open_to_all])
+        self.assertEqual([row['eligible'] for row in rows], [2, 4])
+
+    def test_underage_vote_rejected(self):
+        Election.objects.filter(pk=self.election.pk).update(minimum_voter_age=21)
+        voter = self.create_voter('nineteen', date_of_birth=self.years_ago(19))
+        self.client.force_login(voter)
+
+        self.client.post(reverse('cast_vote', args=[self.election.id]), {'candidate': self.alice.id})
+
+        self.assertFalse(Vote.objects.exists())
+
+    def test_admin_filters(self):
+        self.client.force_login(User.objects.create_superuser('root', password='root-pass'))
+        self.create_voter('twenty', date_of_birth=self.years_ago(20))
+        url = reverse('admin:voting_app_userprofile_changelist')
+
+        response = self.client.get(url, {'age': '18-24', 'o': '4'})
+        self.assertEqual([profile.user.username for profile in response.context['cl'].result_list], ['twenty'])
+
+        response = self.client.get(url, {'eligible_for': self.election.pk, 'o': '4'})
+        self.assertEqual(
+            [profile.user.username for profile in response.context['cl'].result_list], ['twenty', 'voter']
+        )
+
+
+@override_settings(LEDGER_BATCH_SIZE=3)
+class VoteLedgerTests(VotingTestCase):
+
+    def cast(self, count, start=0):
+        votes = []
+        for n in range(start, start + count):
+            voter = self.create_voter(f'ledger-{n}')
+            votes.append(voting.cast_ballot(voter, self.election.id, [self.alice, self.bob][n % 2].id))
+        return votes
+
+    def test_merkle_paths(self):
+        for size in range(1, 18):
+            leaves = [ledger.leaf_hash(bytes([n])) for n in range(size)]
+            root = ledger.merkle_root(leaves)
+            for index in range(size):
+                with self.subTest(size=size, index=index):
+                    path = ledger.merkle_path(leaves, index)
+                    self.assertLessEqual(len(path), (size - 1).bit_length())
+                    self.assertEqual(ledger.root_from_path(leaves[index], index, size, path), root)
+                    if size > 1:
+                        # The path only fits the leaf's own position
+                        self.assertNotEqual(ledger.root_from_path(leaves[index], (index + 1) % size, size, path), root)
+
+    def test_seal_incrementally_and_prove(self):
+        votes = self.cast(4)
+        # Written without cast_ballot: stamped when sealed
+        votes.append(Vote.objects.create(voter=self.voter, candidate=self.alice, election=self.election))
+        self.assertEqual(votes[-1].receipt, '')
+
+        self.assertEqual(ledger.seal(self.election.id), 2)
+        votes += self.cast(6, start=4)
+        self.assertEqual(ledger.seal(self.election.id), 2)
+
+        blocks = list(LedgerBlock.objects.filter(election=self.election))
+        self.assertEqual([block.size for block in blocks], [3, 2, 3, 3])
+        # Incremental election root == tree over all block roots
+        block_leaves = [ledger.leaf_hash(bytes.fromhex(block.merkle_root)) for block in blocks]
+        self.assertEqual(blocks[-1].election_root, ledger.merkle_root(block_leaves).hex())
+        self.assertEqual(blocks[1].election_root, ledger.merkle_root(block_leaves[:2]).hex())
+
+        for vote in Vote.objects.filter(election=self.election):
+            with self.subTest(position=vote.ledger_position):
+                proof = ledger.inclusion_proof(self.election.id, vote.receipt)
+                self.assertTrue(ledger.verify_proof(proof))
+                self.assertLessEqual(len(proof['block_path']) + len(proof['election_path']), 2 + 2)
+        forged = dict(proof, receipt='0' * 64)
+        self.assertFalse(ledger.verify_proof(forged))
+
+        self.assertEqual(ledger.verify_election(self.election.id, workers=1), [])
+
+    def test_tampering_detected(self):
+        first, second, third = self.cast(3)
+        ledger.seal(self.election.id)
+
+        Vote.objects.filter(pk=first.pk).update(candidate=self.bob if first.candidate_id == self.alice.id else self.alice)
+        Vote.objects.filter(pk=second.pk)._raw_delete(Vote.objects.db)
+
+        problems = ledger.verify_election(self.election.id, workers=1)
+        self.assertEqual(len(problems), 2, problems)
+        self.assertIn('altered', problems[0])
+        self.assertIn('missing', problems[1])
+
+    def test_receipt_proof_api(self):
+        vote, = self.cast(1)
+        self.client.force_login(vote.voter)
+        url = reverse('api_ledger_proof', args=[self.election.id, vote.receipt])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        ledger.seal(self.election.id)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(ledger.verify_proof(response.json()))
+        self.assertContains(self.client.get(reverse('election_detail', args=[self.election.id])), vote.receipt)
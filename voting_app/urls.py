@@ -1,20 +1,42 @@
 # cspell:ignore uidb64
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
+from .admission import admission_control
+
+if settings.ASYNC_VIEWS:
+    # ASGI deployments: async implementations of the high-traffic views
+    from . import async_views
+    home_view = async_views.home
+    election_detail_view = async_views.election_detail
+    cast_vote_view = async_views.cast_vote
+    election_results_view = async_views.election_results
+    api_election_status_view = async_views.api_election_status
+else:
+    home_view = views.home
+    election_detail_view = views.ElectionDetailView.as_view()
+    cast_vote_view = views.cast_vote
+    election_results_view = views.election_results
+    api_election_status_view = views.api_election_status
+
+# Rate limits and the concurrency cap on the POSTs that write (voting_app/admission.py)
+cast_vote_view = admission_control('vote')(cast_vote_view)
+register_view = admission_control('register')(views.register)
+login_view = admission_control('login')(auth_views.LoginView.as_view(template_name='voting_app/login.html'))
 
 urlpatterns = [
     # Public views
-    path('', views.home, name='home'),
-    path('register/', views.register, name='register'),
-    path('login/', auth_views.LoginView.as_view(template_name='voting_app/login.html'), name='login'),
+    path('', home_view, name='home'),
+    path('register/', register_view, name='register'),
+    path('login/', login_view, name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     
     # Election views
     path('elections/', views.ElectionListView.as_view(), name='election_list'),
-    path('elections/<int:pk>/', views.ElectionDetailView.as_view(), name='election_detail'),
-    path('elections/<int:election_id>/vote/', views.cast_vote, name='cast_vote'),
-    path('elections/<int:election_id>/results/', views.election_results, name='election_results'),
+    path('elections/<int:pk>/', election_detail_view, name='election_detail'),
+    path('elections/<int:election_id>/vote/', cast_vote_view, name='cast_vote'),
+    path('elections/<int:election_id>/results/', election_results_view, name='election_results'),
     
     # User profile
     path('profile/', views.profile, name='profile'),
@@ -25,9 +47,17 @@ urlpatterns = [
     path('admin/elections/create/', views.create_election, name='create_election'),
     path('admin/elections/<int:election_id>/candidates/', views.manage_candidates, name='manage_candidates'),
     path('admin/candidates/<int:candidate_id>/delete/', views.delete_candidate, name='delete_candidate'),
+    path('admin-dashboard/exports/votes/', views.export_votes, name='export_votes'),
+    path('admin-dashboard/exports/audit-log/', views.export_audit_log, name='export_audit_log'),
+    
+    # Monitoring
+    path('metrics', views.prometheus_metrics, name='metrics'),
     
     # API endpoints
-    path('api/elections/<int:election_id>/status/', views.api_election_status, name='api_election_status'),
+    path('api/elections/<int:election_id>/status/', api_election_status_view, name='api_election_status'),
+    path('api/elections/<int:election_id>/stream/', views.api_election_stream, name='api_election_stream'),
+    path('api/elections/<int:election_id>/results/', views.api_election_results, name='api_election_results'),
+    path('api/elections/<int:election_id>/ledger/<str:receipt>/', views.api_ledger_proof, name='api_ledger_proof'),
     
     # Password reset views
     path('password-reset/', 
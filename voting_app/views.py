@@ -4,15 +4,28 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
 from django.views.generic import ListView, DetailView
-from django.http import JsonResponse
-from django.db.models import Count, Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
 from django.utils import timezone
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
 from django.urls import reverse_lazy
-from django.db import transaction
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
 
-from .models import Election, Candidate, Vote, UserProfile, AuditLog
+from .models import Election, Candidate, Vote, UserProfile
 from .forms import CustomUserCreationForm, VoteForm, ElectionForm, CandidateForm, UserProfileForm
+from . import audit, db_pool, eligibility, ledger, metrics, voter_index
+from .voting import VoteRejected, cast_ballot
+from .ballots import get_ballot
+from .entity_cache import get_election
+from .homepage import get_home_context
+from .live import broadcaster, compute_status
+from .results import closing_results, get_final_results
+from .routing import replica_reads
+from .exports import FORMATS, ExportError, astream, export_filename, export_queryset, parse_moment, stream_export
 
 
 def get_client_ip(request):
@@ -25,41 +38,23 @@ def get_client_ip(request):
     return ip
 
 
+def get_election_or_404(election_id):
+    """Read an election through the entity cache"""
+    try:
+        return get_election(election_id)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
+
+
 def log_audit(user, action, details, request):
-    """Log audit trail"""
-    AuditLog.objects.create(
-        user=user,
-        action=action,
-        details=details,
-        ip_address=get_client_ip(request)
-    )
+    """Log audit trail (batched off the request path when AUDIT_LOG_ASYNC is on)"""
+    audit.record(user, action, details, get_client_ip(request))
 
 
+@replica_reads
 def home(request):
     """Home page showing active elections"""
-    current_time = timezone.now()
-    
-    # Get active elections
-    ongoing_elections = Election.objects.filter(
-        is_active=True,
-        start_time__lte=current_time,
-        end_time__gte=current_time
-    )
-    
-    upcoming_elections = Election.objects.filter(
-        is_active=True,
-        start_time__gt=current_time
-    )
-    
-    finished_elections = Election.objects.filter(
-        end_time__lt=current_time
-    ).order_by('-end_time')[:5]  # Last 5 finished elections
-    
-    context = {
-        'ongoing_elections': ongoing_elections,
-        'upcoming_elections': upcoming_elections,
-        'finished_elections': finished_elections,
-    }
+    context = get_home_context()
     
     return render(request, 'voting_app/home.html', context)
 
@@ -71,6 +66,7 @@ def register(request):
         if form.is_valid():
             user = form.save()
             log_audit(user, 'USER_REGISTERED', f'New user registered: {user.username}', request)
+            metrics.REGISTRATIONS.inc()
             login(request, user)
             messages.success(request, 'Registration successful! Welcome to the voting system.')
             return redirect('home')
@@ -82,6 +78,7 @@ def register(request):
     return render(request, 'voting_app/register.html', {'form': form})
 
 
+@method_decorator(replica_reads, name='dispatch')
 class ElectionListView(ListView):
     """List all elections"""
     model = Election
@@ -99,19 +96,32 @@ class ElectionDetailView(LoginRequiredMixin, DetailView):
     template_name = 'voting_app/election_detail.html'
     context_object_name = 'election'
     
+    def get_object(self, queryset=None):
+        # Election and candidates come from the ballot cache
+        try:
+            self.ballot = get_ballot(self.kwargs['pk'])
+        except Election.DoesNotExist:
+            raise Http404("No Election matches the given query.")
+        return self.ballot['election']
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         election = self.object
         user = self.request.user
         
-        # Check if user has already voted
-        user_vote = Vote.objects.filter(voter=user, election=election).first()
+        # Check if user has already voted; only voters need their Vote row
+        voted = voter_index.has_voted(election.pk, user.pk, election.total_votes)
+        user_vote = None
+        if voted is not False:
+            user_vote = Vote.objects.filter(voter=user, election=election).select_related('candidate').first()
+            if voted and user_vote is None:
+                voter_index.forget(election.pk, user.pk)
         context['user_vote'] = user_vote
         
         # Get candidates with vote counts (only show after election ends or if user is admin)
-        candidates = election.candidates.all()
+        candidates = self.ballot['candidates']
         if election.is_finished or user.is_staff:
-            candidates = candidates.annotate(vote_count=Count('votes'))
+            candidates = election.candidates.select_related('tally')
         
         context['candidates'] = candidates
         context['can_vote'] = election.is_ongoing and not user_vote
@@ -126,56 +136,65 @@ class ElectionDetailView(LoginRequiredMixin, DetailView):
 @login_required
 def cast_vote(request, election_id):
     """Handle vote casting"""
-    election = get_object_or_404(Election, id=election_id)
-    
     if request.method == 'POST':
-        form = VoteForm(election=election, user=request.user, data=request.POST)
-        
-        if form.is_valid():
-            try:
-                with transaction.atomic():
-                    vote = form.save(ip_address=get_client_ip(request))
-                    log_audit(
-                        request.user, 
-                        'VOTE_CAST', 
-                        f'Vote cast in election: {election.title}', 
-                        request
-                    )
-                    messages.success(request, 'Your vote has been cast successfully!')
-                    return redirect('election_detail', pk=election_id)
-            except Exception as e:
-                messages.error(request, f'Error casting vote: {str(e)}')
+        try:
+            vote = cast_ballot(
+                request.user,
+                election_id,
+                request.POST.get('candidate'),
+                ip_address=get_client_ip(request)
+            )
+        except VoteRejected as e:
+            if e.code == 'invalid_candidate':
+                get_election_or_404(election_id)
+            messages.error(request, e.message)
         else:
-            for field, errors in form.errors.items():
-                for error in errors:
-                    messages.error(request, error)
+            log_audit(
+                request.user, 
+                'VOTE_CAST', 
+                f'Vote cast in election: {vote.election.title}', 
+                request
+            )
+            messages.success(request, 'Your vote has been cast successfully!')
     
     return redirect('election_detail', pk=election_id)
 
 
+@replica_reads
 @login_required
 def election_results(request, election_id):
     """View election results"""
-    election = get_object_or_404(Election, id=election_id)
+    # Finished elections are served from their cached results snapshot
+    final_results = get_final_results(election_id)
+    if final_results is not None:
+        return render(request, 'voting_app/election_results.html', final_results)
     
-    # Only show results if election is finished or user is admin
-    if not (election.is_finished or request.user.is_staff):
+    election = get_election_or_404(election_id)
+    
+    if election.is_finished:
+        final_results = closing_results(election)
+        return render(request, 'voting_app/election_results.html', final_results)
+    
+    # Only show live results to admins while the election is not finished
+    if not request.user.is_staff:
         messages.error(request, 'Results are not yet available for this election.')
         return redirect('election_detail', pk=election_id)
     
-    # Get candidates with vote counts and percentages
-    candidates = election.candidates.annotate(
-        vote_count=Count('votes')
-    ).order_by('-vote_count')
+    # Get candidates with vote counts and percentages from the tally store
+    candidates = list(
+        election.candidates.select_related('tally').order_by('-tally__votes', 'name')
+    )
     
-    total_votes = election.total_votes
+    total_votes = sum(candidate.vote_count for candidate in candidates)
+    election.total_votes = total_votes
     
     # Calculate percentages
     for candidate in candidates:
-        candidate.percentage = (candidate.vote_count / total_votes * 100) if total_votes > 0 else 0
+        candidate.percentage = round(candidate.vote_count / total_votes * 100, 2) if total_votes > 0 else 0
     
     context = {
         'election': election,
+        'organizer': election.created_by.get_full_name() or election.created_by.username,
         'candidates': candidates,
         'total_votes': total_votes,
     }
@@ -233,6 +252,9 @@ def admin_dashboard(request):
     recent_votes = Vote.objects.select_related('voter', 'candidate', 'election').order_by('-timestamp')[:10]
     recent_registrations = UserProfile.objects.select_related('user').order_by('-created_at')[:10]
     
+    # Eligible voters and turnout of the active elections (two queries in all)
+    turnout = eligibility.turnout(Election.objects.filter(is_active=True).order_by('-start_time')[:10])
+    
     context = {
         'total_elections': total_elections,
         'active_elections': active_elections,
@@ -240,6 +262,7 @@ def admin_dashboard(request):
         'total_votes': total_votes,
         'recent_votes': recent_votes,
         'recent_registrations': recent_registrations,
+        'turnout': turnout,
     }
     
     return render(request, 'voting_app/admin_dashboard.html', context)
@@ -318,23 +341,132 @@ def delete_candidate(request, candidate_id):
     return redirect('manage_candidates', election_id=election_id)
 
 
+def _export_response(request, kind):
+    """Stream an export filtered by the election, since, until and action query parameters"""
+    params = request.GET
+    format = params.get('format', 'csv')
+    compress = params.get('gzip') in ('1', 'true', 'yes')
+    election = params.get('election') or None
+    try:
+        if election is not None and not election.isdigit():
+            raise ExportError("election must be an election id.")
+        queryset = export_queryset(
+            kind,
+            election=election,
+            since=parse_moment(params['since']) if params.get('since') else None,
+            until=parse_moment(params['until'], end_of_day=True) if params.get('until') else None,
+            action=params.get('action') or None,
+        )
+        content = stream_export(queryset, format=format, compress=compress)
+    except ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    if isinstance(request, ASGIRequest):
+        content = astream(content)
+    
+    log_audit(request.user, 'DATA_EXPORTED', f'Exported {kind} ({request.GET.urlencode()})', request)
+    
+    response = StreamingHttpResponse(
+        content,
+        content_type='application/gzip' if compress else FORMATS[format][0]
+    )
+    filename = export_filename(kind, format, compress, election)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@user_passes_test(is_staff)
+def export_votes(request):
+    """Download all votes as CSV or NDJSON"""
+    return _export_response(request, 'votes')
+
+
+@user_passes_test(is_staff)
+def export_audit_log(request):
+    """Download the audit log as CSV or NDJSON"""
+    return _export_response(request, 'audit')
+
+
+def prometheus_metrics(request):
+    """Counters and histograms of all worker processes in the Prometheus text format"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    
+    db_pool.publish(force=True)
+    now = timezone.now()
+    open_elections = Election.objects.filter(is_active=True, start_time__lte=now, end_time__gte=now).count()
+    ratio = metrics.cache_hit_ratio()
+    extra = [('voting_elections_open', 'gauge', "Active elections currently accepting votes", open_elections)]
+    if ratio is not None:
+        extra.append(('voting_cache_hit_ratio', 'gauge', "Share of cache lookups that hit, all processes", ratio))
+    
+    return HttpResponse(metrics.render(extra), content_type=metrics.CONTENT_TYPE)
+
+
 # API endpoints for AJAX requests
 
+@replica_reads
 @login_required
 def api_election_status(request, election_id):
     """Get election status via API"""
-    election = get_object_or_404(Election, id=election_id)
-    
-    data = {
-        'is_ongoing': election.is_ongoing,
-        'is_upcoming': election.is_upcoming,
-        'is_finished': election.is_finished,
-        'total_votes': election.total_votes,
-        'time_left': None,
-    }
-    
-    if election.is_ongoing:
-        time_left = election.end_time - timezone.now()
-        data['time_left'] = int(time_left.total_seconds())
+    try:
+        data = compute_status(election_id)
+    except Election.DoesNotExist:
+        raise Http404("No Election matches the given query.")
     
     return JsonResponse(data)
+
+
+@login_required
+async def api_election_stream(request, election_id):
+    """Stream election status via Server-Sent Events (requires ASGI)"""
+    if not isinstance(request, ASGIRequest):
+        # WSGI would drain the endless stream into memory and hold the worker forever
+        return HttpResponse(
+            "Live updates need the ASGI server; poll the status API instead.",
+            status=501, content_type='text/plain; charset=utf-8',
+        )
+    if not await Election.objects.filter(id=election_id).aexists():
+        raise Http404("No Election matches the given query.")
+    
+    response = StreamingHttpResponse(broadcaster.stream(election_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+
+@replica_reads
+@login_required
+def api_election_results(request, election_id):
+    """Get final results of a finished election via API"""
+    final_results = get_final_results(election_id)
+    if final_results is None:
+        election = get_object_or_404(Election, id=election_id)
+        if not election.is_finished:
+            return JsonResponse({'error': 'Results are not yet available for this election.'}, status=403)
+        final_results = closing_results(election)
+    
+    return JsonResponse({
+        'election_id': final_results['election']['id'],
+        'total_votes': final_results['total_votes'],
+        'candidates': [
+            {
+                'id': candidate['id'],
+                'name': candidate['name'],
+                'party': candidate['party'],
+                'vote_count': candidate['vote_count'],
+                'percentage': candidate['percentage'],
+            }
+            for candidate in final_results['candidates']
+        ],
+    })
+
+
+@login_required
+def api_ledger_proof(request, election_id, receipt):
+    """Inclusion proof of a vote receipt in the election's ledger"""
+    proof = ledger.inclusion_proof(election_id, receipt.lower())
+    if proof is None:
+        get_object_or_404(Election, id=election_id)
+        return JsonResponse({'error': 'This receipt is not in the ledger (yet).'}, status=404)
+    return JsonResponse(proof)
@@ -0,0 +1,228 @@
+"""
+Per-election "has voted" index.
+
+Each process keeps one bitmap per election, indexed by user id: bit n is set
+once user n has voted. The election detail page uses it for can_vote and
+cast_ballot refuses a repeat submission (double click, retry, bot) before
+resolving the ballot, both without a Vote query.
+
+Memory is one bit per user id up to the highest id that voted, whatever the
+turnout: 125,000 bytes (122 KiB) per election for a million user ids, plus
+at most one GROWTH_BYTES chunk of slack. A Bloom filter would need about
+1.2 MB per million voters for a 1% false positive rate; user ids are dense
+integers, so the exact bitmap is both smaller and free of false positives.
+
+A bitmap is built from the Vote table the first time a process needs it
+(for 1M votes a single streamed query) and then updated as this process
+casts or deletes votes. Votes recorded by other processes are picked up
+through the election's vote total, which the detail page reads from the
+tally store anyway:
+
+    bitmap count >= total  the bitmap is complete: a clear bit means "not voted".
+                           It may hold more votes than the total, which was
+                           read before votes that were committed since
+    bitmap count <  total  load the votes with a higher id than the last one
+                           seen; rebuild only if that does not close the gap
+                           (ids committed out of order)
+
+Deletions are the one thing the total cannot reveal reliably while votes
+come in, so deleting a vote bumps a per-election epoch in the shared cache,
+and a bitmap built under an older epoch is rebuilt. cast_ballot checks the
+epoch before trusting a set bit, and the detail page confirms a set bit with
+the Vote row it needs for display anyway. With a per-process default cache
+(LocMem, i.e. no REDIS_URL) only the worker that deleted the vote sees the
+epoch move, so cast_ballot then confirms a set bit with an indexed EXISTS
+query before refusing the ballot; a stale bit is cleared.
+
+Settings:
+    VOTER_INDEX_ENABLED  Use the index at all (default True). TestCase rolls back
+                         votes this process has already indexed; tests turn it off
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .entity_cache import shared_backend
+from .models import Vote
+from .routing import use_primary
+
+KEY_PREFIX = 'voted'
+
+# Bitmaps grow in chunks of this many bytes (32,768 user ids)
+GROWTH_BYTES = 4096
+
+
+def _enabled():
+    return getattr(settings, 'VOTER_INDEX_ENABLED', True)
+
+
+class VoterBitmap:
+    """Set of user ids, one bit per id"""
+
+    def __init__(self, epoch=0):
+        self.bits = bytearray()
+        self.count = 0
+        self.last_vote_id = 0
+        self.epoch = epoch
+
+    def __contains__(self, user_id):
+        index = user_id >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (user_id & 7)))
+
+    def add(self, user_id, vote_id=0):
+        index = user_id >> 3
+        if index >= len(self.bits):
+            size = (index // GROWTH_BYTES + 1) * GROWTH_BYTES
+            # A new exact-size buffer: extend() would over-allocate by an eighth
+            self.bits = self.bits + bytes(size - len(self.bits))
+        mask = 1 << (user_id & 7)
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.count += 1
+        self.last_vote_id = max(self.last_vote_id, vote_id)
+
+    def discard(self, user_id):
+        if user_id in self:
+            self.bits[user_id >> 3] &= ~(1 << (user_id & 7)) & 0xFF
+            self.count -= 1
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+_lock = threading.Lock()
+_bitmaps = {}
+
+
+def _epoch_key(election_id):
+    return f'{KEY_PREFIX}:{election_id}:epoch'
+
+
+def _votes(election_id, after=0):
+    """(vote id, voter id) of an election's votes with an id above `after`"""
+    votes = Vote.objects.filter(election_id=election_id, pk__gt=after).values_list('pk', 'voter_id')
+    return votes.iterator(chunk_size=10000)
+
+
+def build(election_id):
+    """(Re)build the bitmap of an election from the Vote table"""
+    bitmap = VoterBitmap(cache.get(_epoch_key(election_id), 0))
+    with use_primary():
+        for vote_id, voter_id in _votes(election_id):
+            bitmap.add(voter_id, vote_id)
+    with _lock:
+        _bitmaps[election_id] = bitmap
+    return bitmap
+
+
+def _catch_up(election_id, bitmap, total):
+    """Load the votes cast since the bitmap was last updated, until it holds at least `total`"""
+    with use_primary():
+        votes = list(_votes(election_id, bitmap.last_vote_id))
+    with _lock:
+        for vote_id, voter_id in votes:
+            bitmap.add(voter_id, vote_id)
+    if bitmap.count < total:
+        # A vote with a lower id than the last one seen committed late: start over
+        bitmap = build(election_id)
+    return bitmap
+
+
+def has_voted(election_id, user_id, total):
+    """
+    Whether a user voted in an election with `total` votes (from the tally
+    store), or None when the index is off. May query the Vote table to
+    build or refresh the bitmap.
+    """
+    if not _enabled():
+        return None
+    bitmap = _bitmaps.get(election_id)
+    if bitmap is None or bitmap.epoch != cache.get(_epoch_key(election_id), 0):
+        bitmap = build(election_id)
+    elif bitmap.count < total:
+        bitmap = _catch_up(election_id, bitmap, total)
+    return user_id in bitmap
+
+
+async def ahas_voted(election_id, user_id, total):
+    """Async counterpart of has_voted"""
+    if not _enabled():
+        return None
+    bitmap = _bitmaps.get(election_id)
+    if (
+        bitmap is not None and bitmap.count >= total
+        and bitmap.epoch == await cache.aget(_epoch_key(election_id), 0)
+    ):
+        return user_id in bitmap
+    return await sync_to_async(has_voted)(election_id, user_id, total)
+
+
+def known_voter(election_id, user_id):
+    """
+    True if this process knows the user voted in the election; a False
+    answer means "not known". Only queries the database to confirm a set
+    bit when deletions in other workers cannot be seen (per-process cache).
+    """
+    if not _enabled():
+        return False
+    bitmap = _bitmaps.get(election_id)
+    if bitmap is None or user_id not in bitmap:
+        return False
+    if cache.get(_epoch_key(election_id), 0) != bitmap.epoch:
+        # A vote was deleted by another process since the bitmap was built
+        with _lock:
+            _bitmaps.pop(election_id, None)
+        return False
+    if not shared_backend():
+        with use_primary():
+            voted = Vote.objects.filter(election_id=election_id, voter_id=user_id).exists()
+        if not voted:
+            forget(election_id, user_id)
+        return voted
+    return True
+
+
+def mark(election_id, user_id, vote_id=0):
+    """Record a vote in the bitmap of the election, if this process has one"""
+    with _lock:
+        bitmap = _bitmaps.get(election_id)
+        if bitmap is not None:
+            bitmap.add(user_id, vote_id)
+
+
+def forget(election_id, user_id):
+    """Clear a user's bit, e.g. after the Vote row turned out to be gone"""
+    with _lock:
+        bitmap = _bitmaps.get(election_id)
+        if bitmap is not None:
+            bitmap.discard(user_id)
+
+
+def vote_deleted(vote):
+    """Drop a deleted vote here and, once committed, have other processes stop trusting their bitmaps"""
+    forget(vote.election_id, vote.voter_id)
+
+    def bump_epoch():
+        key = _epoch_key(vote.election_id)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted in between
+            cache.set(key, 1, None)
+    transaction.on_commit(bump_epoch)
+
+
+def stats():
+    """{election_id: (voters, bytes)} of the bitmaps in this process"""
+    with _lock:
+        return {election_id: (bitmap.count, bitmap.memory_bytes) for election_id, bitmap in _bitmaps.items()}
+
+
+def clear():
+    with _lock:
+        _bitmaps.clear()
@@ -0,0 +1,120 @@
+"""
+Streamlined vote casting.
+
+A ballot is resolved with a single query (candidate, its election and the
+voter's eligibility) and inserted relying on the unique (voter, election)
+constraint instead of checking for an existing vote first. Where the
+database supports it the insert uses ON CONFLICT DO NOTHING, so a duplicate
+neither raises nor aborts the transaction.
+
+Query budget for an accepted vote: resolve (1) + insert (1) + tally (1).
+A repeat submission from a voter this process has seen vote (voter_index.py)
+is refused without a query. Accepted votes carry their ledger receipt
+(ledger.py); they are sealed into the ledger later, in batches.
+"""
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Subquery
+
+from .models import Candidate, UserProfile, Vote
+from . import eligibility, ledger, metrics, tallies, voter_index
+
+
+class VoteRejected(ValidationError):
+    """Raised when a ballot cannot be accepted; ``code`` names the reason"""
+
+
+def resolve_ballot(user, election_id, candidate_id):
+    """Load the candidate, its election and the voter's eligibility flag and birth date in one query"""
+    if not candidate_id:
+        raise VoteRejected("Please select a candidate.", code='no_candidate')
+
+    profile = UserProfile.objects.filter(user_id=user.pk)
+    try:
+        return Candidate.objects.select_related('election').annotate(
+            voter_eligible=Subquery(profile.values('is_eligible')[:1]),
+            voter_born=Subquery(profile.values('date_of_birth')[:1]),
+        ).get(pk=candidate_id, election_id=election_id)
+    except (Candidate.DoesNotExist, ValueError, TypeError):
+        raise VoteRejected("Please select a valid candidate.", code='invalid_candidate')
+
+
+def insert_vote(vote):
+    """
+    Insert a vote unless the voter already voted in the election.
+
+    Returns True if the row was inserted, False on a (voter, election) conflict.
+    """
+    opts = Vote._meta
+    fields = [field for field in opts.concrete_fields if not field.primary_key]
+    features = connection.features
+
+    if not (features.supports_update_conflicts_with_target and features.can_return_columns_from_insert):
+        try:
+            with transaction.atomic():
+                vote.save(force_insert=True)
+        except IntegrityError:
+            return False
+        return True
+
+    quote = connection.ops.quote_name
+    values = [field.get_db_prep_save(field.pre_save(vote, True), connection) for field in fields]
+    sql = 'INSERT INTO {table} ({columns}) VALUES ({params}) ON CONFLICT ({target}) DO NOTHING RETURNING {pk}'.format(
+        table=quote(opts.db_table),
+        columns=', '.join(quote(field.column) for field in fields),
+        params=', '.join(['%s'] * len(fields)),
+        target=', '.join(quote(opts.get_field(name).column) for name in ('voter', 'election')),
+        pk=quote(opts.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        row = cursor.fetchone()
+    if row is None:
+        return False
+
+    vote.pk = row[0]
+    vote._state.adding = False
+    vote._state.db = connection.alias
+    return True
+
+
+def cast_ballot(user, election_id, candidate_id, ip_address=None):
+    """
+    Validate and record a vote.
+
+    Raises VoteRejected if the ballot is invalid or the voter already voted.
+    """
+    try:
+        return _cast_ballot(user, election_id, candidate_id, ip_address)
+    except VoteRejected as e:
+        metrics.VOTE_REJECTIONS.inc(reason=e.code)
+        raise
+
+
+def _cast_ballot(user, election_id, candidate_id, ip_address):
+    if voter_index.known_voter(election_id, user.pk):
+        raise VoteRejected("You have already voted in this election.", code='already_voted')
+
+    candidate = resolve_ballot(user, election_id, candidate_id)
+    election = candidate.election
+
+    if not election.is_ongoing:
+        raise VoteRejected("Voting is not currently open for this election.", code='not_open')
+
+    if candidate.voter_eligible is False:
+        raise VoteRejected("You are not eligible to vote.", code='ineligible')
+
+    if candidate.voter_born is not None and not eligibility.is_eligible(election, candidate.voter_born):
+        raise VoteRejected(
+            f"You must be at least {election.minimum_voter_age} to vote in this election.", code='underage'
+        )
+
+    vote = ledger.stamp(Vote(voter=user, candidate=candidate, election=election, ip_address=ip_address))
+    with transaction.atomic():
+        if not insert_vote(vote):
+            voter_index.mark(election.pk, user.pk)
+            raise VoteRejected("You have already voted in this election.", code='already_voted')
+        tallies.record_vote(vote)
+        transaction.on_commit(lambda: metrics.VOTES_CAST.inc(election=election.pk))
+        transaction.on_commit(lambda: voter_index.mark(election.pk, user.pk, vote.pk))
+    return vote